@@ -1,19 +1,221 @@
-from db import dal
-from sqlalchemy.sql import select
+try:
+    import numpy
+except ImportError:
+    numpy = None
+from sqlalchemy.sql import and_, distinct, func, or_, select, update
 
+from db import async_dal, dal
+from pagination import Keyset
 
-def get_orders_by_customer(cust_name, shipped=None, details=False):
-    columns = [dal.orders.c.order_id, dal.users.c.username, dal.users.c.phone]
-    joins = dal.users.join(dal.orders)
-    if details:
-        columns.extend([dal.cookies.c.cookie_name,
-                        dal.line_items.c.quantity,
-                        dal.line_items.c.extended_cost])
-        joins = joins.join(dal.line_items).join(dal.cookies)
-    cust_orders = select(columns)
-    cust_orders = cust_orders.select_from(joins).where(
-        dal.users.c.username == cust_name)
+# SQLite builds older than 3.32 reject statements with more than 999 bound
+# parameters; leave room for the shipped flag.
+MAX_NAMES_PER_QUERY = 990
+
+COOKIE_LISTING = Keyset(dal.cookies.c.quantity, dal.cookies.c.cookie_name,
+                        dal.cookies.c.cookie_id)
+
+
+class InsufficientInventory(Exception):
+    """Raised by ship_it when the order asks for more of some cookies
+    than is on hand. ``shortfalls`` holds (cookie_id, cookie_name,
+    on_hand, requested) rows; cookie_name and on_hand are None for
+    cookies that do not exist."""
+
+    def __init__(self, order_id, shortfalls):
+        super(InsufficientInventory, self).__init__(
+            'order {} is short of cookies {}'.format(
+                order_id, [row[0] for row in shortfalls]))
+        self.order_id = order_id
+        self.shortfalls = shortfalls
+
+
+def _orders_by_customer_params(cust_name, shipped, key='cust_name'):
+    params = {key: cust_name}
     if shipped is not None:
-        cust_orders = cust_orders.where(dal.orders.c.shipped == shipped)
-    result = dal.connection.execute(cust_orders).fetchall()
+        params['shipped'] = shipped
+    return params
+
+
+def get_orders_by_customer(cust_name, shipped=None, details=False):
+    cache = dal.result_cache
+    if cache is not None:
+        key = (cust_name, shipped, details)
+        result = cache.get(key)
+        if result is not None:
+            return result
+        token = cache.token(cust_name)
+    cust_orders = dal.orders_by_customer_stmt(shipped, details)
+    params = _orders_by_customer_params(cust_name, shipped)
+    with dal.connect_scope(read_only=True) as conn:
+        result = conn.execute(cust_orders, params).fetchall()
+    if cache is not None:
+        cache.put(key, result, token)
     return result
+
+
+def get_orders_by_customers(cust_names, shipped=None, details=False):
+    cust_names = list(dict.fromkeys(cust_names))
+    results = dict((cust_name, []) for cust_name in cust_names)
+    cust_orders = dal.orders_by_customers_stmt(shipped, details)
+    with dal.connect_scope(read_only=True) as conn:
+        for start in range(0, len(cust_names), MAX_NAMES_PER_QUERY):
+            chunk = cust_names[start:start + MAX_NAMES_PER_QUERY]
+            params = _orders_by_customer_params(chunk, shipped, 'cust_names')
+            for row in conn.execute(cust_orders, params):
+                results[row.username].append(row)
+    return results
+
+
+def iter_orders_by_customer(cust_name, shipped=None, details=False,
+                            batch_size=1000):
+    cust_orders = dal.orders_by_customer_stmt(shipped, details)
+    params = _orders_by_customer_params(cust_name, shipped)
+    conn, release = dal.acquire(read_only=True)
+    try:
+        result = conn.execution_options(stream_results=True).execute(
+            cust_orders, params)
+        try:
+            while True:
+                rows = result.fetchmany(batch_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield row
+        finally:
+            result.close()
+    finally:
+        release()
+
+
+def get_line_item_columns(cust_name, shipped=None, batch_size=10000):
+    if numpy is None:
+        raise ImportError('get_line_item_columns requires numpy')
+    cust_orders = dal.line_item_columns_stmt(shipped)
+    params = _orders_by_customer_params(cust_name, shipped)
+    keys = [column.key for column in cust_orders.columns]
+    dtypes = {'quantity': numpy.int64, 'extended_cost_cents': numpy.int64}
+    chunks = dict((key, []) for key in keys)
+    with dal.connect_scope(read_only=True) as conn:
+        result = conn.execute(cust_orders, params)
+        while True:
+            rows = result.fetchmany(batch_size)
+            if not rows:
+                break
+            for key, values in zip(keys, zip(*rows)):
+                chunks[key].append(numpy.array(values, dtype=dtypes.get(key)))
+    columns = {}
+    for key in keys:
+        if chunks[key]:
+            columns[key] = numpy.concatenate(chunks[key])
+        else:
+            columns[key] = numpy.array([], dtype=dtypes.get(key, str))
+    return columns
+
+
+def _decrement_inventory(conn, order_id):
+    """Take an order's line items out of stock in one UPDATE, touching no
+    cookie unless every cookie in the order has enough on hand."""
+    line_items, cookies = dal.line_items, dal.cookies
+    in_order = line_items.c.order_id == order_id
+    wanted = conn.execute(select([
+        func.count(distinct(line_items.c.cookie_id))]).where(in_order)).scalar()
+    requested = select([func.sum(line_items.c.quantity)]).where(
+        and_(in_order, line_items.c.cookie_id == cookies.c.cookie_id))
+    requested = requested.as_scalar()
+    u = update(cookies).values(quantity=cookies.c.quantity - requested)
+    u = u.where(cookies.c.cookie_id.in_(
+        select([line_items.c.cookie_id]).where(in_order)))
+    u = u.where(cookies.c.quantity >= requested)
+    return conn.execute(u).rowcount == wanted
+
+
+def list_cookies(cursor=None, size=20):
+    """One page of cookies by quantity and name, with the cursor of the
+    next page or None on the last one."""
+    cookies = dal.cookies
+    s = select([cookies.c.cookie_id, cookies.c.cookie_name,
+                cookies.c.quantity])
+    with dal.connect_scope(read_only=True) as conn:
+        return COOKIE_LISTING.page(s, cursor, size, conn=conn)
+
+
+def get_inventory_summary():
+    summary = dal.inventory_summary
+    s = select([summary.c.cookie_count, summary.c.total_quantity])
+    with dal.connect_scope(read_only=True) as conn:
+        return conn.execute(s).first()
+
+
+def get_customer_summary(user_id):
+    """(user_id, username, order_count, lifetime_spend) for one customer,
+    or None. With dal.enable_order_counters() this reads the user's row by
+    primary key; otherwise the counts come from orders and line items."""
+    s = _customer_summaries().where(dal.users.c.user_id == user_id)
+    with dal.connect_scope(read_only=True) as conn:
+        return conn.execute(s).first()
+
+
+def get_customer_summaries():
+    s = _customer_summaries().order_by(dal.users.c.user_id)
+    with dal.connect_scope(read_only=True) as conn:
+        return conn.execute(s).fetchall()
+
+
+def _customer_summaries():
+    users = dal.users
+    if not dal.order_counters:
+        return dal.order_counter_scan()
+    return select([users.c.user_id, users.c.username, users.c.order_count,
+                   users.c.lifetime_spend])
+
+
+def get_shortfalls(order_id):
+    line_items, cookies = dal.line_items, dal.cookies
+    requested = select([
+        line_items.c.cookie_id,
+        func.sum(line_items.c.quantity).label('requested')]).where(
+            line_items.c.order_id == order_id).group_by(
+                line_items.c.cookie_id).alias('requested')
+    s = select([requested.c.cookie_id, cookies.c.cookie_name,
+                cookies.c.quantity, requested.c.requested])
+    s = s.select_from(requested.outerjoin(
+        cookies, cookies.c.cookie_id == requested.c.cookie_id))
+    s = s.where(or_(cookies.c.quantity.is_(None),
+                    cookies.c.quantity < requested.c.requested))
+    with dal.connect_scope() as conn:
+        return conn.execute(s.order_by(requested.c.cookie_id)).fetchall()
+
+
+def ship_it(order_id):
+    with dal.connect_scope() as conn:
+        trans = conn.begin()
+        try:
+            in_stock = _decrement_inventory(conn, order_id)
+            if in_stock:
+                u = update(dal.orders).where(
+                    dal.orders.c.order_id == order_id)
+                conn.execute(u.values(shipped=True))
+                trans.commit()
+            else:
+                trans.rollback()
+        except Exception:
+            trans.rollback()
+            raise
+        if not in_stock:
+            raise InsufficientInventory(order_id, get_shortfalls(order_id))
+
+
+async def get_orders_by_customer_async(cust_name, shipped=None,
+                                       details=False):
+    return await async_dal.run(get_orders_by_customer, cust_name, shipped,
+                               details)
+
+
+async def get_orders_by_customers_async(cust_names, shipped=None,
+                                        details=False):
+    return await async_dal.run(get_orders_by_customers, cust_names, shipped,
+                               details)
+
+
+async def ship_it_async(order_id):
+    await async_dal.run(ship_it, order_id)
@@ -0,0 +1,184 @@
+import time
+import timeit
+import tracemalloc
+
+import numpy
+
+from sqlalchemy import Column, Integer, MetaData, Numeric, Table
+from sqlalchemy.sql import select
+
+from db import dal, prep_db
+from money import Money
+from app import (get_orders_by_customer, get_orders_by_customers,
+                 get_line_item_columns, get_customer_summary)
+
+
+def get_orders_by_customer_uncached(conn, cust_name, shipped=None,
+                                    details=False):
+    columns = [dal.orders.c.order_id, dal.users.c.username, dal.users.c.phone]
+    joins = dal.users.join(dal.orders)
+    if details:
+        columns.extend([dal.cookies.c.cookie_name,
+                        dal.line_items.c.quantity,
+                        dal.line_items.c.extended_cost])
+        joins = joins.join(dal.line_items).join(dal.cookies)
+    cust_orders = select(columns)
+    cust_orders = cust_orders.select_from(joins).where(
+        dal.users.c.username == cust_name)
+    if shipped is not None:
+        cust_orders = cust_orders.where(dal.orders.c.shipped == shipped)
+    return conn.execute(cust_orders).fetchall()
+
+
+def report(label, func, number):
+    seconds = min(timeit.repeat(func, number=number, repeat=3))
+    print('{:<40} {:>10.0f} calls/s'.format(label, number / seconds))
+
+
+def bench_statement_cache(number=2000):
+    conn = dal.engine.connect()
+    shared_connection = dal.connection
+    dal.connection = conn.execution_options(compiled_cache=dal.compiled_cache)
+    for shipped in (None, True, False):
+        for details in (False, True):
+            label = 'shipped={}, details={}'.format(shipped, details)
+            report('uncached ' + label,
+                   lambda: get_orders_by_customer_uncached(
+                       conn, 'cookiemon', shipped, details), number)
+            report('cached   ' + label,
+                   lambda: get_orders_by_customer(
+                       'cookiemon', shipped, details), number)
+    dal.connection = shared_connection
+    conn.close()
+
+
+def seed_customers(count):
+    dal.connection.execute(dal.users.insert(), [
+        {'username': 'bench{}'.format(i),
+         'email_address': 'bench{}@cookie.com'.format(i),
+         'phone': '555-555-5555', 'password': 'password'}
+        for i in range(count)])
+    user_ids = dict(dal.connection.execute(
+        select([dal.users.c.username, dal.users.c.user_id])).fetchall())
+    dal.connection.execute(dal.orders.insert(), [
+        {'order_id': 10000 + i,
+         'user_id': user_ids['bench{}'.format(i)]} for i in range(count)])
+    dal.connection.execute(dal.line_items.insert(), [
+        {'order_id': 10000 + i, 'cookie_id': 1 + i % 2, 'quantity': 2,
+         'extended_cost': 1.00} for i in range(count)])
+    return ['bench{}'.format(i) for i in range(count)]
+
+
+def bench_batched_lookup(names, number=20):
+    for details in (False, True):
+        label = 'details={}'.format(details)
+        report('per-name loop ' + label,
+               lambda: [get_orders_by_customer(name, details=details)
+                        for name in names], number)
+        report('batched       ' + label,
+               lambda: get_orders_by_customers(names, details=details),
+               number)
+
+
+def seed_wholesale(count):
+    dal.connection.execute(dal.users.insert(), {
+        'username': 'wholesale', 'email_address': 'bulk@cookie.com',
+        'phone': '555-555-5555', 'password': 'password'})
+    user_id = dal.connection.execute(select([dal.users.c.user_id]).where(
+        dal.users.c.username == 'wholesale')).scalar()
+    dal.connection.execute(dal.orders.insert(),
+                           {'order_id': 99999, 'user_id': user_id})
+    dal.connection.execute(dal.line_items.insert(), [
+        {'order_id': 99999, 'cookie_id': 1 + i % 3, 'quantity': 1 + i % 12,
+         'extended_cost': (1 + i % 12) * 0.25} for i in range(count)])
+
+
+def aggregate_rows():
+    rows = get_orders_by_customer('wholesale', details=True)
+    totals = {}
+    for row in rows:
+        totals[row.cookie_name] = (totals.get(row.cookie_name, 0) +
+                                   row.extended_cost)
+    return sum(row.extended_cost for row in rows), totals
+
+
+def aggregate_columns():
+    columns = get_line_item_columns('wholesale')
+    cents = columns['extended_cost_cents']
+    names, index = numpy.unique(columns['cookie_name'], return_inverse=True)
+    return cents.sum(), dict(zip(names, numpy.bincount(index, weights=cents)))
+
+
+def bench_columnar():
+    for label, fetch, aggregate in (
+            ('row list', lambda: get_orders_by_customer(
+                'wholesale', details=True), aggregate_rows),
+            ('columnar', lambda: get_line_item_columns('wholesale'),
+             aggregate_columns)):
+        tracemalloc.start()
+        result = fetch()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        del result
+        start = time.time()
+        aggregate()
+        seconds = time.time() - start
+        print('{:<10} peak {:>8.1f} MiB  fetch+aggregate {:>7.3f} s'.format(
+            label, peak / 2.0 ** 20, seconds))
+
+
+def bench_money(count=200000):
+    """Fetch and total the same costs stored as Numeric(12, 2) and as
+    Money; 0.10 has no exact binary form, so the Numeric total of the
+    stored floats drifts unless every row goes through Decimal."""
+    metadata = MetaData()
+    tables = [Table('costs_' + name, metadata,
+                    Column('cost_id', Integer, primary_key=True),
+                    Column('cost', coltype))
+              for name, coltype in (('numeric', Numeric(12, 2)),
+                                    ('money', Money()))]
+    metadata.create_all(dal.engine)
+    for table in tables:
+        dal.connection.execute(table.insert(), [
+            {'cost': '0.10'} for i in range(count)])
+        query = select([table.c.cost])
+        start = time.time()
+        rows = dal.connection.execute(query).fetchall()
+        seconds = time.time() - start
+        del rows
+        tracemalloc.start()
+        rows = dal.connection.execute(query).fetchall()
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        total = sum(row.cost for row in rows)
+        float_total = dal.connection.execute(
+            'SELECT SUM(cost) FROM {}'.format(table.name)).scalar()
+        print('{:<14} fetch {:>7.3f} s {:>5.0f} bytes/row  total {}  '
+              'SQL SUM {}'.format(table.name, seconds, size / count, total,
+                                 float_total))
+        del rows
+
+
+def bench_customer_summary(number=20):
+    user_id = dal.connection.execute(select([dal.users.c.user_id]).where(
+        dal.users.c.username == 'wholesale')).scalar()
+    dal.connection.execute(dal.orders.update().where(
+        dal.orders.c.order_id == 99999).values(shipped=True))
+    report('customer summary scan', lambda: get_customer_summary(user_id),
+           number)
+    start = time.time()
+    dal.enable_order_counters()
+    print('enable_order_counters {:.3f} s'.format(time.time() - start))
+    report('customer summary counters',
+           lambda: get_customer_summary(user_id), number)
+
+
+if __name__ == '__main__':
+    dal.db_init('sqlite:///:memory:')
+    prep_db()
+    bench_statement_cache()
+    bench_batched_lookup(seed_customers(500))
+    seed_wholesale(200000)
+    bench_columnar()
+    bench_customer_summary()
+    bench_money()
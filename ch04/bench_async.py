@@ -0,0 +1,66 @@
+import asyncio
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from db import async_dal, dal
+from loader import bulk_load
+from app import get_orders_by_customer_async
+
+
+def seed(count):
+    bulk_load(
+        dal,
+        cookies=[{'cookie_name': 'chocolate chip', 'cookie_sku': 'CC01',
+                  'quantity': 100, 'unit_cost': 0.50}],
+        users=({'username': 'user{}'.format(i),
+                'email_address': 'user{}@cookie.com'.format(i),
+                'phone': '555-555-5555', 'password': 'password'}
+               for i in range(count)),
+        orders=({'order_id': i, 'username': 'user{}'.format(i)}
+                for i in range(count)),
+        line_items=({'order_id': i, 'cookie_sku': 'CC01', 'quantity': 2,
+                     'extended_cost': 1.00} for i in range(count)))
+
+
+async def load_test(customers, requests, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def lookup(i):
+        async with semaphore:
+            start = time.time()
+            await get_orders_by_customer_async(
+                'user{}'.format(i % customers), details=True)
+            latencies.append(time.time() - start)
+
+    start = time.time()
+    await asyncio.gather(*[lookup(i) for i in range(requests)])
+    seconds = time.time() - start
+    latencies.sort()
+    print('concurrency={:<4} {:>8.0f} lookups/s  p50={:.2f} ms  '
+          'p99={:.2f} ms'.format(
+              concurrency, requests / seconds,
+              latencies[len(latencies) // 2] * 1000,
+              latencies[int(len(latencies) * 0.99)] * 1000))
+
+
+async def main(customers=10000, requests=5000):
+    tmpdir = tempfile.mkdtemp()
+    try:
+        await async_dal.db_init(
+            'sqlite:///' + os.path.join(tmpdir, 'async.db'),
+            pool_size=8, max_overflow=8)
+        await async_dal.run(seed, customers)
+        for concurrency in (1, 8, 64, 256):
+            await load_test(customers, requests, concurrency)
+        print(dal.pool_stats())
+        await async_dal.close()
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    asyncio.run(main(*[int(arg) for arg in sys.argv[1:]]))
@@ -0,0 +1,81 @@
+import csv
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from db import DataAccessLayer
+from loader import read_records, load_files
+
+
+def write_files(tmpdir, count):
+    paths = {name: os.path.join(tmpdir, name + ext) for name, ext in (
+        ('cookies', '.csv'), ('users', '.ndjson'), ('orders', '.ndjson'),
+        ('line_items', '.csv'))}
+    skus = max(count // 100, 1)
+    with open(paths['cookies'], 'w', newline='') as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(['cookie_name', 'cookie_sku', 'quantity', 'unit_cost'])
+        for i in range(skus):
+            writer.writerow(['cookie {}'.format(i), 'SKU{}'.format(i), 100,
+                             '0.50'])
+    with open(paths['users'], 'w') as users, \
+            open(paths['orders'], 'w') as orders:
+        for i in range(count):
+            users.write(json.dumps({
+                'username': 'user{}'.format(i),
+                'email_address': 'user{}@cookie.com'.format(i),
+                'phone': '555-555-5555', 'password': 'password'}) + '\n')
+            orders.write(json.dumps({
+                'order_id': i, 'username': 'user{}'.format(i)}) + '\n')
+    with open(paths['line_items'], 'w', newline='') as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(['order_id', 'cookie_sku', 'quantity',
+                         'extended_cost'])
+        for i in range(count):
+            for j in range(2):
+                writer.writerow([i, 'SKU{}'.format((i + j) % skus), 2, '1.00'])
+    return paths
+
+
+def row_by_row(dal, paths):
+    conn = dal.connection
+    user_ids, cookie_ids = {}, {}
+    for record in read_records(paths['cookies']):
+        result = conn.execute(dal.cookies.insert(), record)
+        cookie_ids[record['cookie_sku']] = result.inserted_primary_key[0]
+    for record in read_records(paths['users']):
+        result = conn.execute(dal.users.insert(), record)
+        user_ids[record['username']] = result.inserted_primary_key[0]
+    for record in read_records(paths['orders']):
+        record['user_id'] = user_ids[record.pop('username')]
+        conn.execute(dal.orders.insert(), record)
+    for record in read_records(paths['line_items']):
+        record['cookie_id'] = cookie_ids[record.pop('cookie_sku')]
+        conn.execute(dal.line_items.insert(), record)
+
+
+def bench(label, loader, count):
+    tmpdir = tempfile.mkdtemp()
+    try:
+        paths = write_files(tmpdir, count)
+        dal = DataAccessLayer()
+        dal.db_init('sqlite:///' + os.path.join(tmpdir, 'bench.db'))
+        start = time.time()
+        loader(dal, paths)
+        seconds = time.time() - start
+        rows = count * 4 + max(count // 100, 1)
+        print('{:<12} {:>9} rows {:>8.2f} s {:>10.0f} rows/s'.format(
+            label, rows, seconds, rows / seconds))
+        dal.connection.close()
+        dal.engine.dispose()
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    bench('row-by-row', row_by_row, min(count, 1000))
+    bench('bulk_load', load_files, count)
@@ -0,0 +1,65 @@
+import timeit
+
+from sqlalchemy.sql import select
+
+from db import dal, prep_db
+from app import COOKIE_LISTING, list_cookies
+
+
+def report(label, func, number):
+    seconds = min(timeit.repeat(func, number=number, repeat=3))
+    print('{:<40} {:>10.3f} ms/page'.format(label, seconds / number * 1000))
+
+
+def seed_cookies(count):
+    dal.connection.execute(dal.cookies.insert(), [
+        {'cookie_name': 'cookie {}'.format(i), 'cookie_sku': str(i),
+         'quantity': i % 1000, 'unit_cost': 0.50} for i in range(count)])
+
+
+def listing():
+    cookies = dal.cookies
+    return select([cookies.c.cookie_id, cookies.c.cookie_name,
+                   cookies.c.quantity])
+
+
+def offset_page(page, size):
+    cookies = dal.cookies
+    s = listing().order_by(cookies.c.quantity, cookies.c.cookie_name,
+                           cookies.c.cookie_id)
+    s = s.limit(size).offset((page - 1) * size)
+    return dal.connection.execute(s).fetchall()
+
+
+def cursor_before(page, size):
+    """The cursor a client would hold after walking to ``page``."""
+    if page == 1:
+        return None
+    return COOKIE_LISTING.cursor(offset_page(page - 1, size)[-1])
+
+
+def explain(s):
+    compiled = s.compile(dal.engine)
+    params = [compiled.params[name] for name in compiled.positiontup]
+    for row in dal.connection.execute(
+            'EXPLAIN QUERY PLAN ' + str(compiled), params):
+        print('    {}'.format(row[-1]))
+
+
+def bench_pages(pages=(1, 100, 10000), size=20, number=20):
+    for page in pages:
+        cursor = cursor_before(page, size)
+        assert list_cookies(cursor, size).rows == offset_page(page, size)
+        report('offset page {}'.format(page),
+               lambda: offset_page(page, size), number)
+        report('keyset page {}'.format(page),
+               lambda: list_cookies(cursor, size), number)
+    print('keyset plan:')
+    explain(COOKIE_LISTING.paginate(listing(), cursor, size))
+
+
+if __name__ == '__main__':
+    dal.db_init('sqlite:///:memory:')
+    prep_db()
+    seed_cookies(250000)
+    bench_pages()
@@ -0,0 +1,267 @@
+import re
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import event
+from sqlalchemy.sql import select
+from sqlalchemy.sql.dml import Delete, Insert, Update, UpdateBase
+
+
+class ResultCache(object):
+    """LRU cache of order lookups keyed on (cust_name, shipped, details),
+    bounded by entry count, age and an estimated memory budget."""
+
+    def __init__(self, max_entries=1024, ttl=60, max_bytes=16 * 1024 * 1024,
+                 clock=time.time):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.clock = clock
+        self.size = 0
+        self._entries = OrderedDict()
+        self._keys_by_name = {}
+        self._generations = {}
+        self._generation = 0
+        self._lock = threading.Lock()
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0,
+                      'expirations': 0, 'invalidations': 0}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= self.clock():
+                self._remove(key)
+                self.stats['expirations'] += 1
+                entry = None
+            if entry is None:
+                self.stats['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats['hits'] += 1
+            return list(entry[2])
+
+    def token(self, cust_name):
+        with self._lock:
+            return self._generation, self._generations.get(cust_name, 0)
+
+    def put(self, key, rows, token):
+        size = _sizeof(rows)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if token != (self._generation, self._generations.get(key[0], 0)):
+                return
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (self.clock() + self.ttl, size, list(rows))
+            self._keys_by_name.setdefault(key[0], set()).add(key)
+            self.size += size
+            while (len(self._entries) > self.max_entries or
+                   self.size > self.max_bytes):
+                self._remove(next(iter(self._entries)))
+                self.stats['evictions'] += 1
+
+    def invalidate(self, cust_names):
+        with self._lock:
+            for cust_name in cust_names:
+                self._generations[cust_name] = (
+                    self._generations.get(cust_name, 0) + 1)
+                for key in list(self._keys_by_name.get(cust_name, ())):
+                    self._remove(key)
+                    self.stats['invalidations'] += 1
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._generations.clear()
+            self.stats['invalidations'] += len(self._entries)
+            self._entries.clear()
+            self._keys_by_name.clear()
+            self.size = 0
+
+    def _remove(self, key):
+        expires, size, rows = self._entries.pop(key)
+        self.size -= size
+        keys = self._keys_by_name.get(key[0])
+        keys.discard(key)
+        if not keys:
+            del self._keys_by_name[key[0]]
+
+
+def _sizeof(rows):
+    return sys.getsizeof(rows) + sum(
+        sys.getsizeof(row) + sum(sys.getsizeof(value) for value in row)
+        for row in rows)
+
+
+_TEXT_WRITE = re.compile(r'^\s*(insert|update|delete|replace)\b', re.I)
+
+
+class WriteWatcher(object):
+    """Works out which customers a write touches from engine execution
+    events, which see Core statements and ORM flushes alike, and
+    invalidates their cached lookups after the statement runs and again
+    when its transaction ends."""
+
+    PENDING = 'result_cache_pending'
+
+    def __init__(self, cache, users, orders, line_items, cookies):
+        self.cache = cache
+        self.users = users
+        self.orders = orders
+        self.line_items = line_items
+        self.cookies = cookies
+
+    def listen(self, engine):
+        event.listen(engine, 'before_execute', self.before_execute)
+        event.listen(engine, 'after_execute', self.after_execute)
+        event.listen(engine, 'commit', self.end_transaction)
+        event.listen(engine, 'rollback', self.end_transaction)
+
+    def before_execute(self, conn, clauseelement, multiparams, params):
+        if isinstance(clauseelement, UpdateBase):
+            names = self.affected_names(conn, clauseelement,
+                                        _param_sets(multiparams, params))
+        elif (isinstance(clauseelement, str) or
+                hasattr(clauseelement, 'text')):
+            sql = getattr(clauseelement, 'text', clauseelement)
+            names = None if _TEXT_WRITE.match(sql) else set()
+        else:
+            return
+        pending = conn.info.setdefault(self.PENDING, set())
+        if names is None:
+            pending.add(None)
+        else:
+            pending.update(names)
+
+    def after_execute(self, conn, clauseelement, multiparams, params, result):
+        if (isinstance(clauseelement, (UpdateBase, str)) or
+                hasattr(clauseelement, 'text')):
+            self._flush(conn, keep=True)
+
+    def end_transaction(self, conn):
+        self._flush(conn, keep=False)
+
+    def _flush(self, conn, keep):
+        pending = conn.info.get(self.PENDING)
+        if not pending:
+            return
+        if None in pending:
+            self.cache.clear()
+        else:
+            self.cache.invalidate(pending)
+        if not keep:
+            pending.clear()
+
+    def affected_names(self, conn, stmt, param_sets):
+        """Return the usernames whose lookups ``stmt`` may change, or None
+        when that cannot be worked out and the whole cache must go."""
+        table = stmt.table
+        if table not in (self.users, self.orders, self.line_items,
+                         self.cookies):
+            return set()
+        if param_sets is None:
+            return None
+        value_sets = _value_sets(stmt, param_sets)
+        if table is self.cookies:
+            if isinstance(stmt, Insert):
+                return set()
+            if isinstance(stmt, Update) and not any(
+                    'cookie_name' in values or 'cookie_id' in values
+                    for values in value_sets):
+                return set()
+            return None
+        key = {self.users: 'username', self.orders: 'user_id',
+               self.line_items: 'order_id'}[table]
+        new_values = _plain_values(value_sets, key)
+        if new_values is None:
+            return None
+        user_ids, names = set(), set()
+        if table is self.users:
+            names.update(new_values)
+            if isinstance(stmt, Insert):
+                return names
+            query = select([self.users.c.username])
+        elif table is self.orders:
+            user_ids.update(new_values)
+            if isinstance(stmt, Insert):
+                return self.usernames(conn, user_ids)
+            query = select([self.orders.c.user_id])
+        else:
+            if new_values:
+                user_ids.update(row[0] for row in conn.execute(
+                    select([self.orders.c.user_id]).where(
+                        self.orders.c.order_id.in_(new_values))))
+            if isinstance(stmt, Insert):
+                return self.usernames(conn, user_ids)
+            query = select([self.orders.c.user_id]).select_from(
+                self.line_items.join(self.orders))
+        if stmt._whereclause is None:
+            return None
+        query = query.where(stmt._whereclause)
+        for param_set in param_sets:
+            for row in conn.execute(query, param_set):
+                if table is self.users:
+                    names.add(row[0])
+                else:
+                    user_ids.add(row[0])
+        return names | self.usernames(conn, user_ids)
+
+    def usernames(self, conn, user_ids):
+        user_ids = [user_id for user_id in user_ids if user_id is not None]
+        if not user_ids:
+            return set()
+        return set(row[0] for row in conn.execute(
+            select([self.users.c.username]).where(
+                self.users.c.user_id.in_(user_ids))))
+
+
+def _param_sets(multiparams, params):
+    if not multiparams:
+        return [params or {}]
+    if len(multiparams) == 1:
+        first = multiparams[0]
+        if isinstance(first, dict):
+            return [first]
+        if (isinstance(first, (list, tuple)) and
+                all(isinstance(item, dict) for item in first)):
+            return list(first) or [{}]
+    return None
+
+
+def _value_sets(stmt, param_sets):
+    if isinstance(stmt, Delete):
+        # Only the WHERE clause picks the rows; it is looked up as for
+        # an UPDATE, before they are gone.
+        return list(param_sets)
+    if isinstance(stmt, Insert) and stmt._has_multi_parameters:
+        statement_values = stmt.parameters
+    else:
+        statement_values = [stmt.parameters or {}]
+    value_sets = []
+    for values in statement_values:
+        for param_set in param_sets:
+            merged = dict((getattr(key, 'key', key), value)
+                          for key, value in values.items())
+            merged.update(param_set)
+            value_sets.append(merged)
+    return value_sets
+
+
+def _plain_values(value_sets, key):
+    values = set()
+    for value_set in value_sets:
+        value = value_set.get(key)
+        if hasattr(value, '__clause_element__') or hasattr(value, 'compile'):
+            return None
+        if value is not None:
+            values.add(value)
+    return values
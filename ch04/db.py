@@ -1,7 +1,37 @@
+import asyncio
+import contextvars
+import functools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime
-from sqlalchemy import (MetaData, Table, Column, Integer, Numeric, String,
-        DateTime, ForeignKey, Boolean, create_engine)
-from sqlalchemy.sql import insert
+from sqlalchemy import (MetaData, Table, Column, Integer, String, DateTime,
+        ForeignKey, Boolean, CheckConstraint, DDL, Index, create_engine,
+        event, exc, func, inspect, type_coerce, util)
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.sql import and_, select, bindparam
+
+from cache import ResultCache, WriteWatcher
+from instrument import StatementStats
+from loader import bulk_load
+from money import Money, migrate_to_cents
+
+
+class ScopedConnection(object):
+    """Stands in for the shared Connection in pooled mode, routing every
+    call to the connection of the enclosing ``dal.connect_scope()``."""
+
+    def __init__(self, dal):
+        self.dal = dal
+
+    def __getattr__(self, name):
+        conn = self.dal._scoped_connection.get()
+        if conn is None:
+            raise RuntimeError('pooled DataAccessLayer used outside of '
+                               'dal.connect_scope()')
+        return getattr(conn, name)
 
 
 class DataAccessLayer:
@@ -16,7 +46,11 @@ class DataAccessLayer:
         Column('cookie_recipe_url', String(255)),
         Column('cookie_sku', String(55)),
         Column('quantity', Integer()),
-        Column('unit_cost', Numeric(12, 2))
+        Column('unit_cost', Money()),
+        CheckConstraint('quantity >= 0', name='quantity_positive'),
+        # Serves the keyset-paginated stock listing; SQLite appends the
+        # cookie_id rowid, which makes it the unique tie-breaker.
+        Index('ix_cookies_quantity_name', 'quantity', 'cookie_name')
     )
 
     users = Table('users', metadata,
@@ -27,7 +61,10 @@ class DataAccessLayer:
         Column('phone', String(20), nullable=False),
         Column('password', String(25), nullable=False),
         Column('created_on', DateTime(), default=datetime.now),
-        Column('updated_on', DateTime(), default=datetime.now, onupdate=datetime.now)
+        Column('updated_on', DateTime(), default=datetime.now, onupdate=datetime.now),
+        # Maintained only after dal.enable_order_counters().
+        Column('order_count', Integer(), nullable=False, server_default='0'),
+        Column('lifetime_spend', Money(), nullable=False, server_default='0')
     )
 
     orders = Table('orders', metadata,
@@ -41,25 +78,516 @@ class DataAccessLayer:
         Column('order_id', ForeignKey('orders.order_id')),
         Column('cookie_id', ForeignKey('cookies.cookie_id')),
         Column('quantity', Integer()),
-        Column('extended_cost', Numeric(12, 2))
+        Column('extended_cost', Money())
+    )
+
+    # One row holding count(cookie_name) and sum(quantity) over cookies,
+    # kept current by the triggers below.
+    inventory_summary = Table('inventory_summary', metadata,
+        Column('summary_id', Integer(), primary_key=True),
+        Column('cookie_count', Integer(), nullable=False),
+        Column('total_quantity', Integer(), nullable=False)
     )
 
-    def db_init(self, conn_string):
-        self.engine = create_engine(conn_string or self.conn_string)
+    def __init__(self, compiled_cache_size=100, wait_threshold=0.001,
+                 redact=('password',)):
+        self.statements = {}
+        self.compiled_cache = util.LRUCache(compiled_cache_size)
+        self.pooled = False
+        self.wait_threshold = wait_threshold
+        self.result_cache = None
+        self.order_counters = False
+        self.replicas = []
+        self.replica_connections = []
+        self.replica_strategy = 'round_robin'
+        self._replica_busy = []
+        self._next_replica = 0
+        self._replica_lock = threading.Lock()
+        self._scoped_connection = contextvars.ContextVar(
+            'scoped_connection', default=None)
+        self._read_your_writes = contextvars.ContextVar(
+            'read_your_writes', default=False)
+        self._stats_lock = threading.Lock()
+        self.reset_pool_stats()
+        self.statement_stats = StatementStats(redact)
+
+    def db_init(self, conn_string, pooled=False, pool_size=5, max_overflow=10,
+                pool_timeout=30, replica_strings=(),
+                replica_strategy='round_robin'):
+        if replica_strategy not in ('round_robin', 'least_busy'):
+            raise ValueError('unknown replica strategy: {}'.format(
+                replica_strategy))
+        conn_string = conn_string or self.conn_string
+        self.pooled = pooled
+        pool_options = dict(pool_size=pool_size, max_overflow=max_overflow,
+                            pool_timeout=pool_timeout)
+        self.engine = self._create_engine(conn_string, **pool_options)
+        self.statement_stats.listen(self.engine)
+        if pooled:
+            self.reset_pool_stats()
         self.metadata.create_all(self.engine)
-        self.connection = self.engine.connect()
+        if pooled:
+            self.connection = ScopedConnection(self)
+        else:
+            self.connection = self.engine.connect().execution_options(
+                compiled_cache=self.compiled_cache)
+        self.replicas = [self._create_engine(replica_string, **pool_options)
+                         for replica_string in replica_strings]
+        for replica in self.replicas:
+            self.statement_stats.listen(replica)
+        self.replica_strategy = replica_strategy
+        self._replica_busy = [0] * len(self.replicas)
+        if pooled:
+            self.replica_connections = []
+        else:
+            self.replica_connections = [
+                replica.connect().execution_options(
+                    compiled_cache=self.compiled_cache)
+                for replica in self.replicas]
+
+    def enable_result_cache(self, max_entries=1024, ttl=60,
+                            max_bytes=16 * 1024 * 1024):
+        self.result_cache = ResultCache(max_entries, ttl, max_bytes)
+        WriteWatcher(self.result_cache, self.users, self.orders,
+                     self.line_items, self.cookies).listen(self.engine)
+        return self.result_cache
+
+    def stats(self):
+        return self.statement_stats.snapshot()
+
+    def dump_stats(self, path):
+        self.statement_stats.dump(path)
+
+    def start_stats_dump(self, path, interval=60):
+        self.statement_stats.start_dump(path, interval)
+
+    def stop_stats_dump(self):
+        self.statement_stats.stop_dump()
+
+    def _create_engine(self, conn_string, pool_size, max_overflow,
+                       pool_timeout):
+        if not self.pooled:
+            return create_engine(conn_string)
+        url = make_url(conn_string)
+        connect_args = {}
+        if url.drivername.startswith('sqlite'):
+            if url.database in (None, '', ':memory:'):
+                raise ValueError('pooled mode needs a database shared by '
+                                 'every connection, not an in-memory '
+                                 'SQLite database')
+            connect_args['check_same_thread'] = False
+        return create_engine(conn_string, poolclass=QueuePool,
+                             pool_size=pool_size, max_overflow=max_overflow,
+                             pool_timeout=pool_timeout,
+                             connect_args=connect_args)
+
+    @contextmanager
+    def read_your_writes(self):
+        token = self._read_your_writes.set(True)
+        try:
+            yield
+        finally:
+            self._read_your_writes.reset(token)
+
+    def _use_replica(self, read_only):
+        return (read_only and bool(self.replicas) and
+                not self._read_your_writes.get())
+
+    def _pick_replica(self):
+        with self._replica_lock:
+            if self.replica_strategy == 'least_busy':
+                busy = self._replica_busy
+                index = busy.index(min(busy))
+            else:
+                index = self._next_replica
+                self._next_replica = (index + 1) % len(self.replicas)
+            self._replica_busy[index] += 1
+        return index
+
+    def acquire(self, read_only=False):
+        if self._use_replica(read_only):
+            index = self._pick_replica()
+            if self.pooled:
+                conn = self.replicas[index].connect().execution_options(
+                    compiled_cache=self.compiled_cache)
+            else:
+                conn = self.replica_connections[index]
+
+            def release():
+                with self._replica_lock:
+                    self._replica_busy[index] -= 1
+                if self.pooled:
+                    conn.close()
+            return conn, release
+        if self.pooled:
+            conn = self.checkout()
+            return conn, conn.close
+        return self.connection, lambda: None
+
+    @contextmanager
+    def connect_scope(self, read_only=False):
+        conn = self._scoped_connection.get()
+        if conn is not None:
+            yield conn
+            return
+        use_replica = self._use_replica(read_only)
+        conn, release = self.acquire(read_only)
+        token = None
+        if not use_replica:
+            token = self._scoped_connection.set(conn)
+        try:
+            yield conn
+        finally:
+            if token is not None:
+                self._scoped_connection.reset(token)
+            release()
+
+    def sync_replicas(self):
+        source = self.engine.raw_connection()
+        try:
+            for replica in self.replicas:
+                target = replica.raw_connection()
+                try:
+                    source.connection.backup(target.connection)
+                finally:
+                    target.close()
+        finally:
+            source.close()
+
+    def checkout(self):
+        if not self.pooled:
+            raise RuntimeError('checkout() needs db_init(..., pooled=True)')
+        pool = self.engine.pool
+        start = time.time()
+        try:
+            conn = self.engine.connect()
+        except exc.TimeoutError:
+            self._record_checkout(time.time() - start, pool, timed_out=True)
+            raise
+        self._record_checkout(time.time() - start, pool)
+        return conn.execution_options(compiled_cache=self.compiled_cache)
+
+    def _record_checkout(self, elapsed, pool, timed_out=False):
+        with self._stats_lock:
+            stats = self._pool_stats
+            if timed_out:
+                stats['timeouts'] += 1
+            else:
+                stats['checkouts'] += 1
+            if elapsed >= self.wait_threshold:
+                stats['waits'] += 1
+                stats['wait_time'] += elapsed
+            stats['peak_overflow'] = max(stats['peak_overflow'],
+                                         pool.overflow())
+
+    def reset_pool_stats(self):
+        with self._stats_lock:
+            self._pool_stats = {'checkouts': 0, 'waits': 0, 'timeouts': 0,
+                                'wait_time': 0.0, 'peak_overflow': 0}
+
+    def pool_stats(self):
+        if not self.pooled:
+            raise RuntimeError('pool_stats() needs db_init(..., pooled=True)')
+        pool = self.engine.pool
+        with self._stats_lock:
+            stats = dict(self._pool_stats)
+        stats.update(size=pool.size(), checked_in=pool.checkedin(),
+                     checked_out=pool.checkedout(),
+                     overflow=max(pool.overflow(), 0))
+        return stats
+
+    def migrate_money(self):
+        """Convert unit_cost and extended_cost of a database created with
+        Numeric(12, 2) columns to integer cents. Returns the names of the
+        columns converted; none on an up to date database."""
+        with self.connect_scope() as conn:
+            with conn.begin():
+                converted = migrate_to_cents(
+                    conn, self.cookies.c.unit_cost,
+                    self.line_items.c.extended_cost)
+        return [str(column) for column in converted]
+
+    def inventory_summary_scan(self):
+        cookies = self.cookies
+        return select([
+            func.count(cookies.c.cookie_name).label('cookie_count'),
+            func.coalesce(func.sum(cookies.c.quantity), 0).label(
+                'total_quantity')])
+
+    def verify_inventory_summary(self, repair=False):
+        """Compare the maintained summary with a full scan of cookies.
+        Returns None when they agree, otherwise (maintained, scanned), after
+        overwriting the summary with the scan if ``repair`` is set."""
+        summary = self.inventory_summary
+        with self.connect_scope() as conn:
+            trans = conn.begin()
+            try:
+                maintained = conn.execute(select([
+                    summary.c.cookie_count, summary.c.total_quantity])).first()
+                scanned = conn.execute(self.inventory_summary_scan()).first()
+                if maintained is not None:
+                    maintained = tuple(maintained)
+                scanned = tuple(scanned)
+                if maintained != scanned and repair:
+                    conn.execute(summary.delete())
+                    conn.execute(summary.insert().values(
+                        summary_id=1, cookie_count=scanned[0],
+                        total_quantity=scanned[1]))
+                trans.commit()
+            except Exception:
+                trans.rollback()
+                raise
+        if maintained == scanned:
+            return None
+        return maintained, scanned
+
+    def order_counter_scan(self):
+        users, orders, line_items = self.users, self.orders, self.line_items
+        order_count = select([func.count()]).where(
+            orders.c.user_id == users.c.user_id).as_scalar()
+        lifetime_spend = select([
+            func.coalesce(func.sum(line_items.c.extended_cost), 0)]).where(
+                and_(orders.c.user_id == users.c.user_id,
+                     orders.c.shipped,
+                     line_items.c.order_id == orders.c.order_id)).as_scalar()
+        return select([users.c.user_id, users.c.username,
+                       order_count.label('order_count'),
+                       lifetime_spend.label('lifetime_spend')])
+
+    def enable_order_counters(self):
+        """Keep users.order_count and users.lifetime_spend, the spend on
+        shipped orders, current with triggers. Adds the columns to a
+        database created without them and fills them from a scan."""
+        with self.connect_scope() as conn:
+            if conn.dialect.name != 'sqlite':
+                raise NotImplementedError(
+                    'order counters are maintained by SQLite triggers')
+            trans = conn.begin()
+            try:
+                present = set(column['name'] for column in
+                              inspect(conn).get_columns('users'))
+                for column in (self.users.c.order_count,
+                               self.users.c.lifetime_spend):
+                    if column.name not in present:
+                        conn.execute(
+                            'ALTER TABLE users ADD COLUMN {} {} NOT NULL '
+                            'DEFAULT 0'.format(column.name, column.type.compile(
+                                dialect=conn.dialect)))
+                for ddl in ORDER_COUNTER_DDL:
+                    conn.execute(ddl)
+                self._order_counter_drift(conn, repair=True)
+                trans.commit()
+            except Exception:
+                trans.rollback()
+                raise
+        self.order_counters = True
+
+    def verify_order_counters(self, repair=False):
+        """Compare the maintained counters with a scan of orders and line
+        items. Returns (user_id, maintained, scanned) for each user that
+        has drifted, after overwriting them with the scan if ``repair`` is
+        set."""
+        with self.connect_scope() as conn:
+            trans = conn.begin()
+            try:
+                drift = self._order_counter_drift(conn, repair)
+                trans.commit()
+            except Exception:
+                trans.rollback()
+                raise
+        return drift
+
+    def _order_counter_drift(self, conn, repair):
+        users = self.users
+        maintained = dict(
+            (row.user_id, (row.order_count, row.lifetime_spend))
+            for row in conn.execute(select([
+                users.c.user_id, users.c.order_count,
+                users.c.lifetime_spend])))
+        drift = [(row.user_id, maintained[row.user_id],
+                  (row.order_count, row.lifetime_spend))
+                 for row in conn.execute(self.order_counter_scan().order_by(
+                     users.c.user_id))
+                 if maintained[row.user_id] !=
+                 (row.order_count, row.lifetime_spend)]
+        if repair and drift:
+            u = users.update().where(users.c.user_id == bindparam('uid'))
+            conn.execute(u.values(order_count=bindparam('count'),
+                                  lifetime_spend=bindparam('spend'),
+                                  updated_on=users.c.updated_on), [
+                {'uid': user_id, 'count': scanned[0], 'spend': scanned[1]}
+                for user_id, old, scanned in drift])
+        return drift
+
+    def orders_by_customer_stmt(self, shipped=None, details=False):
+        return self._orders_stmt(
+            ('orders_by_customer', shipped is not None, details), shipped,
+            details, self.users.c.username == bindparam('cust_name'))
+
+    def orders_by_customers_stmt(self, shipped=None, details=False):
+        return self._orders_stmt(
+            ('orders_by_customers', shipped is not None, details), shipped,
+            details, self.users.c.username.in_(
+                bindparam('cust_names', expanding=True)))
+
+    def line_item_columns_stmt(self, shipped=None):
+        cents = type_coerce(self.line_items.c.extended_cost, Integer)
+        columns = [self.orders.c.order_id, self.users.c.username,
+                   self.cookies.c.cookie_name, self.line_items.c.quantity,
+                   cents.label('extended_cost_cents')]
+        return self._orders_stmt(
+            ('line_item_columns', shipped is not None), shipped, True,
+            self.users.c.username == bindparam('cust_name'), columns)
+
+    def _orders_stmt(self, key, shipped, details, criterion, columns=None):
+        stmt = self.statements.get(key)
+        if stmt is None:
+            joins = self.users.join(self.orders)
+            if details:
+                joins = joins.join(self.line_items).join(self.cookies)
+            if columns is None:
+                columns = [self.orders.c.order_id, self.users.c.username,
+                           self.users.c.phone]
+                if details:
+                    columns.extend([self.cookies.c.cookie_name,
+                                    self.line_items.c.quantity,
+                                    self.line_items.c.extended_cost])
+            stmt = select(columns).select_from(joins).where(criterion)
+            if shipped is not None:
+                stmt = stmt.where(
+                    self.orders.c.shipped == bindparam('shipped'))
+            self.statements[key] = stmt
+        return stmt
+
+
+INVENTORY_SUMMARY_DDL = [
+    # Seeds the row from a full scan when the table is first created.
+    DDL('INSERT INTO inventory_summary '
+        '(summary_id, cookie_count, total_quantity) '
+        'SELECT 1, count(cookie_name), coalesce(sum(quantity), 0) '
+        'FROM cookies '
+        'WHERE NOT EXISTS (SELECT 1 FROM inventory_summary)'),
+    DDL('CREATE TRIGGER IF NOT EXISTS inventory_summary_insert '
+        'AFTER INSERT ON cookies BEGIN '
+        'UPDATE inventory_summary SET '
+        'cookie_count = cookie_count + (NEW.cookie_name IS NOT NULL), '
+        'total_quantity = total_quantity + coalesce(NEW.quantity, 0); '
+        'END').execute_if(dialect='sqlite'),
+    DDL('CREATE TRIGGER IF NOT EXISTS inventory_summary_update '
+        'AFTER UPDATE OF cookie_name, quantity ON cookies BEGIN '
+        'UPDATE inventory_summary SET '
+        'cookie_count = cookie_count + (NEW.cookie_name IS NOT NULL) '
+        '- (OLD.cookie_name IS NOT NULL), '
+        'total_quantity = total_quantity + coalesce(NEW.quantity, 0) '
+        '- coalesce(OLD.quantity, 0); '
+        'END').execute_if(dialect='sqlite'),
+    DDL('CREATE TRIGGER IF NOT EXISTS inventory_summary_delete '
+        'AFTER DELETE ON cookies BEGIN '
+        'UPDATE inventory_summary SET '
+        'cookie_count = cookie_count - (OLD.cookie_name IS NOT NULL), '
+        'total_quantity = total_quantity - coalesce(OLD.quantity, 0); '
+        'END').execute_if(dialect='sqlite'),
+]
+for ddl in INVENTORY_SUMMARY_DDL:
+    event.listen(DataAccessLayer.metadata, 'after_create', ddl)
+
+# Installed by dal.enable_order_counters(). An order adds to its user's
+# order_count; its line items add to lifetime_spend while it is shipped.
+_ORDER_SPEND = ('(SELECT coalesce(sum(extended_cost), 0) FROM line_items '
+                'WHERE order_id = {}.order_id)')
+_SHIPPED_USER = ('(SELECT user_id FROM orders '
+                 'WHERE order_id = {}.order_id AND shipped)')
+ORDER_COUNTER_DDL = [
+    DDL('CREATE TRIGGER IF NOT EXISTS order_counter_insert '
+        'AFTER INSERT ON orders BEGIN '
+        'UPDATE users SET order_count = order_count + 1, '
+        'lifetime_spend = lifetime_spend + '
+        'CASE WHEN NEW.shipped THEN {new} ELSE 0 END '
+        'WHERE user_id = NEW.user_id; '
+        'END'.format(new=_ORDER_SPEND.format('NEW'))),
+    DDL('CREATE TRIGGER IF NOT EXISTS order_counter_update '
+        'AFTER UPDATE OF order_id, user_id, shipped ON orders BEGIN '
+        'UPDATE users SET order_count = order_count - 1, '
+        'lifetime_spend = lifetime_spend - '
+        'CASE WHEN OLD.shipped THEN {old} ELSE 0 END '
+        'WHERE user_id = OLD.user_id; '
+        'UPDATE users SET order_count = order_count + 1, '
+        'lifetime_spend = lifetime_spend + '
+        'CASE WHEN NEW.shipped THEN {new} ELSE 0 END '
+        'WHERE user_id = NEW.user_id; '
+        'END'.format(old=_ORDER_SPEND.format('OLD'),
+                     new=_ORDER_SPEND.format('NEW'))),
+    DDL('CREATE TRIGGER IF NOT EXISTS order_counter_delete '
+        'AFTER DELETE ON orders BEGIN '
+        'UPDATE users SET order_count = order_count - 1, '
+        'lifetime_spend = lifetime_spend - '
+        'CASE WHEN OLD.shipped THEN {old} ELSE 0 END '
+        'WHERE user_id = OLD.user_id; '
+        'END'.format(old=_ORDER_SPEND.format('OLD'))),
+    DDL('CREATE TRIGGER IF NOT EXISTS order_counter_line_insert '
+        'AFTER INSERT ON line_items BEGIN '
+        'UPDATE users SET lifetime_spend = lifetime_spend + '
+        'coalesce(NEW.extended_cost, 0) WHERE user_id = {new}; '
+        'END'.format(new=_SHIPPED_USER.format('NEW'))),
+    DDL('CREATE TRIGGER IF NOT EXISTS order_counter_line_update '
+        'AFTER UPDATE OF order_id, extended_cost ON line_items BEGIN '
+        'UPDATE users SET lifetime_spend = lifetime_spend - '
+        'coalesce(OLD.extended_cost, 0) WHERE user_id = {old}; '
+        'UPDATE users SET lifetime_spend = lifetime_spend + '
+        'coalesce(NEW.extended_cost, 0) WHERE user_id = {new}; '
+        'END'.format(old=_SHIPPED_USER.format('OLD'),
+                     new=_SHIPPED_USER.format('NEW'))),
+    DDL('CREATE TRIGGER IF NOT EXISTS order_counter_line_delete '
+        'AFTER DELETE ON line_items BEGIN '
+        'UPDATE users SET lifetime_spend = lifetime_spend - '
+        'coalesce(OLD.extended_cost, 0) WHERE user_id = {old}; '
+        'END'.format(old=_SHIPPED_USER.format('OLD'))),
+]
+
+
+class AsyncDataAccessLayer(object):
+    """Runs DataAccessLayer work on a thread pool so coroutines never block
+    the event loop; each call checks out its own pooled connection."""
+
+    def __init__(self, dal):
+        self.dal = dal
+        self.executor = None
+
+    async def db_init(self, conn_string, pool_size=5, max_overflow=10,
+                      pool_timeout=30, **kwargs):
+        self.executor = ThreadPoolExecutor(pool_size + max_overflow)
+        await self.run(self.dal.db_init, conn_string, pooled=True,
+                       pool_size=pool_size, max_overflow=max_overflow,
+                       pool_timeout=pool_timeout, **kwargs)
+
+    async def run(self, func, *args, **kwargs):
+        # run_in_executor() does not carry context variables over, and
+        # read_your_writes() and connect_scope() live in them.
+        loop = asyncio.get_running_loop()
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(
+            self.executor, functools.partial(context.run, func, *args,
+                                             **kwargs))
+
+    async def close(self):
+        await self.run(self.dal.engine.dispose)
+        self.executor.shutdown()
+        self.executor = None
+
 
 dal = DataAccessLayer()
+async_dal = AsyncDataAccessLayer(dal)
 
 
 def prep_db():
-    ins = dal.cookies.insert()
-    dal.connection.execute(ins, cookie_name='dark chocolate chip',
-            cookie_recipe_url='http://some.aweso.me/cookie/recipe_dark.html',
-            cookie_sku='CC02',
-            quantity='1',
-            unit_cost='0.75')
     inventory_list = [
+        {
+            'cookie_name': 'dark chocolate chip',
+            'cookie_recipe_url': 'http://some.aweso.me/cookie/recipe_dark.html',
+            'cookie_sku': 'CC02',
+            'quantity': '1',
+            'unit_cost': '0.75'
+        },
         {
             'cookie_name': 'peanut butter',
             'cookie_recipe_url': 'http://some.aweso.me/cookie/peanut.html',
@@ -75,8 +603,6 @@ def prep_db():
             'unit_cost': '1.00'
         }
     ]
-    dal.connection.execute(ins, inventory_list)
-
     customer_list = [
         {
             'username': "cookiemon",
@@ -97,33 +623,26 @@ def prep_db():
             'password': "password"
         }
     ]
-    ins = dal.users.insert()
-    dal.connection.execute(ins, customer_list)
-    ins = insert(dal.orders).values(user_id=1, order_id='wlk001')
-    dal.connection.execute(ins)
-    ins = insert(dal.line_items)
+    order_list = [
+        {'order_id': 'wlk001', 'username': 'cookiemon'},
+        {'order_id': 'ol001', 'username': 'cakeeater'}
+    ]
     order_items = [
         {
             'order_id': 'wlk001',
-            'cookie_id': 1,
+            'cookie_sku': 'CC02',
             'quantity': 2,
             'extended_cost': 1.00
         },
         {
             'order_id': 'wlk001',
-            'cookie_id': 3,
+            'cookie_sku': 'EWW01',
             'quantity': 12,
             'extended_cost': 3.00
-        }
-    ]
-    dal.connection.execute(ins, order_items)
-    ins = insert(dal.orders).values(user_id=2, order_id='ol001')
-    dal.connection.execute(ins)
-    ins = insert(dal.line_items)
-    order_items = [
+        },
         {
             'order_id': 'ol001',
-            'cookie_id': 1,
+            'cookie_sku': 'CC02',
             'quantity': 24,
             'extended_cost': 12.00
         },
@@ -134,4 +653,5 @@ def prep_db():
             'extended_cost': 6.00
         }
     ]
-    dal.connection.execute(ins, order_items)
+    bulk_load(dal, cookies=inventory_list, users=customer_list,
+              orders=order_list, line_items=order_items)
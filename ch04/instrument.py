@@ -0,0 +1,193 @@
+import json
+import re
+import threading
+import time
+
+from sqlalchemy import event
+
+
+BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+REDACTED = '<redacted>'
+
+_WHITESPACE = re.compile(r'\s+')
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+_IN_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+_BIND_SUFFIX = re.compile(r'_\d+$')
+
+
+def normalize(statement):
+    statement = _WHITESPACE.sub(' ', statement).strip()
+    statement = _STRING.sub('?', statement)
+    statement = _NUMBER.sub('?', statement)
+    return _IN_LIST.sub('(?, ...)', statement)
+
+
+class StatementStats(object):
+    """Per-statement call counts, row counts and latency histograms,
+    collected from cursor execution events. Rows are those fetched for
+    statements that return rows and those affected for the rest."""
+
+    START = 'statement_stats_start'
+
+    def __init__(self, redact=('password',)):
+        self.redact = set(redact)
+        self._lock = threading.Lock()
+        self._dumper = None
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._stats = {}
+
+    def listen(self, engine):
+        event.listen(engine, 'before_cursor_execute', self.before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', self.after_cursor_execute)
+        event.listen(engine, 'handle_error', self.handle_error)
+
+    def before_cursor_execute(self, conn, cursor, statement, parameters,
+                              context, executemany):
+        conn.info.setdefault(self.START, []).append(time.time())
+
+    def after_cursor_execute(self, conn, cursor, statement, parameters,
+                             context, executemany):
+        elapsed = time.time() - conn.info[self.START].pop()
+        if cursor.description is not None and context is not None:
+            # DBAPI rowcount is -1 for SELECT on sqlite3; count the rows
+            # the result fetches instead, once it closes the cursor.
+            rows = 0
+            context.cursor = _CountingCursor(cursor, self, statement)
+        else:
+            rows = cursor.rowcount if cursor.rowcount >= 0 else 0
+        self.record(statement, elapsed, rows, self.redacted(
+            parameters, context, executemany))
+
+    def handle_error(self, context):
+        starts = context.connection.info.get(self.START)
+        if starts:
+            starts.pop()
+
+    def record(self, statement, elapsed, rows, parameters):
+        key = normalize(statement)
+        with self._lock:
+            stats = self._stats.get(key)
+            if stats is None:
+                stats = self._stats[key] = {
+                    'calls': 0, 'rows': 0, 'total_time': 0.0,
+                    'min_time': elapsed, 'max_time': elapsed,
+                    'histogram': [0] * (len(BUCKETS) + 1)}
+            stats['calls'] += 1
+            stats['rows'] += rows
+            stats['total_time'] += elapsed
+            stats['min_time'] = min(stats['min_time'], elapsed)
+            stats['max_time'] = max(stats['max_time'], elapsed)
+            bucket = 0
+            while bucket < len(BUCKETS) and elapsed > BUCKETS[bucket]:
+                bucket += 1
+            stats['histogram'][bucket] += 1
+            stats['last_parameters'] = parameters
+
+    def fetched(self, statement, rows):
+        key = normalize(statement)
+        with self._lock:
+            stats = self._stats.get(key)
+            if stats is not None:
+                stats['rows'] += rows
+
+    def redacted(self, parameters, context, executemany):
+        if executemany:
+            parameters = parameters[0] if parameters else ()
+        compiled = getattr(context, 'compiled', None)
+        if compiled is None:
+            return REDACTED if parameters else parameters
+        sensitive = set(name for name in getattr(compiled, 'binds', ())
+                        if self.is_sensitive(name))
+        if not sensitive:
+            return parameters
+        if isinstance(parameters, dict):
+            return dict((name, REDACTED if name in sensitive else value)
+                        for name, value in parameters.items())
+        names = compiled.positiontup or ()
+        if len(names) != len(parameters):
+            return [REDACTED] * len(parameters)
+        return [REDACTED if name in sensitive else value
+                for name, value in zip(names, parameters)]
+
+    def is_sensitive(self, bind_name):
+        name = _BIND_SUFFIX.sub('', bind_name)
+        return any(name == column or name.endswith('_' + column)
+                   for column in self.redact)
+
+    def snapshot(self):
+        with self._lock:
+            snapshot = {}
+            for key, stats in self._stats.items():
+                stats = dict(stats, histogram=list(stats['histogram']))
+                stats['mean_time'] = stats['total_time'] / stats['calls']
+                snapshot[key] = stats
+            return snapshot
+
+    def dump(self, path):
+        with open(path, 'w') as dumpfile:
+            json.dump({'time': time.time(), 'buckets': list(BUCKETS),
+                       'statements': self.snapshot()},
+                      dumpfile, indent=2, sort_keys=True, default=str)
+
+    def start_dump(self, path, interval=60):
+        self.stop_dump()
+        stop = threading.Event()
+
+        def run():
+            while not stop.wait(interval):
+                self.dump(path)
+            self.dump(path)
+
+        thread = threading.Thread(target=run, name='statement-stats-dump')
+        thread.daemon = True
+        thread.start()
+        self._dumper = (thread, stop)
+
+    def stop_dump(self):
+        if self._dumper is not None:
+            thread, stop = self._dumper
+            stop.set()
+            thread.join()
+            self._dumper = None
+
+
+class _CountingCursor(object):
+    """Stands in for a DBAPI cursor in a result and reports how many rows
+    were fetched through it when it is closed."""
+
+    __slots__ = ('_cursor', '_stats', '_statement', '_rows')
+
+    def __init__(self, cursor, stats, statement):
+        self._cursor = cursor
+        self._stats = stats
+        self._statement = statement
+        self._rows = 0
+
+    def fetchone(self):
+        row = self._cursor.fetchone()
+        if row is not None:
+            self._rows += 1
+        return row
+
+    def fetchmany(self, *args):
+        rows = self._cursor.fetchmany(*args)
+        self._rows += len(rows)
+        return rows
+
+    def fetchall(self):
+        rows = self._cursor.fetchall()
+        self._rows += len(rows)
+        return rows
+
+    def close(self):
+        if self._stats is not None:
+            self._stats.fetched(self._statement, self._rows)
+            self._stats = None
+        self._cursor.close()
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
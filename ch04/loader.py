@@ -0,0 +1,113 @@
+import csv
+import json
+from contextlib import contextmanager
+from itertools import islice
+
+from sqlalchemy.sql import select
+
+
+LOAD_PROFILE = {
+    'journal_mode': 'MEMORY',
+    'synchronous': 'OFF',
+    'cache_size': -262144,
+}
+
+TABLE_ORDER = ('cookies', 'users', 'orders', 'line_items')
+
+
+def read_records(path):
+    if path.endswith('.csv'):
+        with open(path, newline='') as csvfile:
+            for record in csv.DictReader(csvfile):
+                yield dict((key, value if value != '' else None)
+                           for key, value in record.items())
+    elif path.endswith(('.ndjson', '.jsonl')):
+        with open(path) as ndjson:
+            for line in ndjson:
+                if line.strip():
+                    yield json.loads(line)
+    else:
+        raise ValueError('unsupported file type: {}'.format(path))
+
+
+def chunked(records, size):
+    records = iter(records)
+    while True:
+        chunk = list(islice(records, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+@contextmanager
+def load_profile(conn, profile):
+    if not profile or conn.dialect.name != 'sqlite':
+        yield
+        return
+    saved = {}
+    for name, value in profile.items():
+        saved[name] = conn.execute('PRAGMA {}'.format(name)).scalar()
+        conn.execute('PRAGMA {} = {}'.format(name, value))
+    try:
+        yield
+    finally:
+        for name, value in saved.items():
+            conn.execute('PRAGMA {} = {}'.format(name, value))
+
+
+class KeyResolver(object):
+    """Maps natural keys (username, cookie_sku) to surrogate ids, reading
+    each lookup table once the first time it is needed."""
+
+    def __init__(self, conn, dal):
+        self.conn = conn
+        self.lookups = {
+            'username': ('user_id', dal.users.c.username, dal.users.c.user_id),
+            'cookie_sku': ('cookie_id', dal.cookies.c.cookie_sku,
+                           dal.cookies.c.cookie_id),
+        }
+        self.maps = {}
+
+    def resolve(self, table, record):
+        for natural_key, (fk, key_col, id_col) in self.lookups.items():
+            if natural_key not in record or natural_key in table.c:
+                continue
+            if natural_key not in self.maps:
+                self.maps[natural_key] = dict(self.conn.execute(
+                    select([key_col, id_col])).fetchall())
+            value = record.pop(natural_key)
+            try:
+                record[fk] = self.maps[natural_key][value]
+            except KeyError:
+                raise ValueError('unknown {} {!r}'.format(natural_key, value))
+        return record
+
+
+def bulk_load(dal, cookies=(), users=(), orders=(), line_items=(),
+              chunk_size=10000, profile=None):
+    sources = {'cookies': cookies, 'users': users, 'orders': orders,
+               'line_items': line_items}
+    counts = {}
+    with dal.connect_scope() as conn:
+        with load_profile(conn, profile):
+            trans = conn.begin()
+            try:
+                resolver = KeyResolver(conn, dal)
+                for name in TABLE_ORDER:
+                    table = getattr(dal, name)
+                    counts[name] = 0
+                    for chunk in chunked(sources[name], chunk_size):
+                        chunk = [resolver.resolve(table, dict(record))
+                                 for record in chunk]
+                        conn.execute(table.insert(), chunk)
+                        counts[name] += len(chunk)
+                trans.commit()
+            except Exception:
+                trans.rollback()
+                raise
+    return counts
+
+
+def load_files(dal, paths, chunk_size=10000, profile=LOAD_PROFILE):
+    sources = dict((name, read_records(path)) for name, path in paths.items())
+    return bulk_load(dal, chunk_size=chunk_size, profile=profile, **sources)
@@ -0,0 +1,193 @@
+from decimal import ROUND_HALF_EVEN, Decimal
+
+from sqlalchemy import Integer, inspect
+from sqlalchemy.sql import operators
+from sqlalchemy.types import TypeDecorator
+
+
+_CENT = Decimal('0.01')
+
+
+class Cents(int):
+    """An exact amount of money held as an integer number of cents.
+    Sums, integer multiples and floor division stay Cents; anything that
+    could lose a fraction of a cent raises TypeError, as does mixing in a
+    plain number other than 0, which would be read as cents here but as
+    currency units by Money. A plain number only equals Cents(0), when
+    it is 0."""
+
+    __slots__ = ()
+
+    @classmethod
+    def parse(cls, amount):
+        """Cents for an amount in currency units ('0.75', 0.75 or
+        Decimal('0.75')), rounded half-even to the cent."""
+        if isinstance(amount, cls):
+            return amount
+        if isinstance(amount, float):
+            amount = repr(amount)
+        cents = Decimal(amount).quantize(_CENT, ROUND_HALF_EVEN).scaleb(2)
+        return cls(cents)
+
+    def to_decimal(self):
+        return Decimal(int(self)).scaleb(-2)
+
+    def __str__(self):
+        sign = '-' if self < 0 else ''
+        return '{}{}.{:02d}'.format(sign, *divmod(abs(int(self)), 100))
+
+    def __repr__(self):
+        return 'Cents({})'.format(int(self))
+
+    def __add__(self, other):
+        if isinstance(other, Cents) or other == 0:
+            return Cents(int(self) + int(other))
+        raise TypeError('cannot add {!r} to {!r}'.format(other, self))
+
+    __radd__ = __add__
+
+    def __sub__(self, other):
+        if isinstance(other, Cents) or other == 0:
+            return Cents(int(self) - int(other))
+        raise TypeError('cannot subtract {!r} from {!r}'.format(other, self))
+
+    def __rsub__(self, other):
+        return -self.__sub__(other)
+
+    def __mul__(self, other):
+        if isinstance(other, int) and not isinstance(other, (bool, Cents)):
+            return Cents(int(self) * other)
+        raise TypeError('cannot multiply {!r} by {!r}'.format(self, other))
+
+    __rmul__ = __mul__
+
+    def __truediv__(self, other):
+        raise TypeError('cannot divide {!r} by {!r}; use // or divmod()'
+                        .format(self, other))
+
+    def __rtruediv__(self, other):
+        raise TypeError('cannot divide {!r} by {!r}'.format(other, self))
+
+    def __floordiv__(self, other):
+        quotient, remainder = self.__divmod__(other)
+        return quotient
+
+    def __mod__(self, other):
+        quotient, remainder = self.__divmod__(other)
+        return remainder
+
+    def __divmod__(self, other):
+        """Shares and what is left over: an int and Cents for Cents,
+        Cents and Cents for an integer."""
+        if isinstance(other, Cents):
+            quotient, remainder = divmod(int(self), int(other))
+            return quotient, Cents(remainder)
+        if isinstance(other, int) and not isinstance(other, bool):
+            quotient, remainder = divmod(int(self), other)
+            return Cents(quotient), Cents(remainder)
+        raise TypeError('cannot divide {!r} by {!r}'.format(self, other))
+
+    def __rfloordiv__(self, other):
+        raise TypeError('cannot divide {!r} by {!r}'.format(other, self))
+
+    __rmod__ = __rdivmod__ = __rfloordiv__
+
+    def _compared(self, other):
+        if isinstance(other, Cents) or other == 0:
+            return int(other)
+        raise TypeError('cannot compare {!r} with {!r}'.format(self, other))
+
+    def __lt__(self, other):
+        return int(self) < self._compared(other)
+
+    def __le__(self, other):
+        return int(self) <= self._compared(other)
+
+    def __gt__(self, other):
+        return int(self) > self._compared(other)
+
+    def __ge__(self, other):
+        return int(self) >= self._compared(other)
+
+    def __eq__(self, other):
+        if isinstance(other, Cents):
+            return int(self) == int(other)
+        if isinstance(other, (int, float, Decimal)):
+            return other == 0 and int(self) == 0
+        return NotImplemented
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+
+    __hash__ = int.__hash__
+
+    def __neg__(self):
+        return Cents(-int(self))
+
+    def __abs__(self):
+        return Cents(abs(int(self)))
+
+
+class Money(TypeDecorator):
+    """Currency stored as integer cents and loaded as Cents. Cents bind as
+    they are; plain numbers and strings are amounts in currency units.
+
+    In SQL, money plus or minus money and money times an integer stay
+    Money, so ``quantity * unit_cost`` loads as Cents too."""
+
+    impl = Integer
+
+    class comparator_factory(TypeDecorator.Comparator,
+                             Integer.comparator_factory):
+
+        def _adapt_expression(self, op, other_comparator):
+            if (op in (operators.add, operators.sub, operators.mul) and
+                    other_comparator.type._type_affinity is Integer):
+                return op, self.type
+            return super(Money.comparator_factory, self)._adapt_expression(
+                op, other_comparator)
+
+    def process_bind_param(self, value, dialect):
+        if value is None or isinstance(value, Cents):
+            return value
+        return int(Cents.parse(value))
+
+    def result_processor(self, dialect, coltype):
+        def process(value):
+            if value is None:
+                return None
+            return Cents(value)
+        return process
+
+    def process_literal_param(self, value, dialect):
+        return self.process_bind_param(value, dialect)
+
+
+def migrate_to_cents(conn, *columns):
+    """Convert existing decimal money columns to integer cents in place:
+    add an INTEGER column, fill it with the rounded cents, drop the old
+    column and take its name. Columns already INTEGER are skipped, so
+    this is safe to run again. Run it in a transaction; on SQLite it needs
+    3.35 or newer for DROP COLUMN. Returns the columns converted."""
+    inspector = inspect(conn)
+    preparer = conn.dialect.identifier_preparer
+    converted = []
+    for column in columns:
+        table = column.table.name
+        reflected = dict((info['name'], info['type'])
+                         for info in inspector.get_columns(table))
+        if isinstance(reflected[column.name], Integer):
+            continue
+        names = {'table': preparer.quote(table),
+                 'old': preparer.quote(column.name),
+                 'new': preparer.quote(column.name + '_cents')}
+        for statement in (
+                'ALTER TABLE {table} ADD COLUMN {new} INTEGER',
+                'UPDATE {table} SET {new} = CAST(ROUND({old} * 100) '
+                'AS INTEGER)',
+                'ALTER TABLE {table} DROP COLUMN {old}',
+                'ALTER TABLE {table} RENAME COLUMN {new} TO {old}'):
+            conn.execute(statement.format(**names))
+        converted.append(column)
+    return converted
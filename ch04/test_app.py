@@ -1,18 +1,40 @@
+import asyncio
+import os
+import shutil
+import tempfile
+import threading
 import unittest
 
-from decimal import Decimal
+import mock
+try:
+    import numpy
+except ImportError:
+    numpy = None
+from sqlalchemy import exc
+from sqlalchemy.sql import select, update
 
-from db import dal, prep_db
-from app import get_orders_by_customer
+from db import AsyncDataAccessLayer, DataAccessLayer, dal, prep_db
+from app import (get_orders_by_customer, get_orders_by_customers,
+                 iter_orders_by_customer, get_orders_by_customer_async,
+                 get_line_item_columns, ship_it, ship_it_async,
+                 get_inventory_summary, InsufficientInventory,
+                 get_customer_summary, get_customer_summaries)
+from money import Cents
+
+
+def restock(conn, dal, cookie_id=1, quantity=2):
+    """prep_db leaves too few dark chocolate chip cookies to ship wlk001."""
+    conn.execute(update(dal.cookies).where(
+        dal.cookies.c.cookie_id == cookie_id).values(quantity=quantity))
 
 
 class TestApp(unittest.TestCase):
     cookie_orders = [(u'wlk001', u'cookiemon', u'111-111-1111')]
     cookie_details = [
         (u'wlk001', u'cookiemon', u'111-111-1111',
-            u'dark chocolate chip', 2, Decimal('1.00')),
+            u'dark chocolate chip', 2, Cents(100)),
         (u'wlk001', u'cookiemon', u'111-111-1111',
-            u'oatmeal raisin', 12, Decimal('3.00'))]
+            u'oatmeal raisin', 12, Cents(300))]
 
     @classmethod
     def setUpClass(cls):
@@ -90,3 +112,529 @@ class TestApp(unittest.TestCase):
     def test_orders_by_customer_unshipped_only_details(self):
         results = get_orders_by_customer('cookiemon', False, True)
         self.assertEqual(results, self.cookie_details)
+
+    def test_orders_by_customer_stmt_reused(self):
+        self.assertIs(dal.orders_by_customer_stmt(True, True),
+                      dal.orders_by_customer_stmt(False, True))
+        self.assertIsNot(dal.orders_by_customer_stmt(None, True),
+                         dal.orders_by_customer_stmt(True, True))
+
+    def test_orders_by_customer_compiled_once(self):
+        get_orders_by_customer('cookiemon', False, True)
+        cached = len(dal.compiled_cache)
+        get_orders_by_customer('cakeeater', True, True)
+        self.assertEqual(len(dal.compiled_cache), cached)
+
+    def test_iter_orders_by_customer(self):
+        results = iter_orders_by_customer('cookiemon', details=True,
+                                          batch_size=1)
+        self.assertEqual(list(results), self.cookie_details)
+
+    def test_iter_orders_by_customer_shipped_only(self):
+        results = iter_orders_by_customer('cookiemon', True, batch_size=1)
+        self.assertEqual(list(results), [])
+
+    def test_orders_by_customers(self):
+        results = get_orders_by_customers(['cookiemon', 'cakeeater',
+                                           'bad name', 'cookiemon'])
+        self.assertEqual(results, {
+            'cookiemon': self.cookie_orders,
+            'cakeeater': [(u'ol001', u'cakeeater', u'222-222-2222')],
+            'bad name': []})
+
+    def test_orders_by_customers_chunked_details(self):
+        with mock.patch('app.MAX_NAMES_PER_QUERY', 1):
+            results = get_orders_by_customers(['cookiemon', 'bad name'],
+                                              False, True)
+        self.assertEqual(results, {'cookiemon': self.cookie_details,
+                                   'bad name': []})
+
+    def test_orders_by_customers_shipped_only(self):
+        results = get_orders_by_customers(['cookiemon', 'cakeeater'], True)
+        self.assertEqual(results, {'cookiemon': [], 'cakeeater': []})
+
+    def test_orders_by_customers_empty(self):
+        self.assertEqual(get_orders_by_customers([]), {})
+
+    @unittest.skipUnless(numpy, 'requires numpy')
+    def test_line_item_columns(self):
+        columns = get_line_item_columns('cookiemon', batch_size=1)
+        self.assertEqual(columns['cookie_name'].tolist(),
+                         [u'dark chocolate chip', u'oatmeal raisin'])
+        self.assertEqual(columns['quantity'].dtype, numpy.int64)
+        self.assertEqual(columns['quantity'].sum(), 14)
+        self.assertEqual(columns['extended_cost_cents'].tolist(), [100, 300])
+
+    @unittest.skipUnless(numpy, 'requires numpy')
+    def test_line_item_columns_empty(self):
+        columns = get_line_item_columns('cookiemon', True)
+        self.assertEqual(len(columns['quantity']), 0)
+        self.assertEqual(columns['extended_cost_cents'].sum(), 0)
+
+
+class TestShipIt(unittest.TestCase):
+
+    def setUp(self):
+        self.dal = DataAccessLayer()
+        self.dal.db_init('sqlite:///:memory:')
+        self.patches = [mock.patch('db.dal', self.dal),
+                        mock.patch('app.dal', self.dal)]
+        for patch in self.patches:
+            patch.start()
+        prep_db()
+        self.conn = self.dal.connection
+
+    def tearDown(self):
+        for patch in self.patches:
+            patch.stop()
+
+    def quantities(self):
+        return [row[0] for row in self.conn.execute(
+            select([self.dal.cookies.c.quantity]).order_by(
+                self.dal.cookies.c.cookie_id))]
+
+    def shipped(self):
+        return [row[0] for row in self.conn.execute(
+            select([self.dal.orders.c.shipped]).order_by(
+                self.dal.orders.c.order_id))]
+
+    def test_ship_it(self):
+        restock(self.conn, self.dal)
+        self.conn.execute(self.dal.line_items.insert(), {
+            'order_id': 'wlk001', 'cookie_id': 3, 'quantity': 8,
+            'extended_cost': 2.00})
+        self.dal.statement_stats.reset()
+        ship_it('wlk001')
+        self.assertEqual(self.quantities(), [0, 24, 80])
+        self.assertEqual(self.shipped(), [False, True])
+        updates = [stats['calls'] for key, stats in self.dal.stats().items()
+                   if key.startswith('UPDATE cookies')]
+        self.assertEqual(updates, [1])
+
+    def test_shortfall(self):
+        with self.assertRaises(InsufficientInventory) as raised:
+            ship_it('wlk001')
+        self.assertEqual(raised.exception.shortfalls,
+                         [(1, u'dark chocolate chip', 1, 2)])
+        self.assertEqual(self.quantities(), [1, 24, 100])
+        self.assertEqual(self.shipped(), [False, False])
+
+    def test_missing_cookie(self):
+        self.conn.execute(update(self.dal.cookies).values(quantity=50))
+        with self.assertRaises(InsufficientInventory) as raised:
+            ship_it('ol001')
+        self.assertEqual(raised.exception.shortfalls, [(4, None, None, 6)])
+        self.assertEqual(self.quantities(), [50, 50, 50])
+
+    def test_quantity_constraint(self):
+        with self.assertRaises(exc.IntegrityError):
+            self.conn.execute(update(self.dal.cookies).values(quantity=-1))
+
+
+class TestInventorySummary(unittest.TestCase):
+
+    def setUp(self):
+        self.dal = DataAccessLayer()
+        self.dal.db_init('sqlite:///:memory:')
+        self.patches = [mock.patch('db.dal', self.dal),
+                        mock.patch('app.dal', self.dal)]
+        for patch in self.patches:
+            patch.start()
+        prep_db()
+        self.conn = self.dal.connection
+        self.cookies = self.dal.cookies
+
+    def tearDown(self):
+        for patch in self.patches:
+            patch.stop()
+
+    def test_maintained(self):
+        self.assertEqual(tuple(get_inventory_summary()), (3, 125))
+        self.conn.execute(self.cookies.insert(), [
+            {'cookie_name': 'sugar', 'quantity': 10},
+            {'cookie_name': None, 'quantity': 5}])
+        self.conn.execute(self.cookies.update().where(
+            self.cookies.c.cookie_id == 2).values(quantity=4))
+        self.conn.execute(self.cookies.update().where(
+            self.cookies.c.cookie_name.is_(None)).values(
+                cookie_name='mystery', quantity=None))
+        self.conn.execute(self.cookies.delete().where(
+            self.cookies.c.cookie_id == 3))
+        self.assertEqual(tuple(get_inventory_summary()), (4, 15))
+        self.assertIsNone(self.dal.verify_inventory_summary())
+
+    def test_ship_it(self):
+        restock(self.conn, self.dal)
+        ship_it('wlk001')
+        self.assertEqual(tuple(get_inventory_summary()), (3, 112))
+        self.assertIsNone(self.dal.verify_inventory_summary())
+
+    def test_rolled_back(self):
+        trans = self.conn.begin()
+        self.conn.execute(self.cookies.delete())
+        trans.rollback()
+        self.assertEqual(tuple(get_inventory_summary()), (3, 125))
+
+    def test_verify_and_repair(self):
+        self.conn.execute(self.dal.inventory_summary.update().values(
+            total_quantity=0))
+        self.assertEqual(self.dal.verify_inventory_summary(repair=True),
+                         ((3, 0), (3, 125)))
+        self.assertIsNone(self.dal.verify_inventory_summary())
+
+    def test_seeded_from_existing_cookies(self):
+        self.conn.execute(self.dal.inventory_summary.delete())
+        self.dal.metadata.create_all(self.dal.engine)
+        self.assertEqual(tuple(get_inventory_summary()), (3, 125))
+
+
+class TestOrderCounters(unittest.TestCase):
+
+    def setUp(self):
+        self.dal = DataAccessLayer()
+        self.dal.db_init('sqlite:///:memory:')
+        self.patches = [mock.patch('db.dal', self.dal),
+                        mock.patch('app.dal', self.dal)]
+        for patch in self.patches:
+            patch.start()
+        prep_db()
+        self.conn = self.dal.connection
+        self.scanned = get_customer_summaries()
+
+    def tearDown(self):
+        for patch in self.patches:
+            patch.stop()
+
+    def summaries(self):
+        return [tuple(row) for row in get_customer_summaries()]
+
+    def test_enable(self):
+        self.dal.enable_order_counters()
+        self.assertEqual(self.summaries(), [
+            (1, u'cookiemon', 1, Cents(0)), (2, u'cakeeater', 1, Cents(0)),
+            (3, u'pieguy', 0, Cents(0))])
+        self.assertEqual(self.summaries(),
+                         [tuple(row) for row in self.scanned])
+        self.dal.statement_stats.reset()
+        self.assertEqual(tuple(get_customer_summary(2)),
+                         (2, u'cakeeater', 1, Cents(0)))
+        self.assertIsNone(get_customer_summary(99))
+        self.assertFalse([key for key in self.dal.stats()
+                          if 'orders' in key])
+
+    def test_maintained(self):
+        self.dal.enable_order_counters()
+        orders, line_items = self.dal.orders, self.dal.line_items
+        restock(self.conn, self.dal)
+        ship_it('wlk001')
+        self.assertEqual(tuple(get_customer_summary(1)),
+                         (1, u'cookiemon', 1, Cents(400)))
+        self.conn.execute(line_items.insert(), {
+            'order_id': 'wlk001', 'cookie_id': 2, 'quantity': 4,
+            'extended_cost': '1.00'})
+        self.conn.execute(line_items.update().where(
+            line_items.c.cookie_id == 1).values(extended_cost='2.50'))
+        self.conn.execute(line_items.delete().where(
+            line_items.c.cookie_id == 3))
+        self.conn.execute(orders.insert(), {
+            'order_id': 'pie001', 'user_id': 3, 'shipped': True})
+        self.conn.execute(line_items.insert(), {
+            'order_id': 'pie001', 'cookie_id': 2, 'quantity': 1,
+            'extended_cost': '0.25'})
+        self.conn.execute(orders.update().where(
+            orders.c.order_id == 'ol001').values(user_id=3))
+        self.assertEqual(self.summaries(), [
+            (1, u'cookiemon', 1, Cents(350)), (2, u'cakeeater', 0, Cents(0)),
+            (3, u'pieguy', 2, Cents(25))])
+        self.conn.execute(orders.delete().where(
+            orders.c.order_id == 'wlk001'))
+        self.conn.execute(orders.update().where(
+            orders.c.order_id == 'pie001').values(shipped=False))
+        self.assertEqual(self.summaries(), [
+            (1, u'cookiemon', 0, Cents(0)), (2, u'cakeeater', 0, Cents(0)),
+            (3, u'pieguy', 2, Cents(0))])
+        self.assertEqual(self.dal.verify_order_counters(), [])
+
+    def test_verify_and_repair(self):
+        self.dal.enable_order_counters()
+        users = self.dal.users
+        self.conn.execute(users.update().where(users.c.user_id == 2).values(
+            order_count=7, lifetime_spend=Cents(1)))
+        self.assertEqual(self.dal.verify_order_counters(repair=True),
+                         [(2, (7, Cents(1)), (1, Cents(0)))])
+        self.assertEqual(self.dal.verify_order_counters(), [])
+
+    def test_added_to_existing_database(self):
+        self.conn.execute('ALTER TABLE users DROP COLUMN order_count')
+        self.conn.execute('ALTER TABLE users DROP COLUMN lifetime_spend')
+        self.dal.enable_order_counters()
+        self.dal.enable_order_counters()
+        self.assertEqual(self.summaries(),
+                         [tuple(row) for row in self.scanned])
+
+
+class TestPooledDataAccessLayer(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.dal = DataAccessLayer(wait_threshold=0.1)
+        self.dal.db_init('sqlite:///' + os.path.join(self.tmpdir, 'pool.db'),
+                         pooled=True, pool_size=1, max_overflow=1,
+                         pool_timeout=0.2)
+
+    def tearDown(self):
+        self.dal.engine.dispose()
+        shutil.rmtree(self.tmpdir)
+
+    def test_in_memory_rejected(self):
+        with self.assertRaises(ValueError):
+            DataAccessLayer().db_init('sqlite:///:memory:', pooled=True)
+
+    def test_not_pooled(self):
+        with self.assertRaises(RuntimeError):
+            dal.checkout()
+        with self.assertRaises(RuntimeError):
+            dal.pool_stats()
+
+    def test_outside_scope(self):
+        with self.assertRaises(RuntimeError):
+            self.dal.connection.execute(self.dal.users.select())
+
+    def test_thread_gets_own_connection(self):
+        seen = {}
+        barrier = threading.Barrier(2)
+
+        def worker():
+            with self.dal.connect_scope() as conn:
+                seen['worker'] = conn.connection.connection
+                barrier.wait()
+                conn.execute(self.dal.users.select()).fetchall()
+
+        with self.dal.connect_scope() as conn:
+            thread = threading.Thread(target=worker)
+            thread.start()
+            barrier.wait()
+            with self.dal.connect_scope() as nested:
+                self.assertIs(nested, conn)
+            self.dal.connection.execute(self.dal.users.select()).fetchall()
+            thread.join()
+            self.assertIsNot(seen['worker'], conn.connection.connection)
+        self.assertEqual(self.dal.pool_stats()['checked_out'], 0)
+
+    def test_task_gets_own_connection(self):
+        seen = []
+
+        async def task():
+            with self.dal.connect_scope() as conn:
+                await asyncio.sleep(0)
+                self.assertIs(self.dal._scoped_connection.get(), conn)
+                seen.append(conn)
+
+        async def main():
+            await asyncio.gather(task(), task())
+
+        asyncio.run(main())
+        self.assertIsNot(seen[0], seen[1])
+        self.assertEqual(self.dal.pool_stats()['checked_out'], 0)
+
+    def test_pool_stats(self):
+        barrier = threading.Barrier(3)
+        release = threading.Event()
+
+        def worker():
+            with self.dal.connect_scope():
+                barrier.wait()
+                release.wait()
+
+        threads = [threading.Thread(target=worker) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        barrier.wait()
+        with self.assertRaises(exc.TimeoutError):
+            self.dal.checkout()
+        release.set()
+        for thread in threads:
+            thread.join()
+        stats = self.dal.pool_stats()
+        self.assertEqual(stats['checkouts'], 2)
+        self.assertEqual(stats['timeouts'], 1)
+        self.assertEqual(stats['waits'], 1)
+        self.assertGreaterEqual(stats['wait_time'], 0.2)
+        self.assertEqual(stats['peak_overflow'], 1)
+        self.assertEqual(stats['checked_out'], 0)
+
+    def test_app_in_pooled_mode(self):
+        results = {}
+
+        def worker(name):
+            results[name] = get_orders_by_customer('cookiemon')
+
+        with mock.patch('db.dal', self.dal), mock.patch('app.dal', self.dal):
+            prep_db()
+            threads = [threading.Thread(target=worker, args=(i,))
+                       for i in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        for result in results.values():
+            self.assertEqual(result, TestApp.cookie_orders)
+        self.assertEqual(self.dal.pool_stats()['checked_out'], 0)
+
+    def test_iter_orders_releases_connection_on_early_stop(self):
+        with mock.patch('db.dal', self.dal), mock.patch('app.dal', self.dal):
+            prep_db()
+            results = iter_orders_by_customer('cookiemon', details=True,
+                                              batch_size=1)
+            self.assertEqual(next(results), TestApp.cookie_details[0])
+            self.assertEqual(self.dal.pool_stats()['checked_out'], 1)
+            results.close()
+        self.assertEqual(self.dal.pool_stats()['checked_out'], 0)
+
+
+class TestAsyncDataAccessLayer(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.dal = DataAccessLayer()
+        self.async_dal = AsyncDataAccessLayer(self.dal)
+        asyncio.run(self.async_dal.db_init(
+            'sqlite:///' + os.path.join(self.tmpdir, 'async.db'),
+            pool_size=2, max_overflow=2))
+        self.patches = [mock.patch('db.dal', self.dal),
+                        mock.patch('app.dal', self.dal),
+                        mock.patch('app.async_dal', self.async_dal)]
+        for patch in self.patches:
+            patch.start()
+        prep_db()
+
+    def tearDown(self):
+        for patch in self.patches:
+            patch.stop()
+        asyncio.run(self.async_dal.close())
+        shutil.rmtree(self.tmpdir)
+
+    def test_concurrent_lookups(self):
+        async def main():
+            return await asyncio.gather(*[
+                get_orders_by_customer_async('cookiemon', False, True)
+                for _ in range(20)])
+
+        for result in asyncio.run(main()):
+            self.assertEqual(result, TestApp.cookie_details)
+        self.assertEqual(self.dal.pool_stats()['checked_out'], 0)
+
+    def test_ship_it(self):
+        async def main():
+            await ship_it_async('wlk001')
+            return await get_orders_by_customer_async('cookiemon', True)
+
+        restock(self.dal.engine, self.dal)
+        self.assertEqual(asyncio.run(main()), TestApp.cookie_orders)
+        quantities = self.dal.engine.execute(
+            select([self.dal.cookies.c.quantity])
+            .order_by(self.dal.cookies.c.cookie_id)).fetchall()
+        self.assertEqual(quantities, [(0,), (24,), (88,)])
+
+
+class TestReplicaRouting(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.dal = DataAccessLayer()
+        self.patches = [mock.patch('db.dal', self.dal),
+                        mock.patch('app.dal', self.dal)]
+        for patch in self.patches:
+            patch.start()
+
+    def tearDown(self):
+        for patch in self.patches:
+            patch.stop()
+        if not self.dal.pooled:
+            for conn in [self.dal.connection] + self.dal.replica_connections:
+                conn.close()
+        for engine in [self.dal.engine] + self.dal.replicas:
+            engine.dispose()
+        shutil.rmtree(self.tmpdir)
+
+    def url(self, name):
+        return 'sqlite:///' + os.path.join(self.tmpdir, name + '.db')
+
+    def init(self, **kwargs):
+        self.dal.db_init(self.url('primary'),
+                         replica_strings=[self.url('replica1'),
+                                          self.url('replica2')],
+                         **kwargs)
+        prep_db()
+
+    def test_reads_go_to_replicas(self):
+        self.init()
+        with self.assertRaises(exc.OperationalError):
+            get_orders_by_customer('cookiemon')
+        self.dal.sync_replicas()
+        self.assertEqual(get_orders_by_customer('cookiemon'),
+                         TestApp.cookie_orders)
+
+    def test_read_your_writes(self):
+        self.init()
+        restock(self.dal.engine, self.dal)
+        self.dal.sync_replicas()
+        ship_it('wlk001')
+        self.assertEqual(get_orders_by_customer('cookiemon', True), [])
+        with self.dal.read_your_writes():
+            self.assertEqual(get_orders_by_customer('cookiemon', True),
+                             TestApp.cookie_orders)
+        with self.dal.connect_scope():
+            self.assertEqual(get_orders_by_customer('cookiemon', True),
+                             TestApp.cookie_orders)
+
+    def test_async_read_your_writes(self):
+        async_dal = AsyncDataAccessLayer(self.dal)
+        asyncio.run(async_dal.db_init(
+            self.url('primary'), replica_strings=[self.url('replica1')]))
+        prep_db()
+        restock(self.dal.engine, self.dal)
+        self.dal.sync_replicas()
+        ship_it('wlk001')
+
+        async def main():
+            stale = await get_orders_by_customer_async('cookiemon', True)
+            with self.dal.read_your_writes():
+                fresh = await get_orders_by_customer_async('cookiemon', True)
+            return stale, fresh
+
+        with mock.patch('app.async_dal', async_dal):
+            self.assertEqual(asyncio.run(main()),
+                             ([], TestApp.cookie_orders))
+        asyncio.run(async_dal.close())
+
+    def test_round_robin(self):
+        self.init()
+        picked = []
+        for _ in range(4):
+            conn, release = self.dal.acquire(read_only=True)
+            picked.append(self.dal.replica_connections.index(conn))
+            release()
+        self.assertEqual(picked, [0, 1, 0, 1])
+
+    def test_least_busy(self):
+        self.init(replica_strategy='least_busy')
+        first, release_first = self.dal.acquire(read_only=True)
+        second, release_second = self.dal.acquire(read_only=True)
+        self.assertIsNot(first, second)
+        release_second()
+        third, release_third = self.dal.acquire(read_only=True)
+        self.assertIs(third, second)
+        release_first()
+        release_third()
+        self.assertEqual(self.dal._replica_busy, [0, 0])
+
+    def test_pooled(self):
+        self.init(pooled=True, pool_size=1, max_overflow=0)
+        self.dal.sync_replicas()
+        self.assertEqual(get_orders_by_customer('cookiemon', details=True),
+                         TestApp.cookie_details)
+        self.assertEqual(list(iter_orders_by_customer('cookiemon')),
+                         TestApp.cookie_orders)
+        for replica in self.dal.replicas:
+            self.assertEqual(replica.pool.checkedout(), 0)
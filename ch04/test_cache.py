@@ -0,0 +1,155 @@
+import unittest
+
+import mock
+from sqlalchemy.sql import delete, insert, update
+
+from cache import ResultCache
+from db import DataAccessLayer, prep_db
+from app import get_orders_by_customer, ship_it
+
+
+class FakeClock(object):
+    now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class TestResultCache(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.cache = ResultCache(max_entries=2, ttl=10, clock=self.clock)
+
+    def put(self, key, rows):
+        self.cache.put(key, rows, self.cache.token(key[0]))
+
+    def test_hit_and_miss(self):
+        self.assertIsNone(self.cache.get(('a', None, False)))
+        self.put(('a', None, False), [(1, 'a')])
+        self.assertEqual(self.cache.get(('a', None, False)), [(1, 'a')])
+        self.assertEqual(self.cache.stats['hits'], 1)
+        self.assertEqual(self.cache.stats['misses'], 1)
+
+    def test_lru_eviction(self):
+        self.put(('a', None, False), [])
+        self.put(('b', None, False), [])
+        self.cache.get(('a', None, False))
+        self.put(('c', None, False), [])
+        self.assertIsNone(self.cache.get(('b', None, False)))
+        self.assertEqual(self.cache.get(('a', None, False)), [])
+        self.assertEqual(self.cache.stats['evictions'], 1)
+
+    def test_ttl(self):
+        self.put(('a', None, False), [])
+        self.clock.now = 10
+        self.assertIsNone(self.cache.get(('a', None, False)))
+        self.assertEqual(self.cache.stats['expirations'], 1)
+
+    def test_memory_budget(self):
+        cache = ResultCache(max_bytes=2000)
+        rows = [(i, 'x' * 100) for i in range(5)]
+        cache.put(('a', None, False), rows, cache.token('a'))
+        cache.put(('b', None, False), rows, cache.token('b'))
+        self.assertEqual(len(cache), 1)
+        self.assertLessEqual(cache.size, 2000)
+        cache.put(('c', None, False), rows * 10, cache.token('c'))
+        self.assertIsNone(cache.get(('c', None, False)))
+
+    def test_stale_put_ignored(self):
+        token = self.cache.token('a')
+        self.cache.invalidate(['a'])
+        self.cache.put(('a', None, False), [], token)
+        self.assertIsNone(self.cache.get(('a', None, False)))
+
+
+class TestWriteInvalidation(unittest.TestCase):
+
+    def setUp(self):
+        self.dal = DataAccessLayer()
+        self.dal.db_init('sqlite:///:memory:')
+        self.patches = [mock.patch('db.dal', self.dal),
+                        mock.patch('app.dal', self.dal)]
+        for patch in self.patches:
+            patch.start()
+        prep_db()
+        self.cache = self.dal.enable_result_cache()
+        for cust_name in ('cookiemon', 'cakeeater'):
+            for details in (False, True):
+                get_orders_by_customer(cust_name, details=details)
+        self.cache.reset_stats()
+
+    def tearDown(self):
+        for patch in self.patches:
+            patch.stop()
+
+    def cached(self, cust_name):
+        return sorted(key[2] for key in self.cache._entries
+                      if key[0] == cust_name)
+
+    def test_hit(self):
+        get_orders_by_customer('cookiemon')
+        self.assertEqual(self.cache.stats['hits'], 1)
+
+    def test_ship_it_invalidates_only_that_customer(self):
+        self.dal.connection.execute(update(self.dal.cookies).values(
+            quantity=100))
+        ship_it('wlk001')
+        self.assertEqual(self.cached('cookiemon'), [])
+        self.assertEqual(self.cached('cakeeater'), [False, True])
+        self.assertEqual(get_orders_by_customer('cookiemon', True),
+                         [(u'wlk001', u'cookiemon', u'111-111-1111')])
+
+    def test_line_item_insert(self):
+        self.dal.connection.execute(insert(self.dal.line_items).values(
+            order_id='ol001', cookie_id=2, quantity=1, extended_cost=0.25))
+        self.assertEqual(self.cached('cakeeater'), [])
+        self.assertEqual(self.cached('cookiemon'), [False, True])
+        self.assertEqual(len(get_orders_by_customer('cakeeater',
+                                                    details=True)), 2)
+
+    def test_order_insert_for_user(self):
+        self.dal.connection.execute(self.dal.orders.insert(),
+                                    [{'order_id': 'wlk002', 'user_id': 1}])
+        self.assertEqual(self.cached('cookiemon'), [])
+        self.assertEqual(self.cached('cakeeater'), [False, True])
+
+    def test_cookie_quantity_update_keeps_entries(self):
+        self.dal.connection.execute(update(self.dal.cookies).values(
+            quantity=self.dal.cookies.c.quantity - 1))
+        self.assertEqual(len(self.cache), 4)
+
+    def test_cookie_rename_clears(self):
+        self.dal.connection.execute(update(self.dal.cookies).values(
+            cookie_name='chocolate'))
+        self.assertEqual(len(self.cache), 0)
+
+    def test_line_item_delete(self):
+        self.dal.connection.execute(delete(self.dal.line_items).where(
+            self.dal.line_items.c.order_id == 'ol001'))
+        self.assertEqual(self.cached('cakeeater'), [])
+        self.assertEqual(self.cached('cookiemon'), [False, True])
+        self.assertEqual(get_orders_by_customer('cakeeater', details=True),
+                         [])
+
+    def test_delete_without_where_clears(self):
+        self.dal.connection.execute(delete(self.dal.orders))
+        self.assertEqual(len(self.cache), 0)
+
+    def test_unwatched_delete_keeps_entries(self):
+        self.dal.connection.execute(delete(self.dal.inventory_summary))
+        self.assertEqual(len(self.cache), 4)
+
+    def test_text_write_clears(self):
+        self.dal.connection.execute('UPDATE orders SET shipped = 1')
+        self.assertEqual(len(self.cache), 0)
+
+    def test_rolled_back_write(self):
+        trans = self.dal.connection.begin()
+        stmt = update(self.dal.orders).values(shipped=True).where(
+            self.dal.orders.c.order_id == 'ol001')
+        self.dal.connection.execute(stmt)
+        self.assertEqual(self.cached('cakeeater'), [])
+        get_orders_by_customer('cakeeater')
+        trans.rollback()
+        self.assertEqual(self.cached('cakeeater'), [])
@@ -0,0 +1,109 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import mock
+from sqlalchemy.sql import select
+
+from db import DataAccessLayer, prep_db
+from app import get_orders_by_customer, get_orders_by_customers
+from instrument import BUCKETS, REDACTED, normalize
+
+
+class TestStatementStats(unittest.TestCase):
+
+    def setUp(self):
+        self.dal = DataAccessLayer()
+        self.dal.db_init('sqlite:///:memory:')
+        self.patches = [mock.patch('db.dal', self.dal),
+                        mock.patch('app.dal', self.dal)]
+        for patch in self.patches:
+            patch.start()
+        prep_db()
+        self.dal.statement_stats.reset()
+
+    def tearDown(self):
+        for patch in self.patches:
+            patch.stop()
+
+    def find(self, fragment):
+        matches = [stats for key, stats in self.dal.stats().items()
+                   if fragment in key]
+        self.assertEqual(len(matches), 1)
+        return matches[0]
+
+    def test_normalize(self):
+        self.assertEqual(normalize("SELECT *\n  FROM orders WHERE id = 12 "
+                                   "AND name = 'o''x' AND x IN (?, ?, ?)"),
+                         'SELECT * FROM orders WHERE id = ? AND name = ? '
+                         'AND x IN (?, ...)')
+
+    def test_calls_and_histogram(self):
+        get_orders_by_customer('cakeeater')
+        get_orders_by_customer('cookiemon')
+        stats = self.find('FROM users JOIN orders')
+        self.assertEqual(stats['calls'], 2)
+        self.assertEqual(sum(stats['histogram']), 2)
+        self.assertEqual(len(stats['histogram']), len(BUCKETS) + 1)
+        self.assertLessEqual(stats['min_time'], stats['mean_time'])
+        self.assertLessEqual(stats['mean_time'], stats['max_time'])
+
+    def test_in_lists_share_an_entry(self):
+        get_orders_by_customers(['cookiemon'])
+        get_orders_by_customers(['cookiemon', 'cakeeater'])
+        self.assertEqual(self.find('IN (?, ...)')['calls'], 1)
+        self.assertEqual(self.find('IN (?)')['calls'], 1)
+
+    def test_rows_for_writes(self):
+        self.dal.connection.execute(self.dal.cookies.update().values(
+            quantity=self.dal.cookies.c.quantity + 1))
+        self.assertEqual(self.find('UPDATE cookies')['rows'], 3)
+
+    def test_rows_for_reads(self):
+        rows = (get_orders_by_customer('cookiemon', details=True) +
+                get_orders_by_customer('cakeeater', details=True))
+        self.assertEqual(self.find('FROM users JOIN orders')['rows'],
+                         len(rows))
+        result = self.dal.connection.execute(select([self.dal.cookies]))
+        result.fetchone()
+        result.close()
+        self.assertEqual(self.find('FROM cookies')['rows'], 1)
+
+    def test_password_redacted(self):
+        users = self.dal.users
+        self.dal.connection.execute(users.insert(), [
+            {'username': 'u1', 'email_address': 'u1@cookie.com',
+             'phone': '1', 'password': 'secret1'},
+            {'username': 'u2', 'email_address': 'u2@cookie.com',
+             'phone': '2', 'password': 'secret2'}])
+        self.dal.connection.execute(select([users.c.user_id]).where(
+            users.c.password == 'secret1'))
+        params = self.find('INSERT INTO users')['last_parameters']
+        self.assertIn(REDACTED, params)
+        self.assertIn('u1', params)
+        self.assertNotIn('secret1', params)
+        params = self.find('WHERE users.password')['last_parameters']
+        self.assertEqual(params, [REDACTED])
+
+    def test_text_parameters_redacted(self):
+        self.dal.connection.execute(
+            'SELECT user_id FROM users WHERE password = ?', 'secret')
+        self.assertEqual(self.find('WHERE password')['last_parameters'],
+                         REDACTED)
+
+    def test_dump(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmpdir, 'stats.json')
+            get_orders_by_customer('cakeeater')
+            self.dal.start_stats_dump(path, interval=60)
+            self.dal.stop_stats_dump()
+            with open(path) as dumpfile:
+                dumped = json.load(dumpfile)
+            self.assertEqual(dumped['buckets'], list(BUCKETS))
+            self.assertEqual(set(dumped['statements']),
+                             set(self.dal.stats()))
+        finally:
+            shutil.rmtree(tmpdir)
@@ -0,0 +1,90 @@
+import csv
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from sqlalchemy.sql import select
+
+from db import DataAccessLayer
+from loader import LOAD_PROFILE, bulk_load, load_files
+
+
+class TestBulkLoad(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.dal = DataAccessLayer()
+        self.dal.db_init('sqlite:///' + os.path.join(self.tmpdir, 'load.db'))
+
+    def tearDown(self):
+        self.dal.connection.close()
+        self.dal.engine.dispose()
+        shutil.rmtree(self.tmpdir)
+
+    def write_csv(self, name, records):
+        path = os.path.join(self.tmpdir, name)
+        with open(path, 'w', newline='') as csvfile:
+            writer = csv.DictWriter(csvfile, fieldnames=list(records[0]))
+            writer.writeheader()
+            writer.writerows(records)
+        return path
+
+    def write_ndjson(self, name, records):
+        path = os.path.join(self.tmpdir, name)
+        with open(path, 'w') as ndjson:
+            for record in records:
+                ndjson.write(json.dumps(record) + '\n')
+        return path
+
+    def test_load_files(self):
+        paths = {
+            'cookies': self.write_csv('cookies.csv', [
+                {'cookie_name': 'chocolate chip', 'cookie_recipe_url': '',
+                 'cookie_sku': 'CC01', 'quantity': 12, 'unit_cost': 0.50},
+                {'cookie_name': 'molasses', 'cookie_recipe_url': '',
+                 'cookie_sku': 'MOL01', 'quantity': 1, 'unit_cost': 0.80}]),
+            'users': self.write_ndjson('users.ndjson', [
+                {'username': 'cookiemon', 'email_address': 'mon@cookie.com',
+                 'phone': '111-111-1111', 'password': 'password'}]),
+            'orders': self.write_ndjson('orders.ndjson', [
+                {'order_id': 1, 'username': 'cookiemon'}]),
+            'line_items': self.write_csv('line_items.csv', [
+                {'order_id': 1, 'cookie_sku': 'MOL01', 'quantity': 2,
+                 'extended_cost': 1.60},
+                {'order_id': 1, 'cookie_sku': 'CC01', 'quantity': 1,
+                 'extended_cost': 0.50}]),
+        }
+        counts = load_files(self.dal, paths, chunk_size=1)
+        self.assertEqual(counts, {'cookies': 2, 'users': 1, 'orders': 1,
+                                  'line_items': 2})
+        conn = self.dal.connection
+        self.assertEqual(conn.execute(select([self.dal.orders.c.user_id]))
+                         .fetchall(), [(1,)])
+        self.assertEqual(conn.execute(
+            select([self.dal.line_items.c.cookie_id])
+            .order_by(self.dal.line_items.c.line_items_id)).fetchall(),
+            [(2,), (1,)])
+        self.assertEqual(conn.execute(
+            select([self.dal.cookies.c.cookie_recipe_url])).fetchall(),
+            [(None,), (None,)])
+
+    def test_unknown_key_rolls_back(self):
+        with self.assertRaises(ValueError):
+            bulk_load(self.dal,
+                      cookies=[{'cookie_name': 'molasses',
+                                'cookie_sku': 'MOL01'}],
+                      line_items=[{'order_id': 1, 'cookie_sku': 'CC01'}])
+        self.assertEqual(self.dal.connection.execute(
+            self.dal.cookies.select()).fetchall(), [])
+
+    def test_profile_restores_pragmas(self):
+        conn = self.dal.connection
+        before = dict((name, conn.execute('PRAGMA ' + name).scalar())
+                      for name in LOAD_PROFILE)
+        bulk_load(self.dal, cookies=[{'cookie_name': 'molasses'}],
+                  profile=LOAD_PROFILE)
+        after = dict((name, conn.execute('PRAGMA ' + name).scalar())
+                     for name in LOAD_PROFILE)
+        self.assertEqual(after, before)
@@ -1,24 +1,24 @@
 import unittest
-from decimal import Decimal
 
 import mock
 
 from db import dal, prep_db
 from app import get_orders_by_customer
+from money import Cents
 
 
 class TestApp(unittest.TestCase):
     cookie_orders = [(u'wlk001', u'cookiemon', u'111-111-1111')]
     cookie_details = [
         (u'wlk001', u'cookiemon', u'111-111-1111',
-            u'dark chocolate chip', 2, Decimal('1.00')),
+            u'dark chocolate chip', 2, Cents(100)),
         (u'wlk001', u'cookiemon', u'111-111-1111',
-            u'oatmeal raisin', 12, Decimal('3.00'))]
+            u'oatmeal raisin', 12, Cents(300))]
 
-    @mock.patch('app.select')
+    @mock.patch('app.dal.orders_by_customer_stmt')
     @mock.patch('app.dal.connection')
-    def test_orders_by_customer_blank(self, mock_conn, mock_select):
-        mock_select.return_value.select_from.return_value.where.return_value = None
+    def test_orders_by_customer_blank(self, mock_conn, mock_stmt):
+        mock_stmt.return_value = None
         mock_conn.execute.return_value.fetchall.return_value = []
         results = get_orders_by_customer('')
         self.assertEqual(results, [])
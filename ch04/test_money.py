@@ -0,0 +1,118 @@
+import os
+import shutil
+import tempfile
+import unittest
+from decimal import Decimal
+
+import mock
+from sqlalchemy import MetaData, Numeric, create_engine, func
+from sqlalchemy.sql import select
+
+from db import DataAccessLayer, prep_db
+from app import get_orders_by_customer
+from money import Cents
+
+
+class TestCents(unittest.TestCase):
+
+    def test_parse(self):
+        self.assertEqual(Cents.parse('0.75'), Cents(75))
+        self.assertEqual(Cents.parse(0.29), Cents(29))
+        self.assertEqual(Cents.parse(Decimal('12')), Cents(1200))
+        self.assertEqual(Cents.parse('0.125'), Cents(12))
+        self.assertEqual(str(Cents(-5)), '-0.05')
+        self.assertEqual(Cents(1234).to_decimal(), Decimal('12.34'))
+
+    def test_arithmetic(self):
+        self.assertIsInstance(sum([Cents(25), Cents(75)]), Cents)
+        self.assertEqual(Cents(25) * 3, Cents(75))
+        self.assertEqual(3 * Cents(25) - Cents(5), Cents(70))
+        for bad in (lambda: Cents(25) + 1, lambda: Cents(25) * 0.5,
+                    lambda: Cents(25) * Cents(2)):
+            with self.assertRaises(TypeError):
+                bad()
+
+    def test_division(self):
+        self.assertEqual(divmod(Cents(100), 3), (Cents(33), Cents(1)))
+        self.assertIsInstance(Cents(150) // 3, Cents)
+        self.assertEqual(Cents(150) % Cents(100), Cents(50))
+        self.assertEqual(Cents(300) // Cents(100), 3)
+        for bad in (lambda: Cents(150) / 3, lambda: Cents(150) / Cents(3),
+                    lambda: 3 / Cents(150), lambda: Cents(150) // 1.5,
+                    lambda: 300 // Cents(150)):
+            with self.assertRaises(TypeError):
+                bad()
+
+    def test_comparisons(self):
+        self.assertLess(Cents(50), Cents(100))
+        self.assertGreater(Cents(1), 0)
+        self.assertEqual(Cents(0), 0)
+        self.assertNotEqual(Cents(150), 150)
+        self.assertNotEqual(150, Cents(150))
+        self.assertNotEqual(Cents(150), None)
+        self.assertEqual(len(set([Cents(5), Cents(5)])), 1)
+        for bad in (lambda: Cents(150) > 1.0, lambda: 1 < Cents(150),
+                    lambda: Cents(150) <= Decimal('1.50')):
+            with self.assertRaises(TypeError):
+                bad()
+
+
+class TestMoney(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.url = 'sqlite:///' + os.path.join(self.tmpdir, 'money.db')
+        self.dal = DataAccessLayer()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_sql_arithmetic(self):
+        self.dal.db_init(self.url)
+        with mock.patch('db.dal', self.dal):
+            prep_db()
+        cookies = self.dal.cookies
+        inv_cost = (cookies.c.quantity * cookies.c.unit_cost).label(
+            'inv_cost')
+        rows = self.dal.connection.execute(
+            select([inv_cost]).order_by(cookies.c.cookie_id)).fetchall()
+        self.assertEqual([row.inv_cost for row in rows],
+                         [Cents(75), Cents(600), Cents(10000)])
+        total = self.dal.connection.execute(
+            select([func.sum(inv_cost)])).scalar()
+        self.assertEqual((total, str(total)), (Cents(10675), '106.75'))
+        cheap = self.dal.connection.execute(select([
+            cookies.c.cookie_name]).where(cookies.c.unit_cost < 0.5)).scalar()
+        self.assertEqual(cheap, u'peanut butter')
+
+    def test_migrate(self):
+        old = MetaData()
+        for table in DataAccessLayer.metadata.sorted_tables:
+            table.tometadata(old)
+        old.tables['cookies'].c.unit_cost.type = Numeric(12, 2)
+        old.tables['line_items'].c.extended_cost.type = Numeric(12, 2)
+        engine = create_engine(self.url)
+        old.create_all(engine)
+        engine.execute(old.tables['cookies'].insert(), [
+            {'cookie_name': 'chip', 'quantity': 1,
+             'unit_cost': Decimal('0.29')}])
+        engine.execute(old.tables['users'].insert(), [
+            {'username': 'cookiemon', 'email_address': 'mon@cookie.com',
+             'phone': '111-111-1111', 'password': 'password'}])
+        engine.execute(old.tables['orders'].insert(), [
+            {'order_id': 'wlk001', 'user_id': 1}])
+        engine.execute(old.tables['line_items'].insert(), [
+            {'order_id': 'wlk001', 'cookie_id': 1, 'quantity': 3,
+             'extended_cost': Decimal('0.87')}])
+        engine.dispose()
+
+        self.dal.db_init(self.url)
+        self.assertEqual(self.dal.migrate_money(),
+                         ['cookies.unit_cost', 'line_items.extended_cost'])
+        self.assertEqual(self.dal.migrate_money(), [])
+        self.assertEqual(self.dal.connection.execute(
+            select([self.dal.cookies.c.unit_cost])).scalar(), Cents(29))
+        with mock.patch('app.dal', self.dal):
+            self.assertEqual(get_orders_by_customer('cookiemon', details=True),
+                             [(u'wlk001', u'cookiemon', u'111-111-1111',
+                               u'chip', 3, Cents(87))])
@@ -0,0 +1,118 @@
+import unittest
+from datetime import datetime
+from decimal import Decimal
+
+import mock
+from sqlalchemy import desc
+from sqlalchemy.sql import select
+
+from db import DataAccessLayer, prep_db
+from app import COOKIE_LISTING, list_cookies
+from money import Cents
+from pagination import Keyset
+
+
+class TestKeyset(unittest.TestCase):
+
+    def setUp(self):
+        self.dal = DataAccessLayer()
+        self.dal.db_init('sqlite:///:memory:')
+        self.patches = [mock.patch('db.dal', self.dal),
+                        mock.patch('app.dal', self.dal)]
+        for patch in self.patches:
+            patch.start()
+        prep_db()
+        self.dal.connection.execute(self.dal.cookies.insert(), [
+            {'cookie_name': 'cookie {}'.format(i % 5), 'quantity': i % 3,
+             'unit_cost': Decimal('0.50')} for i in range(20)])
+
+    def tearDown(self):
+        for patch in self.patches:
+            patch.stop()
+
+    def pages(self, keyset, query, size, conn=None):
+        pages, cursor = [], None
+        while True:
+            page = keyset.page(query, cursor, size, conn=conn)
+            pages.append(page.rows)
+            cursor = page.next_cursor
+            if cursor is None:
+                return pages
+
+    def test_list_cookies(self):
+        pages, cursor = [], None
+        while True:
+            page = list_cookies(cursor, size=4)
+            pages.append([row.cookie_id for row in page.rows])
+            cursor = page.next_cursor
+            if cursor is None:
+                break
+        cookies = self.dal.cookies
+        expected = [row[0] for row in self.dal.connection.execute(
+            select([cookies.c.cookie_id]).order_by(
+                cookies.c.quantity, cookies.c.cookie_name,
+                cookies.c.cookie_id))]
+        self.assertEqual(sum(pages, []), expected)
+        self.assertEqual([len(page) for page in pages], [4] * 5 + [3])
+
+    def test_mixed_directions(self):
+        cookies = self.dal.cookies
+        keyset = Keyset(desc(cookies.c.quantity), cookies.c.cookie_name,
+                        desc(cookies.c.cookie_id))
+        query = select([cookies.c.cookie_id, cookies.c.quantity,
+                        cookies.c.cookie_name])
+        rows = sum(self.pages(keyset, query, 3, self.dal.connection), [])
+        self.assertEqual(
+            [tuple(row) for row in rows],
+            sorted((tuple(row) for row in self.dal.connection.execute(
+                query)), key=lambda row: (-row[1], row[2], -row[0])))
+
+    def test_exact_last_page(self):
+        page = list_cookies(size=23)
+        self.assertEqual(len(page.rows), 23)
+        self.assertIsNone(page.next_cursor)
+
+    def test_cursor_checks(self):
+        cursor = list_cookies(size=2).next_cursor
+        other = Keyset(self.dal.cookies.c.cookie_id)
+        with self.assertRaises(ValueError):
+            other.decode(cursor)
+        with self.assertRaises(ValueError):
+            COOKIE_LISTING.decode('not a cursor')
+
+    def test_values_round_trip(self):
+        users = self.dal.users
+        keyset = Keyset(users.c.created_on, users.c.user_id)
+        row = {users.c.created_on: datetime(2016, 1, 2, 3, 4, 5, 6),
+               users.c.user_id: 7}
+        with mock.patch('pagination.RowProxy', dict):
+            cursor = keyset.cursor(row)
+        self.assertEqual(keyset.decode(cursor),
+                         [datetime(2016, 1, 2, 3, 4, 5, 6), 7])
+        keyset = Keyset(self.dal.cookies.c.unit_cost)
+        self.assertEqual(
+            keyset.decode(keyset.cursor(mock.Mock(unit_cost=Decimal('0.75')))),
+            [Decimal('0.75')])
+        value, = keyset.decode(keyset.cursor(mock.Mock(unit_cost=Cents(75))))
+        self.assertEqual((type(value), value), (Cents, Cents(75)))
+
+    def test_money_key(self):
+        cookies = self.dal.cookies
+        keyset = Keyset(cookies.c.unit_cost, cookies.c.cookie_id)
+        query = select([cookies.c.cookie_id, cookies.c.unit_cost])
+        page = keyset.page(query, size=21, conn=self.dal.connection)
+        rest = keyset.page(query, page.next_cursor, conn=self.dal.connection)
+        self.assertEqual([row.unit_cost for row in rest.rows],
+                         [Cents(75), Cents(100)])
+
+    def test_uses_index(self):
+        cursor = list_cookies(size=2).next_cursor
+        cookies = self.dal.cookies
+        query = COOKIE_LISTING.paginate(
+            select([cookies.c.cookie_id, cookies.c.cookie_name]), cursor, 2)
+        compiled = query.compile(self.dal.engine)
+        plan = ' '.join(str(row) for row in self.dal.connection.execute(
+            'EXPLAIN QUERY PLAN ' + str(compiled),
+            [compiled.params[name] for name in compiled.positiontup]))
+        self.assertIn('ix_cookies_quantity_name', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
@@ -1,7 +1,46 @@
-from db import Cookie, LineItem, Order, User,  dal
+from sqlalchemy import func, literal
+from sqlalchemy.orm import joinedload, selectinload, subqueryload
+from sqlalchemy.sql import select
 
+from db import Cookie, InventoryMovement, LineItem, Order, User,  dal
+from pagination import Keyset
+from projection import projection
+from streaming import stream
 
-def get_orders_by_customer(cust_name, shipped=None, details=False):
+# SQLite builds older than 3.32 reject statements with more than 999 bound
+# parameters; leave room for the shipped flag.
+MAX_NAMES_PER_QUERY = 990
+
+
+class InsufficientInventory(Exception):
+    """Raised by ship_it when the order asks for more of some cookies
+    than is on hand. ``shortfalls`` holds (cookie_id, cookie_name,
+    on_hand, requested) rows; cookie_name and on_hand are None for
+    cookies that do not exist."""
+
+    def __init__(self, order_id, shortfalls):
+        super(InsufficientInventory, self).__init__(
+            'order {} is short of cookies {}'.format(
+                order_id, [row[0] for row in shortfalls]))
+        self.order_id = order_id
+        self.shortfalls = shortfalls
+
+# Queries issued per chunk of ORDER_GRAPH_CHUNK orders. Cookies are always
+# joined onto their line items, so the count does not grow with the number
+# of distinct cookies. The chunk matches the selectin loader's own batch.
+ORDER_GRAPH_CHUNK = 500
+ORDER_GRAPH_LOADERS = {'selectin': selectinload, 'joined': joinedload,
+                       'subquery': subqueryload}
+ORDER_GRAPH_QUERIES = {'selectin': 2, 'joined': 1, 'subquery': 2}
+
+CookieStock = projection('CookieStock', Cookie.cookie_name, Cookie.quantity)
+OrderSummary = projection('OrderSummary', Order.order_id, User.username,
+                          Order.shipped)
+
+COOKIE_LISTING = Keyset(Cookie.quantity, Cookie.cookie_name, Cookie.cookie_id)
+
+
+def _orders_query(shipped=None, details=False):
     query = dal.session.query(Order.order_id, User.username, User.phone)
     query = query.join(User)
     if details:
@@ -10,5 +49,184 @@ def get_orders_by_customer(cust_name, shipped=None, details=False):
         query = query.join(LineItem).join(Cookie)
     if shipped is not None:
         query = query.filter(Order.shipped == shipped)
-    results = query.filter(User.username == cust_name).all()
+    return query
+
+
+def _orders_by_customer_query(cust_name, shipped=None, details=False):
+    query = _orders_query(shipped, details)
+    return query.filter(User.username == cust_name)
+
+
+def get_orders_by_customer(cust_name, shipped=None, details=False):
+    cache = dal.result_cache
+    if cache is not None:
+        key = (cust_name, shipped, details)
+        results = cache.get(key)
+        if results is not None:
+            return results
+        token = cache.token(cust_name)
+    params = {'cust_name': cust_name}
+    if shipped is not None:
+        params['shipped'] = shipped
+    query = dal.orders_by_customer_query(shipped, details)
+    results = query(dal.session).params(**params).all()
+    if cache is not None:
+        cache.put(key, results, token)
+    return results
+
+
+def get_orders_by_customers(cust_names, shipped=None, details=False):
+    cust_names = list(dict.fromkeys(cust_names))
+    results = dict((cust_name, []) for cust_name in cust_names)
+    query = _orders_query(shipped, details)
+    for start in range(0, len(cust_names), MAX_NAMES_PER_QUERY):
+        chunk = cust_names[start:start + MAX_NAMES_PER_QUERY]
+        for row in query.filter(User.username.in_(chunk)):
+            results[row.username].append(row)
     return results
+
+
+def iter_orders_by_customer(cust_name, shipped=None, details=False,
+                            batch_size=1000):
+    query = _orders_by_customer_query(cust_name, shipped, details)
+    query = query.yield_per(batch_size)
+    result = dal.session.execute(query.statement)
+    try:
+        for row in query.instances(result):
+            yield row
+    finally:
+        result.close()
+
+
+def order_graph_query_count(order_count, strategy='selectin'):
+    chunks = -(-order_count // ORDER_GRAPH_CHUNK)
+    return chunks * ORDER_GRAPH_QUERIES[strategy]
+
+
+def get_order_graphs(order_ids, strategy='selectin'):
+    """Load orders with their line items and cookies in at most
+    order_graph_query_count(len(order_ids), strategy) queries."""
+    if strategy not in ORDER_GRAPH_LOADERS:
+        raise ValueError('unknown loading strategy: {}'.format(strategy))
+    order_ids = sorted(set(order_ids))
+    # Building the query configures the mappers, which adds the
+    # Order.line_items backref used below.
+    query = dal.session.query(Order)
+    loader = ORDER_GRAPH_LOADERS[strategy](Order.line_items)
+    query = query.options(loader.joinedload(LineItem.cookie))
+    query = query.order_by(Order.order_id)
+    results = []
+    for start in range(0, len(order_ids), ORDER_GRAPH_CHUNK):
+        chunk = order_ids[start:start + ORDER_GRAPH_CHUNK]
+        results.extend(query.filter(Order.order_id.in_(chunk)))
+    return results
+
+
+def get_cookie(cookie_id):
+    cache = dal.second_level_cache
+    if cache is not None:
+        return cache.get(dal.session, Cookie, cookie_id)
+    return dal.session.query(Cookie).get(cookie_id)
+
+
+def get_cookies():
+    cache = dal.second_level_cache
+    if cache is not None:
+        return cache.all(dal.session, Cookie)
+    return dal.session.query(Cookie).order_by(Cookie.cookie_id).all()
+
+
+def iter_cookies(batch_size=1000):
+    return stream(dal.session.query(Cookie).order_by(Cookie.cookie_id),
+                  batch_size)
+
+
+def get_cookie_stock():
+    return CookieStock.all(dal.session.query(Cookie).order_by(
+        Cookie.cookie_id))
+
+
+def list_cookies(cursor=None, size=20):
+    """One page of cookies by quantity and name, with the cursor of the
+    next page or None on the last one."""
+    return COOKIE_LISTING.page(dal.session.query(Cookie), cursor, size)
+
+
+def search_cookies(text, limit=20):
+    """The cookies whose names match every word of ``text``, taking each
+    word as a prefix, best match first."""
+    hits = Cookie.search(text, limit=limit)
+    return dal.session.query(Cookie).join(
+        hits, Cookie.cookie_id == hits.c.cookie_id).order_by(
+        hits.c.rank).all()
+
+
+def get_order_summaries(shipped=None):
+    query = dal.session.query(Order).join(User).order_by(Order.order_id)
+    if shipped is not None:
+        query = query.filter(Order.shipped == shipped)
+    return OrderSummary.all(query)
+
+
+def _ship(session, order_id):
+    order = session.query(Order).options(
+        selectinload(Order.line_items).joinedload(LineItem.cookie)).filter(
+            Order.order_id == order_id).one()
+    requested, cookies = {}, {}
+    for line_item in order.line_items:
+        requested[line_item.cookie_id] = (
+            requested.get(line_item.cookie_id, 0) + line_item.quantity)
+        cookies[line_item.cookie_id] = line_item.cookie
+    shortfalls = []
+    for cookie_id in sorted(requested):
+        cookie = cookies[cookie_id]
+        if cookie is None:
+            shortfalls.append((cookie_id, None, None, requested[cookie_id]))
+        elif cookie.stock < requested[cookie_id]:
+            shortfalls.append((cookie_id, cookie.cookie_name,
+                               cookie.stock, requested[cookie_id]))
+    if shortfalls:
+        raise InsufficientInventory(order_id, shortfalls)
+    for cookie_id, quantity in requested.items():
+        cookies[cookie_id].quantity -= quantity
+    order.shipped = True
+
+
+def _ship_to_ledger(session, order_id):
+    """Append one movement per cookie instead of updating the cookie rows.
+    Each INSERT only happens while the derived stock covers it, which
+    SQLite's single writer makes race free; other databases need
+    serializable transactions for the same guarantee."""
+    movements = InventoryMovement.__table__
+    requested = session.query(LineItem.cookie_id, func.sum(LineItem.quantity))
+    requested = requested.filter(LineItem.order_id == order_id).group_by(
+        LineItem.cookie_id).order_by(LineItem.cookie_id).all()
+    short = {}
+    for cookie_id, quantity in requested:
+        on_hand = select([Cookie.stock]).where(Cookie.cookie_id == cookie_id)
+        append = movements.insert().from_select(
+            ['cookie_id', 'quantity', 'order_id'],
+            select([literal(cookie_id), literal(-quantity),
+                    literal(order_id)]).where(
+                        on_hand.as_scalar() >= quantity))
+        if session.execute(append).rowcount == 0:
+            short[cookie_id] = quantity
+    if short:
+        stock = dict((row[0], row[1:]) for row in session.query(
+            Cookie.cookie_id, Cookie.cookie_name, Cookie.stock).filter(
+                Cookie.cookie_id.in_(short)))
+        raise InsufficientInventory(order_id, [
+            (cookie_id,) + stock.get(cookie_id, (None, None)) + (quantity,)
+            for cookie_id, quantity in sorted(short.items())])
+    session.query(Order).filter(Order.order_id == order_id).update(
+        {Order.shipped: True}, synchronize_session=False)
+
+
+def ship_it(order_id, attempts=5):
+    """Ship an order in its own transaction. Cookie rows carry a version
+    counter, so a concurrent shipment of the same cookies makes the
+    commit fail and the whole order is retried against fresh stock.
+    With dal.inventory_ledger set, shipments append to the inventory
+    ledger instead and never touch the cookie rows."""
+    ship = _ship_to_ledger if dal.inventory_ledger else _ship
+    dal.run_in_transaction(lambda session: ship(session, order_id), attempts)
@@ -0,0 +1,125 @@
+import time
+import timeit
+import tracemalloc
+
+from sqlalchemy import util
+from sqlalchemy.sql import bindparam, select
+
+from db import Cookie, LineItem, Order, User, dal, prep_db
+from app import (_orders_by_customer_query, get_orders_by_customer,
+                 get_orders_by_customers)
+from projection import projection
+
+
+def report(label, func, number):
+    seconds = min(timeit.repeat(func, number=number, repeat=3))
+    print('{:<40} {:>10.0f} calls/s'.format(label, number / seconds))
+
+
+def core_orders_by_customer_stmt(shipped=None, details=False):
+    """The ch04 Core statement, built on the same tables."""
+    orders, users = Order.__table__, User.__table__
+    columns = [orders.c.order_id, users.c.username, users.c.phone]
+    joins = users.join(orders)
+    if details:
+        line_items, cookies = LineItem.__table__, Cookie.__table__
+        columns.extend([cookies.c.cookie_name, line_items.c.quantity,
+                        line_items.c.extended_cost])
+        joins = joins.join(line_items).join(cookies)
+    stmt = select(columns).select_from(joins).where(
+        users.c.username == bindparam('cust_name'))
+    if shipped is not None:
+        stmt = stmt.where(orders.c.shipped == bindparam('shipped'))
+    return stmt
+
+
+def bench_query_forms(number=2000):
+    conn = dal.engine.connect().execution_options(
+        compiled_cache=util.LRUCache(100))
+    for shipped in (None, False):
+        for details in (False, True):
+            label = 'shipped={}, details={}'.format(shipped, details)
+            params = {'cust_name': 'cookiemon'}
+            if shipped is not None:
+                params['shipped'] = shipped
+            stmt = core_orders_by_customer_stmt(shipped, details)
+            report('orm query   ' + label,
+                   lambda: _orders_by_customer_query(
+                       'cookiemon', shipped, details).all(), number)
+            report('orm baked   ' + label,
+                   lambda: get_orders_by_customer(
+                       'cookiemon', shipped, details), number)
+            report('core ch04   ' + label,
+                   lambda: conn.execute(stmt, params).fetchall(), number)
+    conn.close()
+
+
+def seed_customers(count):
+    names = ['bench{}'.format(i) for i in range(count)]
+    dal.session.bulk_insert_mappings(User, [
+        {'username': name, 'email_address': name + '@cookie.com',
+         'phone': '555-555-5555', 'password': 'password'}
+        for name in names])
+    user_ids = dict(dal.session.query(User.username, User.user_id))
+    dal.session.bulk_insert_mappings(Order, [
+        {'order_id': 10000 + i, 'user_id': user_ids[name]}
+        for i, name in enumerate(names)])
+    dal.session.bulk_insert_mappings(LineItem, [
+        {'order_id': 10000 + i, 'cookie_id': 1 + i % 2, 'quantity': 2,
+         'extended_cost': 1.00} for i in range(count)])
+    dal.session.commit()
+    return names
+
+
+def bench_batched_lookup(names, number=20):
+    for details in (False, True):
+        label = 'details={}'.format(details)
+        report('per-name loop ' + label,
+               lambda: [get_orders_by_customer(name, details=details)
+                        for name in names], number)
+        report('batched       ' + label,
+               lambda: get_orders_by_customers(names, details=details),
+               number)
+
+
+def bench_projections(count=100000):
+    dal.session.bulk_insert_mappings(Cookie, [
+        {'cookie_name': 'cookie {}'.format(i), 'cookie_sku': str(i),
+         'quantity': i, 'unit_cost': 0.50} for i in range(count)])
+    dal.session.commit()
+    query = dal.session.query(Cookie)
+    loaders = [
+        ('instances', lambda: query.all()),
+        ('column tuples',
+         lambda: query.with_entities(Cookie.cookie_name,
+                                     Cookie.quantity).all()),
+        ('slots projection',
+         lambda: projection('Stock', Cookie.cookie_name,
+                            Cookie.quantity).all(query)),
+        ('namedtuple projection',
+         lambda: projection('Stock', Cookie.cookie_name, Cookie.quantity,
+                            kind='namedtuple').all(query))]
+    for label, loader in loaders:
+        start = time.time()
+        rows = loader()
+        seconds = time.time() - start
+        del rows
+        dal.session.expunge_all()
+        tracemalloc.start()
+        rows = loader()
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        print('{:<24} {:>8} rows {:>7.3f} s {:>7.0f} bytes/row'.format(
+            label, len(rows), seconds, size / len(rows)))
+        del rows
+        dal.session.expunge_all()
+
+
+if __name__ == '__main__':
+    dal.conn_string = 'sqlite:///:memory:'
+    dal.connect()
+    dal.session = dal.Session()
+    prep_db(dal.session)
+    bench_query_forms()
+    bench_batched_lookup(seed_customers(500))
+    bench_projections()
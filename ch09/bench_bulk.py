@@ -0,0 +1,46 @@
+import time
+
+from db import Cookie, dal
+from bulk import flush_inserts
+
+
+def make_cookies(count):
+    return [Cookie(cookie_name='cookie {}'.format(i), cookie_sku=str(i),
+                   quantity=i, unit_cost='0.50') for i in range(count)]
+
+
+def add_and_flush(session, cookies):
+    session.add_all(cookies)
+    session.flush()
+
+
+def bulk_save(session, cookies):
+    session.bulk_save_objects(cookies)
+
+
+def returning_flush(session, cookies):
+    session.add_all(cookies)
+    flush_inserts(session)
+
+
+def bench_inserts(count=20000):
+    for label, insert in (('add + flush', add_and_flush),
+                          ('bulk_save_objects', bulk_save),
+                          ('flush_inserts', returning_flush)):
+        session = dal.Session()
+        cookies = make_cookies(count)
+        start = time.time()
+        insert(session, cookies)
+        with_keys = sum(1 for cookie in cookies
+                        if cookie.__dict__.get('cookie_id') is not None)
+        session.commit()
+        seconds = time.time() - start
+        print('{:<20} {:>7.3f} s {:>8.0f} rows/s  keys on {} of {}'.format(
+            label, seconds, count / seconds, with_keys, count))
+        session.close()
+
+
+if __name__ == '__main__':
+    dal.conn_string = 'sqlite:///:memory:'
+    dal.connect()
+    bench_inserts()
@@ -0,0 +1,73 @@
+import time
+import timeit
+
+from sqlalchemy import func
+
+from db import Cookie, dal, prep_db
+from app import search_cookies
+
+FLAVORS = ['dark chocolate', 'white chocolate', 'peanut butter', 'oatmeal',
+           'snickerdoodle', 'ginger', 'lemon', 'almond', 'coconut', 'maple']
+STYLES = ['chip', 'chunk', 'crinkle', 'sandwich', 'shortbread', 'biscotti',
+          'thumbprint']
+
+
+def report(label, func, number):
+    seconds = min(timeit.repeat(func, number=number, repeat=3))
+    print('{:<40} {:>10.3f} ms/query'.format(label, seconds / number * 1000))
+
+
+def seed_cookies(count, batch=50000):
+    for start in range(0, count, batch):
+        dal.engine.execute(Cookie.__table__.insert(), [
+            {'cookie_name': '{} {} {}'.format(
+                FLAVORS[i % len(FLAVORS)], STYLES[i % len(STYLES)], i),
+             'cookie_sku': str(i), 'quantity': i % 1000, 'unit_cost': 0.50,
+             'version_id': 1}
+            for i in range(start, min(start + batch, count))])
+
+
+def like_search(text, limit=20):
+    return dal.session.query(Cookie).filter(*[
+        Cookie.cookie_name.like('%{}%'.format(word))
+        for word in text.split()]).limit(limit).all()
+
+
+def like_count(text):
+    return dal.session.query(func.count(Cookie.cookie_id)).filter(*[
+        Cookie.cookie_name.like('%{}%'.format(word))
+        for word in text.split()]).scalar()
+
+
+def search_count(text):
+    hits = Cookie.search(text)
+    return dal.session.query(func.count(hits.c.cookie_id)).scalar()
+
+
+def bench_search(number=5):
+    # A selective search has few matches, so LIKE reads every row before
+    # it fills a page. 'biscotti' alone is in one name in seven; ranking
+    # its 140k matches is the worst case for the index.
+    for text in ('biscotti 123456', 'snick 4242', 'biscotti'):
+        report('like top 20   {!r}'.format(text),
+               lambda: like_search(text), number)
+        report('fts5 top 20   {!r}'.format(text),
+               lambda: search_cookies(text), number)
+        report('like count    {!r}'.format(text),
+               lambda: like_count(text), number)
+        report('fts5 count    {!r}'.format(text),
+               lambda: search_count(text), number)
+        dal.session.expunge_all()
+
+
+if __name__ == '__main__':
+    dal.conn_string = 'sqlite:///:memory:'
+    dal.connect()
+    dal.session = dal.Session()
+    prep_db(dal.session)
+    dal.session.commit()
+    seed_cookies(1000000)
+    start = time.time()
+    dal.enable_search()
+    print('index build {:.1f} s'.format(time.time() - start))
+    bench_search()
@@ -0,0 +1,111 @@
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+from sqlalchemy import event, func
+
+from db import Cookie, LineItem, Order, User, dal
+from app import InsufficientInventory, ship_it
+
+
+def set_wal(dbapi_conn, conn_record):
+    cursor = dbapi_conn.cursor()
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute('PRAGMA busy_timeout=5000')
+    cursor.close()
+
+
+def seed(orders, skus=20, stock=2000):
+    with dal.session_scope() as session:
+        session.bulk_insert_mappings(Cookie, [
+            {'cookie_name': 'cookie {}'.format(i), 'cookie_sku': str(i),
+             'quantity': stock, 'unit_cost': 0.50} for i in range(skus)])
+        session.bulk_insert_mappings(User, [
+            {'username': 'stress', 'email_address': 'stress@cookie.com',
+             'phone': '555-555-5555', 'password': 'password'}])
+        session.bulk_insert_mappings(Order, [
+            {'order_id': i, 'user_id': 1} for i in range(1, orders + 1)])
+        # Every order wants the best seller plus a couple of random SKUs,
+        # so the best seller runs out part way through.
+        line_items = []
+        for order_id in range(1, orders + 1):
+            for cookie_id in {1, random.randint(2, skus),
+                              random.randint(2, skus)}:
+                line_items.append({
+                    'order_id': order_id, 'cookie_id': cookie_id,
+                    'quantity': random.randint(1, 3),
+                    'extended_cost': 1.00})
+        session.bulk_insert_mappings(LineItem, line_items)
+    with dal.session_scope() as session:
+        return dict(session.query(Cookie.cookie_id, Cookie.quantity))
+
+
+def worker(order_ids, results, lock):
+    while True:
+        try:
+            order_id = order_ids.pop()
+        except IndexError:
+            return
+        try:
+            ship_it(order_id, attempts=50)
+            outcome = 'shipped'
+        except InsufficientInventory:
+            outcome = 'short'
+        with lock:
+            results[outcome] += 1
+
+
+def verify(stock):
+    with dal.session_scope() as session:
+        final = dict(session.query(Cookie.cookie_id, Cookie.stock))
+        sold = dict(session.query(LineItem.cookie_id,
+                                  func.sum(LineItem.quantity)).join(
+            Order).filter(Order.shipped == True).group_by(  # noqa: E712
+                LineItem.cookie_id))
+    for cookie_id, quantity in final.items():
+        assert quantity >= 0, 'cookie {} oversold'.format(cookie_id)
+        assert stock[cookie_id] - quantity == sold.get(cookie_id, 0), \
+            'cookie {} stock does not match shipments'.format(cookie_id)
+    return final
+
+
+def main(orders=2000, threads=16, ledger=0):
+    tmpdir = tempfile.mkdtemp()
+    try:
+        dal.conn_string = 'sqlite:///' + os.path.join(tmpdir, 'ship.db')
+        dal.inventory_ledger = bool(ledger)
+        dal.connect()
+        event.listen(dal.engine, 'connect', set_wal)
+        stock = seed(orders)
+        order_ids = list(range(orders, 0, -1))
+        results, lock = {'shipped': 0, 'short': 0}, threading.Lock()
+        workers = [threading.Thread(target=worker,
+                                    args=(order_ids, results, lock))
+                   for _ in range(threads)]
+        start = time.time()
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        seconds = time.time() - start
+        final = verify(stock)
+        if ledger:
+            dal.compact_inventory()
+            assert verify(stock) == final
+        print('{} {} orders on {} threads in {:.2f} s ({:.0f} orders/s): '
+              '{} shipped, {} short, {} retries, best seller left {}'.format(
+                  'ledger' if ledger else 'version', orders, threads,
+                  seconds, orders / seconds,
+                  results['shipped'], results['short'],
+                  dal.transaction_stats['retries'], final[1]))
+        dal.engine.dispose()
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,48 @@
+import time
+import tracemalloc
+
+from db import Cookie, dal
+from streaming import stream
+
+
+def load_cookies(count):
+    dal.engine.execute(Cookie.__table__.insert(), [
+        {'cookie_name': 'cookie {}'.format(i), 'cookie_sku': str(i),
+         'quantity': i, 'unit_cost': '0.50', 'version_id': 1}
+        for i in range(count)])
+
+
+def touch(cookie):
+    cookie.quantity += 1
+
+
+def bench_iteration(count=200000, batch_size=1000):
+    """Walk every cookie, reading it and then changing it, by plain
+    iteration, by yield_per alone and by stream(); changed objects stay
+    strongly referenced until a flush, so only stream() keeps them
+    bounded."""
+    load_cookies(count)
+    for job in (len, touch):
+        for label, iterate in (
+                ('query', lambda query: query),
+                ('yield_per', lambda query: query.yield_per(batch_size)),
+                ('stream', lambda query: stream(query, batch_size))):
+            session = dal.Session()
+            query = session.query(Cookie).order_by(Cookie.cookie_id)
+            tracemalloc.start()
+            start = time.time()
+            for cookie in iterate(query):
+                job(cookie.cookie_name if job is len else cookie)
+            session.commit()
+            seconds = time.time() - start
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            session.close()
+            print('{:<6} {:<10} {:>7.3f} s  peak {:>8.1f} MiB'.format(
+                job.__name__, label, seconds, peak / 2.0 ** 20))
+
+
+if __name__ == '__main__':
+    dal.conn_string = 'sqlite:///:memory:'
+    dal.connect()
+    bench_iteration()
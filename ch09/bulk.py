@@ -0,0 +1,212 @@
+from sqlalchemy import inspect, util
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.orm.interfaces import MANYTOONE, ONETOMANY
+from sqlalchemy.sql import bindparam
+from sqlalchemy.sql.dml import Insert
+from sqlalchemy.sql.elements import ClauseElement
+from sqlalchemy.sql.util import sort_tables
+
+
+# Multi-row statements are built once per table, column set and row
+# count, and compiled once per connection dialect; a batch then only binds.
+_STATEMENTS = util.LRUCache(100)
+_COMPILED = util.LRUCache(100)
+
+
+class ReturningInsert(Insert):
+    """An INSERT that renders its RETURNING clause on SQLite, which
+    supports it from 3.35 although the 1.3 SQLite compiler does not."""
+
+
+@compiles(ReturningInsert, 'sqlite')
+def _compile_returning_insert(element, compiler, **kw):
+    insert = element._clone()
+    insert._returning = None
+    columns = [compiler._label_select_column(None, column, True, False, {})
+               for column in element._returning]
+    return '{} RETURNING {}'.format(compiler.visit_insert(insert, **kw),
+                                    ', '.join(columns))
+
+
+def supports_returning(dialect):
+    return (dialect.name == 'sqlite' and
+            dialect.dbapi.sqlite_version_info >= (3, 35))
+
+
+def flush_inserts(session, batch_size=500):
+    """Flush ``session``, inserting its pending objects with one multi-row
+    INSERT ... RETURNING per mapper and batch instead of one INSERT per
+    object. Primary keys, version ids and column defaults are set on every
+    object, which becomes persistent just as after a flush, and rolls back
+    the same way. A second-level cache on the session's DataAccessLayer
+    is told about them as a flush would. Returns the objects inserted
+    this way.
+
+    Objects of inherited or self-referencing mappers, of mappers with
+    before_insert or after_insert listeners or with version counters they
+    set themselves (version_id_generator=False), with composite keys
+    left to the database, with pending many-to-many collections or whose
+    parent is not inserted here go through the normal flush, as do those
+    with SQL expressions for values and everything on a database without
+    RETURNING.
+
+    Rows from one statement come back in no promised order. Supplied keys
+    match them up; otherwise the keys SQLite allots to the rows of one
+    INSERT rise in VALUES order, so they are matched in key order."""
+    pending = sorted(session.new, key=lambda obj: inspect(obj).insert_order)
+    inserted = []
+    if pending and supports_returning(
+            session.get_bind(inspect(pending[0]).mapper).dialect):
+        by_table = {}
+        for obj in pending:
+            mapper = inspect(obj).mapper
+            if _eligible(mapper):
+                by_table.setdefault(mapper.local_table, []).append(obj)
+        with session.no_autoflush:
+            for table in sort_tables(by_table):
+                inserted.extend(_insert(session, table, by_table[table],
+                                        batch_size))
+    cache = getattr(getattr(session, 'dal', None), 'second_level_cache', None)
+    if inserted and cache is not None:
+        cache.written(session, inserted)
+    session.flush()
+    return inserted
+
+
+def _eligible(mapper):
+    table = mapper.local_table
+    return (mapper.inherits is None and not mapper.polymorphic_map and
+            (mapper.version_id_col is None or
+             mapper.version_id_generator is not False) and
+            not mapper.dispatch.before_insert and
+            not mapper.dispatch.after_insert and
+            not any(fk.column.table is table for fk in table.foreign_keys))
+
+
+def _column_keys(mapper):
+    table = mapper.local_table
+    return dict((column, prop.key) for prop in mapper.column_attrs
+                for column in prop.columns
+                if getattr(column, 'table', None) is table)
+
+
+def _insert(session, table, objs, batch_size):
+    mapper = inspect(objs[0]).mapper
+    keys = _column_keys(mapper)
+    primary_key = list(table.primary_key.columns)
+    batches = {}
+    for obj in objs:
+        params = _params(mapper, keys, obj)
+        if params is None:
+            continue
+        supplied = tuple(sorted(params))
+        if (len(primary_key) > 1 and
+                any(column.key not in params for column in primary_key)):
+            continue
+        batches.setdefault(supplied, []).append((obj, params))
+    inserted = []
+    for supplied, rows in batches.items():
+        for start in range(0, len(rows), batch_size):
+            batch = rows[start:start + batch_size]
+            stmt = _statement(table, keys, supplied, len(batch))
+            conn = session.connection(mapper=mapper, clause=stmt)
+            params = {}
+            for row, (obj, values) in enumerate(batch):
+                for key, value in values.items():
+                    params['{}_r{}'.format(key, row)] = value
+            result = conn.execution_options(
+                compiled_cache=_COMPILED).execute(stmt, params)
+            fetched = result.fetchall()
+            result.close()
+            states = set()
+            for obj, row in _match(primary_key, batch, fetched):
+                state = inspect(obj)
+                for column, key in keys.items():
+                    state.dict[key] = row[column]
+                _sync_children(mapper, obj)
+                states.add(state)
+                inserted.append(obj)
+            # What the unit of work does once a flush has inserted rows.
+            session._register_persistent(states)
+            unloaded = [prop.key for prop in mapper.column_attrs
+                        if prop.key not in keys.values()]
+            for state in states:
+                state._expire_attributes(state.dict, unloaded)
+    return inserted
+
+
+def _statement(table, keys, supplied, rows):
+    key = (table, supplied, rows)
+    stmt = _STATEMENTS.get(key)
+    if stmt is None:
+        stmt = ReturningInsert(table).values([
+            dict((name, bindparam('{}_r{}'.format(name, row)))
+                 for name in supplied) for row in range(rows)]).returning(
+                     *keys)
+        _STATEMENTS[key] = stmt
+    return stmt
+
+
+def _params(mapper, keys, obj):
+    """The column values of ``obj``, after copying in the keys of parents
+    it references; None when a parent has no key yet."""
+    state = inspect(obj)
+    for prop in mapper.relationships:
+        if prop.direction is not MANYTOONE:
+            continue
+        parent = state.dict.get(prop.key)
+        if parent is None:
+            continue
+        parent_mapper = inspect(parent).mapper
+        for local, remote in prop.local_remote_pairs:
+            value = getattr(parent,
+                            parent_mapper.get_property_by_column(remote).key)
+            if value is None:
+                return None
+            state.dict[keys[local]] = value
+    for prop in mapper.relationships:
+        if prop.secondary is not None and state.dict.get(prop.key):
+            return None
+    params = {}
+    for column, key in keys.items():
+        if key in state.dict:
+            value = state.dict[key]
+            if isinstance(value, ClauseElement):
+                return None
+            if value is not None or not column.primary_key:
+                params[column.key] = value
+        elif column is mapper.version_id_col:
+            params[column.key] = mapper.version_id_generator(None)
+    return params
+
+
+def _sync_children(mapper, obj):
+    """Copy the new key of ``obj`` into the pending children of its
+    one-to-many collections, which are inserted after it."""
+    state = inspect(obj)
+    for prop in mapper.relationships:
+        if prop.direction is not ONETOMANY or prop.secondary is not None:
+            continue
+        children = state.dict.get(prop.key)
+        if not children:
+            continue
+        for child in (children if prop.uselist else [children]):
+            child_state = inspect(child)
+            if child_state.key is not None:
+                continue
+            for local, remote in prop.local_remote_pairs:
+                value = state.dict[mapper.get_property_by_column(local).key]
+                child_state.dict[child_state.mapper.get_property_by_column(
+                    remote).key] = value
+
+
+def _match(primary_key, batch, rows):
+    if len(primary_key) == 1 and primary_key[0].key not in batch[0][1]:
+        column, = primary_key
+        rows = sorted(rows, key=lambda row: row[column])
+        return [(obj, row) for (obj, params), row in zip(batch, rows)]
+    by_key = dict((tuple(row[column] for column in primary_key), row)
+                  for row in rows)
+    return [(obj, by_key[tuple(params[column.key]
+                               for column in primary_key)])
+            for obj, params in batch]
@@ -1,9 +1,27 @@
+import contextvars
+import random
+import threading
+import time
+from contextlib import contextmanager
 from datetime import datetime
 
-from sqlalchemy import (Column, Integer, Numeric, String, DateTime, ForeignKey,
-                        Boolean, create_engine)
+from sqlalchemy import (Column, Integer, String, DateTime, ForeignKey,
+                        Boolean, CheckConstraint, Index, create_engine, event,
+                        exc, func)
+from sqlalchemy.ext import baked
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import relationship, backref, sessionmaker
+from sqlalchemy.ext.hybrid import hybrid_property, hybrid_method
+from sqlalchemy.orm import (relationship, backref, sessionmaker, Session,
+                            column_property)
+from sqlalchemy.orm.exc import StaleDataError
+from sqlalchemy.sql import bindparam, select
+from sqlalchemy.sql.dml import UpdateBase
+
+import search
+from bulk import flush_inserts
+from cache import _TEXT_WRITE, ResultCache, SecondLevelCache, WriteWatcher
+from instrument import StatementStats
+from money import Money, migrate_to_cents
 
 
 conn_string = 'some conn string'
@@ -12,13 +30,37 @@ Base = declarative_base()
 
 class Cookie(Base):
     __tablename__ = 'cookies'
+    __table_args__ = (CheckConstraint('quantity >= 0',
+                                      name='quantity_positive'),
+                      # Serves the keyset-paginated stock listing; SQLite
+                      # appends the cookie_id rowid as the tie-breaker.
+                      Index('ix_cookies_quantity_name', 'quantity',
+                            'cookie_name'))
 
     cookie_id = Column(Integer, primary_key=True)
     cookie_name = Column(String(50), index=True)
     cookie_recipe_url = Column(String(255))
     cookie_sku = Column(String(55))
     quantity = Column(Integer())
-    unit_cost = Column(Numeric(12, 2))
+    unit_cost = Column(Money())
+    version_id = Column(Integer(), nullable=False)
+
+    __mapper_args__ = {'version_id_col': version_id}
+
+    @hybrid_property
+    def inventory_value(self):
+        return self.unit_cost * self.stock
+
+    @hybrid_method
+    def bake_more(self, min_quantity):
+        return self.stock < min_quantity
+
+    @classmethod
+    def search(cls, text, prefix=True, limit=None):
+        """Full-text matches for ``text`` as a (cookie_id, rank) subquery;
+        join it to Cookie and order by rank, lower is better. Needs
+        dal.enable_search()."""
+        return search.matches(text, prefix, limit)
 
     def __repr__(self):
         return "Cookie(cookie_name='{self.cookie_name}', " \
@@ -65,7 +107,7 @@ class LineItem(Base):
     order_id = Column(Integer(), ForeignKey('orders.order_id'))
     cookie_id = Column(Integer(), ForeignKey('cookies.cookie_id'))
     quantity = Column(Integer())
-    extended_cost = Column(Numeric(12, 2))
+    extended_cost = Column(Money())
 
     order = relationship("Order", backref=backref('line_items',
                                                   order_by=line_item_id))
@@ -79,78 +121,381 @@ class LineItem(Base):
                 self=self)
 
 
-class DataAccessLayer:
+class InventoryMovement(Base):
+    __tablename__ = 'inventory_movements'
+    movement_id = Column(Integer(), primary_key=True)
+    cookie_id = Column(Integer(), ForeignKey('cookies.cookie_id'), index=True)
+    quantity = Column(Integer(), nullable=False)
+    order_id = Column(Integer(), ForeignKey('orders.order_id'))
+    created_on = Column(DateTime(), default=datetime.now)
 
-    def __init__(self):
-        self.engine = None
-        self.session = None
-        self.conn_string = conn_string
+    def __repr__(self):
+        return "InventoryMovement(cookie_id={self.cookie_id}, " \
+            "quantity={self.quantity}, " \
+            "order_id={self.order_id})".format(self=self)
 
-    def connect(self):
-        self.engine = create_engine(self.conn_string)
-        Base.metadata.create_all(self.engine)
-        self.Session = sessionmaker(bind=self.engine)
 
+# Stock on hand: the snapshot in cookies.quantity plus the movements that
+# have not been compacted into it yet. Without the ledger there are none.
+Cookie.stock = column_property(
+    Cookie.quantity + select([
+        func.coalesce(func.sum(InventoryMovement.quantity), 0)]).where(
+            InventoryMovement.cookie_id == Cookie.cookie_id).as_scalar())
 
-dal = DataAccessLayer()
 
+class RoutingSession(Session):
+    """Sends reads to a replica picked by the DataAccessLayer; flushes,
+    bulk operations, textual INSERT, UPDATE, DELETE and REPLACE statements
+    and every read after a write in the same transaction stay on the
+    primary."""
 
-def prep_db(session):
-    c1 = Cookie(cookie_name='dark chocolate chip',
-                cookie_recipe_url='http://some.aweso.me/cookie/dark_cc.html',
-                cookie_sku='CC02',
-                quantity=1,
-                unit_cost=0.75)
-    c2 = Cookie(cookie_name='peanut butter',
-                cookie_recipe_url='http://some.aweso.me/cookie/peanut.html',
-                cookie_sku='PB01',
-                quantity=24,
-                unit_cost=0.25)
-    c3 = Cookie(cookie_name='oatmeal raisin',
-                cookie_recipe_url='http://some.okay.me/cookie/raisin.html',
-                cookie_sku='EWW01',
-                quantity=100,
-                unit_cost=1.00)
-    session.bulk_save_objects([c1, c2, c3])
-    session.commit()
+    def __init__(self, dal=None, **kwargs):
+        super(RoutingSession, self).__init__(**kwargs)
+        self.dal = dal
+        self.read_your_writes = False
+        self._wrote = False
 
-    cookiemon = User(username='cookiemon',
-                     email_address='mon@cookie.com',
-                     phone='111-111-1111',
-                     password='password')
-    cakeeater = User(username='cakeeater',
-                     email_address='cakeeater@cake.com',
-                     phone='222-222-2222',
-                     password='password')
-    pieperson = User(username='pieperson',
-                     email_address='person@pie.com',
-                     phone='333-333-3333',
-                     password='password')
-    session.add(cookiemon)
-    session.add(cakeeater)
-    session.add(pieperson)
-    session.commit()
+    def get_bind(self, mapper=None, clause=None):
+        dal = self.dal
+        if (self._flushing or isinstance(clause, UpdateBase) or
+                _TEXT_WRITE.match(getattr(clause, 'text', ''))):
+            self._wrote = True
+        if (dal is None or not dal.replicas or self.read_your_writes or
+                self._wrote):
+            return super(RoutingSession, self).get_bind(mapper, clause)
+        return dal.pick_replica()
 
-    o1 = Order()
-    o1.user = cookiemon
-    session.add(o1)
 
-    line1 = LineItem(cookie=c1, quantity=2, extended_cost=1.00)
+@event.listens_for(RoutingSession, 'after_commit')
+@event.listens_for(RoutingSession, 'after_rollback')
+def _clear_written(session):
+    session._wrote = False
 
-    line2 = LineItem(cookie=c3, quantity=12, extended_cost=3.00)
 
-    o1.line_items.append(line1)
-    o1.line_items.append(line2)
-    session.commit()
+class ScopedSession(object):
+    """Stands in for dal.session and forwards to the session of the
+    enclosing dal.session_scope() in the current thread or task."""
+
+    def __init__(self, dal):
+        object.__setattr__(self, '_dal', dal)
+
+    def _current(self):
+        session = self._dal._scoped_session.get()
+        if session is None:
+            raise RuntimeError('dal.session used outside dal.session_scope()')
+        return session
+
+    def __getattr__(self, name):
+        return getattr(self._current(), name)
 
-    o2 = Order()
-    o2.user = cakeeater
+    def __setattr__(self, name, value):
+        setattr(self._current(), name, value)
 
-    line1 = LineItem(cookie=c1, quantity=24, extended_cost=12.00)
-    line2 = LineItem(cookie=c3, quantity=6, extended_cost=6.00)
 
-    o2.line_items.append(line1)
-    o2.line_items.append(line2)
+class DataAccessLayer:
+
+    def __init__(self, session_pool_size=10):
+        self.engine = None
+        self.session = None
+        self.conn_string = conn_string
+        self.result_cache = None
+        self.second_level_cache = None
+        self.inventory_ledger = False
+        self.bakery = baked.bakery()
+        self.queries = {}
+        self.replica_strings = []
+        self.replica_strategy = 'round_robin'
+        self.replicas = []
+        self._replica_busy = {}
+        self._next_replica = 0
+        self._replica_lock = threading.Lock()
+        self.statement_stats = StatementStats()
+        self.session_pool_size = session_pool_size
+        self._scoped_session = contextvars.ContextVar(
+            'scoped_session', default=None)
+        self._session_lock = threading.Lock()
+        self._session_pool = []
+        self._live_sessions = set()
+        self.reset_session_stats()
+        self.reset_transaction_stats()
 
-    session.add(o2)
+    def connect(self):
+        if self.replica_strategy not in ('round_robin', 'least_busy'):
+            raise ValueError('unknown replica strategy: {}'.format(
+                self.replica_strategy))
+        self.engine = create_engine(self.conn_string)
+        self.statement_stats.listen(self.engine)
+        Base.metadata.create_all(self.engine)
+        self.replicas = [create_engine(replica_string)
+                         for replica_string in self.replica_strings]
+        self._replica_busy = dict((replica, 0) for replica in self.replicas)
+        for replica in self.replicas:
+            event.listen(replica, 'checkout', self._replica_checkout(replica))
+            event.listen(replica, 'checkin', self._replica_checkin(replica))
+            self.statement_stats.listen(replica)
+        self.Session = sessionmaker(bind=self.engine, class_=RoutingSession,
+                                    dal=self)
+        with self._session_lock:
+            self._session_pool = []
+        self.session = ScopedSession(self)
+
+    @contextmanager
+    def session_scope(self):
+        """Give the current thread or task a session for the duration of
+        the block, commit it on success, roll it back on error and return
+        it, closed, to the pool. Nested scopes share the outer session."""
+        session = self._scoped_session.get()
+        if session is not None:
+            yield session
+            return
+        session = self._checkout_session()
+        token = self._scoped_session.set(session)
+        try:
+            yield session
+            session.commit()
+        except BaseException:
+            session.rollback()
+            raise
+        finally:
+            self._scoped_session.reset(token)
+            self._checkin_session(session)
+
+    def run_in_transaction(self, func, attempts=5, backoff=0.005,
+                           max_backoff=0.2):
+        """Call func(session) with the session of a fresh session_scope(),
+        starting over with jittered exponential backoff when the commit
+        loses an optimistic locking race or SQLite reports the database as
+        locked. func must use that session, not dal.session, which the
+        caller may have set to a session of its own."""
+        if self._scoped_session.get() is not None:
+            raise RuntimeError('run_in_transaction() cannot retry inside '
+                               'an open session_scope()')
+        attempt = 1
+        while True:
+            try:
+                with self.session_scope() as session:
+                    return func(session)
+            except (StaleDataError, exc.OperationalError) as error:
+                if attempt >= attempts or not _is_conflict(error):
+                    raise
+                with self._session_lock:
+                    self.transaction_stats['retries'] += 1
+                time.sleep(random.uniform(
+                    0, min(max_backoff, backoff * 2 ** attempt)))
+                attempt += 1
+
+    def compact_inventory(self):
+        """Fold the inventory ledger into the cookies.quantity snapshot
+        and drop the folded movements. Returns how many were folded."""
+        def compact(session):
+            last = session.query(func.max(InventoryMovement.movement_id))
+            last = last.scalar()
+            if last is None:
+                return 0
+            movements = InventoryMovement.__table__
+            cookies = Cookie.__table__
+            folded = movements.c.movement_id <= last
+            delta = select([func.sum(movements.c.quantity)]).where(
+                folded).where(movements.c.cookie_id == cookies.c.cookie_id)
+            session.execute(cookies.update().where(
+                cookies.c.cookie_id.in_(
+                    select([movements.c.cookie_id]).where(folded))).values(
+                        quantity=cookies.c.quantity + delta.as_scalar(),
+                        version_id=cookies.c.version_id + 1))
+            return session.execute(movements.delete().where(folded)).rowcount
+        folded = self.run_in_transaction(compact)
+        if folded and self.second_level_cache is not None:
+            self.second_level_cache.invalidate(Cookie)
+        return folded
+
+    def reset_transaction_stats(self):
+        with self._session_lock:
+            self.transaction_stats = {'retries': 0}
+
+    def _checkout_session(self):
+        with self._session_lock:
+            if self._session_pool:
+                session = self._session_pool.pop()
+                self._session_counts['reused'] += 1
+            else:
+                session = None
+                self._session_counts['created'] += 1
+        if session is None:
+            session = self.Session()
+        with self._session_lock:
+            self._live_sessions.add(session)
+        return session
+
+    def _checkin_session(self, session):
+        session.close()
+        session.read_your_writes = False
+        session._wrote = False
+        with self._session_lock:
+            self._live_sessions.discard(session)
+            if len(self._session_pool) < self.session_pool_size:
+                self._session_pool.append(session)
+
+    def reset_session_stats(self):
+        with self._session_lock:
+            self._session_counts = {'created': 0, 'reused': 0}
+
+    def session_stats(self):
+        with self._session_lock:
+            sizes = [len(session.identity_map)
+                     for session in self._live_sessions]
+            return dict(self._session_counts, live=len(sizes),
+                        pooled=len(self._session_pool),
+                        identity_map_sizes=sorted(sizes),
+                        identity_map_total=sum(sizes))
+
+    def enable_result_cache(self, max_entries=1024, ttl=60,
+                            max_bytes=16 * 1024 * 1024):
+        self.result_cache = ResultCache(max_entries, ttl, max_bytes)
+        WriteWatcher(self.result_cache, User.__table__, Order.__table__,
+                     LineItem.__table__, Cookie.__table__).listen(self.engine)
+        return self.result_cache
+
+    def enable_second_level_cache(self, classes=(Cookie,), max_entries=10000):
+        self.second_level_cache = SecondLevelCache(classes, max_entries)
+        self.second_level_cache.listen(self.Session)
+        return self.second_level_cache
+
+    def flush_inserts(self, batch_size=500):
+        """Flush dal.session with pending inserts batched into multi-row
+        INSERT ... RETURNING statements; see bulk.flush_inserts."""
+        return flush_inserts(self.session, batch_size)
+
+    def migrate_money(self):
+        """Convert unit_cost and extended_cost of a database created with
+        Numeric(12, 2) columns to integer cents. Returns the names of the
+        columns converted; none on an up to date database."""
+        with self.engine.begin() as conn:
+            converted = migrate_to_cents(conn, Cookie.__table__.c.unit_cost,
+                                         LineItem.__table__.c.extended_cost)
+        return [str(column) for column in converted]
+
+    def enable_search(self):
+        """Build the FTS5 index over cookie names and keep it in sync with
+        triggers. Safe to call again; the index is rebuilt each time."""
+        with self.engine.begin() as conn:
+            search.install(conn)
+
+    def orders_by_customer_query(self, shipped=None, details=False):
+        key = ('orders_by_customer', shipped is not None, details)
+        query = self.queries.get(key)
+        if query is None:
+            query = self.bakery(lambda session: session.query(
+                Order.order_id, User.username, User.phone).join(User))
+            if details:
+                query += lambda q: q.add_columns(
+                    Cookie.cookie_name, LineItem.quantity,
+                    LineItem.extended_cost).join(LineItem).join(Cookie)
+            if shipped is not None:
+                query += lambda q: q.filter(
+                    Order.shipped == bindparam('shipped'))
+            query += lambda q: q.filter(
+                User.username == bindparam('cust_name'))
+            self.queries[key] = query
+        return query
+
+    def stats(self):
+        return self.statement_stats.snapshot()
+
+    def dump_stats(self, path):
+        self.statement_stats.dump(path)
+
+    def start_stats_dump(self, path, interval=60):
+        self.statement_stats.start_dump(path, interval)
+
+    def stop_stats_dump(self):
+        self.statement_stats.stop_dump()
+
+    def _replica_checkout(self, replica):
+        def checkout(dbapi_conn, conn_record, conn_proxy):
+            with self._replica_lock:
+                self._replica_busy[replica] += 1
+        return checkout
+
+    def _replica_checkin(self, replica):
+        def checkin(dbapi_conn, conn_record):
+            with self._replica_lock:
+                self._replica_busy[replica] -= 1
+        return checkin
+
+    def pick_replica(self):
+        with self._replica_lock:
+            if self.replica_strategy == 'least_busy':
+                return min(self.replicas, key=self._replica_busy.get)
+            replica = self.replicas[self._next_replica]
+            self._next_replica = (self._next_replica + 1) % len(self.replicas)
+            return replica
+
+    def sync_replicas(self):
+        source = self.engine.raw_connection()
+        try:
+            for replica in self.replicas:
+                target = replica.raw_connection()
+                try:
+                    source.connection.backup(target.connection)
+                finally:
+                    target.close()
+        finally:
+            source.close()
+
+
+def _is_conflict(error):
+    if isinstance(error, StaleDataError):
+        return True
+    return 'database is locked' in str(error.orig)
+
+
+dal = DataAccessLayer()
+
+
+def prep_db(session):
+    session.bulk_insert_mappings(Cookie, [
+        {'cookie_name': 'dark chocolate chip',
+         'cookie_recipe_url': 'http://some.aweso.me/cookie/dark_cc.html',
+         'cookie_sku': 'CC02',
+         'quantity': 1,
+         'unit_cost': 0.75},
+        {'cookie_name': 'peanut butter',
+         'cookie_recipe_url': 'http://some.aweso.me/cookie/peanut.html',
+         'cookie_sku': 'PB01',
+         'quantity': 24,
+         'unit_cost': 0.25},
+        {'cookie_name': 'oatmeal raisin',
+         'cookie_recipe_url': 'http://some.okay.me/cookie/raisin.html',
+         'cookie_sku': 'EWW01',
+         'quantity': 100,
+         'unit_cost': 1.00}])
+    session.bulk_insert_mappings(User, [
+        {'username': 'cookiemon',
+         'email_address': 'mon@cookie.com',
+         'phone': '111-111-1111',
+         'password': 'password'},
+        {'username': 'cakeeater',
+         'email_address': 'cakeeater@cake.com',
+         'phone': '222-222-2222',
+         'password': 'password'},
+        {'username': 'pieperson',
+         'email_address': 'person@pie.com',
+         'phone': '333-333-3333',
+         'password': 'password'}])
+
+    cookie_ids = dict(session.query(Cookie.cookie_sku, Cookie.cookie_id))
+    user_ids = dict(session.query(User.username, User.user_id))
+
+    session.bulk_insert_mappings(Order, [
+        {'order_id': 1, 'user_id': user_ids['cookiemon']},
+        {'order_id': 2, 'user_id': user_ids['cakeeater']}])
+    session.bulk_insert_mappings(LineItem, [
+        {'order_id': 1, 'cookie_id': cookie_ids['CC02'], 'quantity': 2,
+         'extended_cost': 1.00},
+        {'order_id': 1, 'cookie_id': cookie_ids['EWW01'], 'quantity': 12,
+         'extended_cost': 3.00},
+        {'order_id': 2, 'cookie_id': cookie_ids['CC02'], 'quantity': 24,
+         'extended_cost': 12.00},
+        {'order_id': 2, 'cookie_id': cookie_ids['EWW01'], 'quantity': 6,
+         'extended_cost': 6.00}])
     session.commit()
@@ -0,0 +1,119 @@
+import base64
+import json
+from collections import namedtuple
+from datetime import date, datetime
+from decimal import Decimal
+
+from sqlalchemy import Index, and_, or_
+from sqlalchemy.engine import RowProxy
+from sqlalchemy.sql import operators
+from sqlalchemy.sql.elements import UnaryExpression
+
+from money import Cents
+
+
+Page = namedtuple('Page', ['rows', 'next_cursor'])
+
+
+class Keyset(object):
+    """Seek pagination over a fixed sort key, for Core selects and ORM
+    queries alike. Columns sort ascending unless wrapped in desc(). Key
+    columns must not hold NULLs, and the last one must be unique so every
+    row has a distinct position.
+
+    Cursors are opaque strings recording the sort key of the last row
+    of a page; the next page starts strictly after it."""
+
+    def __init__(self, *order_by):
+        self.order_by = order_by
+        self.columns = []
+        for clause in order_by:
+            descending = (isinstance(clause, UnaryExpression) and
+                          clause.modifier is operators.desc_op)
+            if isinstance(clause, UnaryExpression):
+                clause = clause.element
+            self.columns.append((clause, clause.key, descending))
+        self.keys = [key for column, key, descending in self.columns]
+
+    def index(self, name, **kwargs):
+        return Index(name, *self.order_by, **kwargs)
+
+    def after(self, values):
+        """The criterion for rows strictly after ``values``, with the
+        leading column also bounded on its own so an index range scan
+        can start at the cursor."""
+        clauses = []
+        for position, (column, key, descending) in enumerate(self.columns):
+            equal = [self.columns[i][0] == values[i] for i in range(position)]
+            beyond = (column < values[position] if descending else
+                      column > values[position])
+            clauses.append(and_(*(equal + [beyond])))
+        column, key, descending = self.columns[0]
+        leading = column <= values[0] if descending else column >= values[0]
+        return and_(leading, or_(*clauses))
+
+    def paginate(self, query, cursor=None, size=20):
+        """Return ``query`` (a select() or an ORM Query) ordered by the
+        key, starting after ``cursor`` and fetching one row more than
+        ``size`` to tell whether another page follows."""
+        query = query.order_by(*self.order_by)
+        if cursor is not None:
+            after = self.after(self.decode(cursor))
+            query = (query.filter(after) if hasattr(query, 'filter')
+                     else query.where(after))
+        return query.limit(size + 1)
+
+    def page(self, query, cursor=None, size=20, conn=None):
+        """Fetch one page. Core selects need ``conn``; ORM queries run on
+        their own session."""
+        query = self.paginate(query, cursor, size)
+        rows = (conn.execute(query).fetchall() if conn is not None
+                else query.all())
+        if len(rows) <= size:
+            return Page(rows, None)
+        rows = rows[:size]
+        return Page(rows, self.cursor(rows[-1]))
+
+    def cursor(self, row):
+        if isinstance(row, RowProxy):
+            values = [row[column] for column, key, descending in self.columns]
+        else:
+            values = [getattr(row, key) for key in self.keys]
+        state = {'k': self.keys, 'v': [_encode(value) for value in values]}
+        return base64.urlsafe_b64encode(
+            json.dumps(state, separators=(',', ':')).encode()).decode()
+
+    def decode(self, cursor):
+        try:
+            state = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        except (ValueError, TypeError):
+            raise ValueError('malformed cursor')
+        if (not isinstance(state, dict) or state.get('k') != self.keys or
+                len(state.get('v', ())) != len(self.keys)):
+            raise ValueError('cursor does not match this sort key')
+        return [_decode(value) for value in state['v']]
+
+
+def _encode(value):
+    if isinstance(value, Cents):
+        return {'c': int(value)}
+    if isinstance(value, datetime):
+        return {'dt': value.isoformat()}
+    if isinstance(value, date):
+        return {'d': value.isoformat()}
+    if isinstance(value, Decimal):
+        return {'n': str(value)}
+    return value
+
+
+def _decode(value):
+    if isinstance(value, dict):
+        if 'dt' in value:
+            return datetime.fromisoformat(value['dt'])
+        if 'd' in value:
+            return date.fromisoformat(value['d'])
+        if 'n' in value:
+            return Decimal(value['n'])
+        if 'c' in value:
+            return Cents(value['c'])
+    return value
@@ -0,0 +1,85 @@
+from collections import namedtuple
+
+
+class Projection(object):
+    """Read-only rows built straight from a query's columns, with no
+    identity map, instance state or change tracking.
+
+    ``kind`` is 'slots' for a generated class with __slots__ or
+    'namedtuple' for a named tuple."""
+
+    def __init__(self, name, columns, kind='slots'):
+        if kind not in ('slots', 'namedtuple'):
+            raise ValueError('unknown projection kind: {}'.format(kind))
+        self.name = name
+        self.columns = columns
+        self.fields = tuple(column.key for column in columns)
+        for field in self.fields:
+            if not field.isidentifier() or field.startswith('_'):
+                raise ValueError('column {!r} needs a label'.format(field))
+        if len(set(self.fields)) != len(self.fields):
+            raise ValueError('duplicate fields: {}'.format(self.fields))
+        if kind == 'namedtuple':
+            self.row_class = namedtuple(name, self.fields)
+        else:
+            self.row_class = _slotted_class(name, self.fields)
+
+    def __repr__(self):
+        return 'Projection({!r}, {!r})'.format(self.name, self.fields)
+
+    def _execute(self, query):
+        query = query.with_entities(*self.columns)
+        return query.session.execute(query.statement, query._params)
+
+    def iter(self, query, batch_size=1000):
+        """Yield a row for each result of ``query`` with its entities
+        replaced by this projection's columns."""
+        result = self._execute(query)
+        make = self.row_class._make
+        try:
+            while True:
+                rows = result.fetchmany(batch_size)
+                if not rows:
+                    break
+                for row in map(make, rows):
+                    yield row
+        finally:
+            result.close()
+
+    def all(self, query):
+        return list(map(self.row_class._make,
+                        self._execute(query).fetchall()))
+
+
+def projection(name, *columns, **kwargs):
+    return Projection(name, columns, **kwargs)
+
+
+def _slotted_class(name, fields):
+    args = ', '.join(fields)
+    body = ''.join('    self.{0} = {0}\n'.format(field) for field in fields)
+    namespace = {}
+    exec('def __init__(self, {}):\n{}'.format(args, body or '    pass\n'),
+         namespace)
+
+    def _make(cls, values):
+        return cls(*values)
+
+    def __repr__(self):
+        return '{}({})'.format(name, ', '.join(
+            '{}={!r}'.format(field, getattr(self, field))
+            for field in fields))
+
+    def __eq__(self, other):
+        return (type(other) is type(self) and
+                all(getattr(self, field) == getattr(other, field)
+                    for field in fields))
+
+    def __iter__(self):
+        return (getattr(self, field) for field in fields)
+
+    return type(name, (object,), {
+        '__slots__': fields, '__init__': namespace['__init__'],
+        '_make': classmethod(_make), '_fields': fields,
+        '__repr__': __repr__, '__eq__': __eq__, '__hash__': None,
+        '__iter__': __iter__})
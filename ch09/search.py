@@ -0,0 +1,71 @@
+import re
+
+from sqlalchemy import DDL, false
+from sqlalchemy.sql import column, select, table
+
+
+# External-content FTS5 index over cookies.cookie_name: the index stores
+# only tokens and reads names back from cookies by rowid. The prefix
+# option keeps two- and three-letter prefix indexes so type-ahead queries
+# do not scan the whole term list.
+cookies_fts = table('cookies_fts', column('rowid'), column('cookie_name'),
+                    column('rank'), column('cookies_fts'))
+
+SEARCH_DDL = [
+    DDL("CREATE VIRTUAL TABLE IF NOT EXISTS cookies_fts USING fts5("
+        "cookie_name, content='cookies', content_rowid='cookie_id', "
+        "prefix='2 3')"),
+    DDL("CREATE TRIGGER IF NOT EXISTS cookies_fts_insert "
+        "AFTER INSERT ON cookies BEGIN "
+        "INSERT INTO cookies_fts (rowid, cookie_name) "
+        "VALUES (new.cookie_id, new.cookie_name); END"),
+    # Stock changes bump quantity and version_id on every shipment; only
+    # a rename needs to touch the index.
+    DDL("CREATE TRIGGER IF NOT EXISTS cookies_fts_update "
+        "AFTER UPDATE OF cookie_name ON cookies BEGIN "
+        "INSERT INTO cookies_fts (cookies_fts, rowid, cookie_name) "
+        "VALUES ('delete', old.cookie_id, old.cookie_name); "
+        "INSERT INTO cookies_fts (rowid, cookie_name) "
+        "VALUES (new.cookie_id, new.cookie_name); END"),
+    DDL("CREATE TRIGGER IF NOT EXISTS cookies_fts_delete "
+        "AFTER DELETE ON cookies BEGIN "
+        "INSERT INTO cookies_fts (cookies_fts, rowid, cookie_name) "
+        "VALUES ('delete', old.cookie_id, old.cookie_name); END"),
+]
+
+_TERM = re.compile(r'\w+', re.UNICODE)
+
+
+def install(conn):
+    """Create the index and its triggers if missing, then rebuild it from
+    the rows already in cookies."""
+    for ddl in SEARCH_DDL:
+        conn.execute(ddl)
+    rebuild(conn)
+
+
+def rebuild(conn):
+    conn.execute(cookies_fts.insert().values(cookies_fts='rebuild'))
+
+
+def match_expression(text, prefix=True):
+    """Turn free text into an FTS5 query matching every word. Words are
+    quoted so user input cannot inject query syntax; with ``prefix`` each
+    word also matches longer terms."""
+    terms = ['"{}"{}'.format(term, '*' if prefix else '')
+             for term in _TERM.findall(text)]
+    return ' '.join(terms)
+
+
+def matches(text, prefix=True, limit=None):
+    """A subquery of matching cookie_id values with their bm25 rank, best
+    first. With ``limit`` only the best matches are kept."""
+    expression = match_expression(text, prefix)
+    s = select([cookies_fts.c.rowid.label('cookie_id'), cookies_fts.c.rank])
+    if expression:
+        s = s.where(cookies_fts.c.cookies_fts.match(expression))
+    else:
+        s = s.where(false())
+    if limit is not None:
+        s = s.order_by(cookies_fts.c.rank).limit(limit)
+    return s.alias('cookie_search')
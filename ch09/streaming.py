@@ -0,0 +1,66 @@
+from sqlalchemy import event
+
+
+def stream(query, batch_size=1000):
+    """Yield the results of ``query`` fetching ``batch_size`` rows at a
+    time and expunging what each batch loaded before fetching the next,
+    so the session's identity map holds one batch at most.
+
+    Pending changes are flushed before each batch is expunged, so objects
+    the loop adds or changes do not pile up; objects consumed earlier
+    come back detached. Objects the
+    session held before the stream started stay in it, as does the last
+    batch when the loop stops early. The loading limits of
+    Query.yield_per() apply: no collection eager loading."""
+    session = query.session
+    query = query.yield_per(batch_size)
+    loaded = []
+
+    def collect(session, state):
+        loaded.append(state)
+
+    def release():
+        if not loaded:
+            return
+        if session.new or session.dirty or session.deleted:
+            session.flush()
+        # Everything the batch loaded is listed, so there is nothing for
+        # expunge()'s per-object cascade to find; detach them in one go.
+        session._expunge_states([state for state in loaded
+                                 if state.session_id == session.hash_key])
+        del loaded[:]
+
+    # What Query.__iter__() does, short of handing the result to the
+    # loader, which here goes through _ReleasingResult.
+    context = query._compile_context()
+    context.statement.use_labels = True
+    if query._autoflush and not query._populate_existing:
+        session._autoflush()
+    conn = query._get_bind_args(context, query._connection_from_session,
+                                close_with_result=True)
+    event.listen(session, 'loaded_as_persistent', collect, raw=True)
+    result = conn.execute(context.statement, query._params)
+    try:
+        for obj in query.instances(_ReleasingResult(result, release),
+                                   context):
+            yield obj
+        release()
+    finally:
+        event.remove(session, 'loaded_as_persistent', collect)
+        result.close()
+
+
+class _ReleasingResult(object):
+    """Passes a result through, releasing the last batch before each
+    fetch of the next one."""
+
+    def __init__(self, result, release):
+        self._result = result
+        self._release = release
+
+    def fetchmany(self, size=None):
+        self._release()
+        return self._result.fetchmany(size)
+
+    def __getattr__(self, name):
+        return getattr(self._result, name)
@@ -1,19 +1,31 @@
+import asyncio
+import os
+import shutil
+import tempfile
+import threading
 import unittest
 
-from decimal import Decimal
+import mock
+from sqlalchemy import exc
+from sqlalchemy.orm.exc import StaleDataError
 
-from db import prep_db, dal
+from db import (Cookie, DataAccessLayer, InventoryMovement, LineItem, Order,
+                prep_db, dal)
 
-from app import get_orders_by_customer
+import app
+from app import (InsufficientInventory, get_order_graphs,
+                 get_orders_by_customer, get_orders_by_customers,
+                 iter_orders_by_customer, order_graph_query_count, ship_it)
+from money import Cents
 
 
 class TestApp(unittest.TestCase):
     cookie_orders = [(1, u'cookiemon', u'111-111-1111')]
     cookie_details = [
         (1, u'cookiemon', u'111-111-1111',
-            u'dark chocolate chip', 2, Decimal('1.00')),
+            u'dark chocolate chip', 2, Cents(100)),
         (1, u'cookiemon', u'111-111-1111',
-            u'oatmeal raisin', 12, Decimal('3.00'))]
+            u'oatmeal raisin', 12, Cents(300))]
 
     @classmethod
     def setUpClass(cls):
@@ -101,3 +113,423 @@ class TestApp(unittest.TestCase):
     def test_orders_by_customer_unshipped_only_details(self):
         results = get_orders_by_customer('cookiemon', False, True)
         self.assertEqual(results, self.cookie_details)
+
+    def test_orders_by_customer_query_reused(self):
+        query = dal.orders_by_customer_query(True, True)
+        self.assertIs(dal.orders_by_customer_query(False, True), query)
+        self.assertIsNot(dal.orders_by_customer_query(None, True), query)
+
+    def test_orders_by_customer_baked_once(self):
+        get_orders_by_customer('cookiemon', False, True)
+        baked = len(dal.orders_by_customer_query(False, True)._bakery)
+        get_orders_by_customer('cakeeater', True, True)
+        self.assertEqual(
+            len(dal.orders_by_customer_query(False, True)._bakery), baked)
+
+    def test_iter_orders_by_customer(self):
+        results = iter_orders_by_customer('cookiemon', details=True,
+                                          batch_size=1)
+        self.assertEqual(list(results), self.cookie_details)
+
+    def test_iter_orders_by_customer_early_stop(self):
+        results = iter_orders_by_customer('cookiemon', details=True,
+                                          batch_size=1)
+        self.assertEqual(next(results), self.cookie_details[0])
+        results.close()
+        self.assertEqual(get_orders_by_customer('cookiemon'),
+                         self.cookie_orders)
+
+    def test_orders_by_customers(self):
+        results = get_orders_by_customers(['cookiemon', 'cakeeater',
+                                           'bad name', 'cookiemon'])
+        self.assertEqual(results, {
+            'cookiemon': self.cookie_orders,
+            'cakeeater': [(2, u'cakeeater', u'222-222-2222')],
+            'bad name': []})
+
+    def test_orders_by_customers_chunked_details(self):
+        with mock.patch('app.MAX_NAMES_PER_QUERY', 1):
+            results = get_orders_by_customers(['cookiemon', 'bad name'],
+                                              False, True)
+        self.assertEqual(results, {'cookiemon': self.cookie_details,
+                                   'bad name': []})
+
+    def test_orders_by_customers_shipped_only(self):
+        results = get_orders_by_customers(['cookiemon', 'cakeeater'], True)
+        self.assertEqual(results, {'cookiemon': [], 'cakeeater': []})
+
+    def test_orders_by_customers_empty(self):
+        self.assertEqual(get_orders_by_customers([]), {})
+
+    def query_count(self):
+        return sum(stats['calls'] for stats in dal.stats().values())
+
+    def render(self, orders):
+        return [(order.order_id, [(line_item.cookie.cookie_name,
+                                   line_item.quantity)
+                                  for line_item in order.line_items])
+                for order in orders]
+
+    def test_order_graphs(self):
+        for strategy in ('selectin', 'joined', 'subquery'):
+            dal.session.expunge_all()
+            dal.statement_stats.reset()
+            orders = get_order_graphs([2, 1, 2, 3], strategy)
+            self.assertEqual(self.render(orders), [
+                (1, [(u'dark chocolate chip', 2), (u'oatmeal raisin', 12)]),
+                (2, [(u'dark chocolate chip', 24), (u'oatmeal raisin', 6)])])
+            self.assertEqual(self.query_count(),
+                             order_graph_query_count(2, strategy))
+
+    def test_order_graphs_chunked(self):
+        with mock.patch('app.ORDER_GRAPH_CHUNK', 1):
+            dal.statement_stats.reset()
+            orders = get_order_graphs([1, 2], 'selectin')
+            self.assertEqual(len(self.render(orders)), 2)
+            self.assertEqual(self.query_count(),
+                             order_graph_query_count(2, 'selectin'))
+        self.assertEqual(order_graph_query_count(2, 'selectin'), 2)
+
+    def test_order_graphs_empty(self):
+        self.assertEqual(get_order_graphs([]), [])
+
+    def test_order_graphs_bad_strategy(self):
+        with self.assertRaises(ValueError):
+            get_order_graphs([1], 'lazy')
+
+
+class TestReplicaRouting(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.dal = DataAccessLayer()
+        self.dal.conn_string = self.url('primary')
+        self.dal.replica_strings = [self.url('replica1'),
+                                    self.url('replica2')]
+        self.dal.connect()
+        session = self.dal.Session()
+        prep_db(session)
+        session.close()
+        self.dal.session = self.dal.Session()
+        self.patch = mock.patch('app.dal', self.dal)
+        self.patch.start()
+
+    def tearDown(self):
+        self.patch.stop()
+        self.dal.session.close()
+        for engine in [self.dal.engine] + self.dal.replicas:
+            engine.dispose()
+        shutil.rmtree(self.tmpdir)
+
+    def url(self, name):
+        return 'sqlite:///' + os.path.join(self.tmpdir, name + '.db')
+
+    def test_reads_go_to_replicas(self):
+        with self.assertRaises(exc.OperationalError):
+            get_orders_by_customer('cookiemon')
+        self.dal.session.rollback()
+        self.dal.sync_replicas()
+        self.assertEqual(get_orders_by_customer('cookiemon'),
+                         TestApp.cookie_orders)
+
+    def test_read_your_writes(self):
+        self.dal.sync_replicas()
+        order = self.dal.session.query(Order).get(1)
+        order.shipped = True
+        self.dal.session.flush()
+        self.assertEqual(get_orders_by_customer('cookiemon', True),
+                         TestApp.cookie_orders)
+        self.dal.session.commit()
+        self.assertEqual(get_orders_by_customer('cookiemon', True), [])
+        self.dal.session.read_your_writes = True
+        self.assertEqual(get_orders_by_customer('cookiemon', True),
+                         TestApp.cookie_orders)
+
+    def test_text_write(self):
+        self.dal.sync_replicas()
+        self.dal.session.execute('UPDATE orders SET shipped = 1 '
+                                 'WHERE order_id = 1')
+        self.assertEqual(get_orders_by_customer('cookiemon', True),
+                         TestApp.cookie_orders)
+        self.dal.session.commit()
+        for engine in [self.dal.engine] + self.dal.replicas:
+            self.assertEqual(engine.scalar(
+                'SELECT shipped FROM orders WHERE order_id = 1'),
+                engine is self.dal.engine)
+
+    def test_round_robin(self):
+        picked = [self.dal.pick_replica() for _ in range(4)]
+        replica1, replica2 = self.dal.replicas
+        self.assertEqual(picked, [replica1, replica2, replica1, replica2])
+
+    def test_least_busy(self):
+        self.dal.replica_strategy = 'least_busy'
+        replica1, replica2 = self.dal.replicas
+        conn = replica1.connect()
+        self.assertIs(self.dal.pick_replica(), replica2)
+        conn.close()
+        self.assertIs(self.dal.pick_replica(), replica1)
+
+
+class TestSessionScope(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.dal = DataAccessLayer(session_pool_size=2)
+        self.dal.conn_string = 'sqlite:///' + os.path.join(self.tmpdir,
+                                                            'scope.db')
+        self.dal.connect()
+        with self.dal.session_scope() as session:
+            prep_db(session)
+        self.dal.reset_session_stats()
+        self.patch = mock.patch('app.dal', self.dal)
+        self.patch.start()
+
+    def tearDown(self):
+        self.patch.stop()
+        self.dal.engine.dispose()
+        shutil.rmtree(self.tmpdir)
+
+    def test_outside_scope(self):
+        with self.assertRaises(RuntimeError):
+            get_orders_by_customer('cookiemon')
+
+    def test_app_in_scope(self):
+        with self.dal.session_scope():
+            self.assertEqual(get_orders_by_customer('cookiemon'),
+                             TestApp.cookie_orders)
+            self.assertEqual(self.dal.session_stats()['live'], 1)
+        self.assertEqual(self.dal.session_stats()['live'], 0)
+
+    def test_nested_scope_shares_session(self):
+        with self.dal.session_scope() as outer:
+            with self.dal.session_scope() as inner:
+                self.assertIs(inner, outer)
+
+    def test_commit_and_rollback(self):
+        with self.dal.session_scope() as session:
+            session.query(Order).get(1).shipped = True
+        with self.assertRaises(ZeroDivisionError):
+            with self.dal.session_scope() as session:
+                session.query(Order).get(2).shipped = True
+                1 / 0
+        with self.dal.session_scope() as session:
+            self.assertEqual(
+                [order.shipped for order in
+                 session.query(Order).order_by(Order.order_id)],
+                [True, False])
+
+    def test_sessions_reused_and_cleared(self):
+        for _ in range(3):
+            with self.dal.session_scope() as session:
+                self.assertEqual(len(session.identity_map), 0)
+                orders = session.query(Order).all()
+                self.assertEqual(len(orders), 2)
+                self.assertEqual(
+                    self.dal.session_stats()['identity_map_sizes'], [2])
+        stats = self.dal.session_stats()
+        self.assertEqual((stats['created'], stats['reused']), (0, 3))
+        self.assertEqual((stats['live'], stats['pooled']), (0, 1))
+
+    def test_thread_own_session(self):
+        entered, release = threading.Event(), threading.Event()
+        sessions = []
+
+        def worker():
+            with self.dal.session_scope() as session:
+                sessions.append(session)
+                entered.set()
+                release.wait(5)
+
+        thread = threading.Thread(target=worker)
+        thread.start()
+        entered.wait(5)
+        with self.dal.session_scope() as session:
+            self.assertIsNot(session, sessions[0])
+            self.assertEqual(self.dal.session_stats()['live'], 2)
+        release.set()
+        thread.join()
+        self.assertEqual(self.dal.session_stats()['pooled'], 2)
+
+    def test_task_own_session(self):
+        async def lookup(started, release):
+            with self.dal.session_scope() as session:
+                started.set()
+                await release.wait()
+                return session
+
+        async def main():
+            started = [asyncio.Event(), asyncio.Event()]
+            release = asyncio.Event()
+            tasks = [asyncio.ensure_future(lookup(event, release))
+                     for event in started]
+            for event in started:
+                await event.wait()
+            release.set()
+            return await asyncio.gather(*tasks)
+
+        first, second = asyncio.run(main())
+        self.assertIsNot(first, second)
+
+
+class ShipItTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.dal = DataAccessLayer()
+        self.dal.conn_string = 'sqlite:///' + os.path.join(self.tmpdir,
+                                                            'ship.db')
+        self.dal.connect()
+        with self.dal.session_scope() as session:
+            prep_db(session)
+        self.patch = mock.patch('app.dal', self.dal)
+        self.patch.start()
+
+    def tearDown(self):
+        self.patch.stop()
+        self.dal.engine.dispose()
+        shutil.rmtree(self.tmpdir)
+
+    def stock(self):
+        with self.dal.session_scope() as session:
+            return [(cookie.quantity, cookie.version_id) for cookie in
+                    session.query(Cookie).order_by(Cookie.cookie_id)]
+
+    def restock(self, quantity=50):
+        with self.dal.session_scope() as session:
+            for cookie in session.query(Cookie):
+                cookie.quantity = quantity
+
+
+class TestShipIt(ShipItTestCase):
+
+    def test_ship_it(self):
+        self.restock()
+        ship_it(1)
+        self.assertEqual(self.stock(), [(48, 3), (50, 2), (38, 3)])
+        with self.dal.session_scope() as session:
+            self.assertTrue(session.query(Order).get(1).shipped)
+
+    def test_shortfall(self):
+        with self.assertRaises(InsufficientInventory) as raised:
+            ship_it(1)
+        self.assertEqual(raised.exception.shortfalls,
+                         [(1, u'dark chocolate chip', 1, 2)])
+        self.assertEqual(self.stock(), [(1, 1), (24, 1), (100, 1)])
+
+    def test_assigned_session(self):
+        self.restock()
+        self.dal.session = self.dal.Session()
+        try:
+            ship_it(1)
+        finally:
+            self.dal.session.close()
+        self.assertEqual(self.stock(), [(48, 3), (50, 2), (38, 3)])
+        with self.dal.session_scope() as session:
+            self.assertTrue(session.query(Order).get(1).shipped)
+
+    def test_conflict_retried(self):
+        self.restock()
+        real_ship = app._ship
+        calls = []
+
+        def racing_ship(session, order_id):
+            real_ship(session, order_id)
+            if not calls:
+                cookies = Cookie.__table__
+                self.dal.engine.execute(cookies.update().where(
+                    cookies.c.cookie_id == 1).values(
+                        quantity=cookies.c.quantity - 1,
+                        version_id=cookies.c.version_id + 1))
+            calls.append(order_id)
+
+        with mock.patch('app._ship', racing_ship):
+            ship_it(1)
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(self.dal.transaction_stats['retries'], 1)
+        self.assertEqual(self.stock()[0], (47, 4))
+
+    def test_conflict_gives_up(self):
+        self.restock()
+
+        def always_stale(session, order_id):
+            app._ship(session, order_id)
+            cookies = Cookie.__table__
+            self.dal.engine.execute(cookies.update().values(
+                version_id=cookies.c.version_id + 1))
+
+        with self.assertRaises(StaleDataError):
+            self.dal.run_in_transaction(
+                lambda session: always_stale(session, 1), attempts=2,
+                backoff=0)
+        self.assertEqual(self.dal.transaction_stats['retries'], 1)
+
+    def test_no_retry_inside_scope(self):
+        with self.dal.session_scope():
+            with self.assertRaises(RuntimeError):
+                ship_it(1)
+
+
+class TestInventoryLedger(ShipItTestCase):
+
+    def setUp(self):
+        super(TestInventoryLedger, self).setUp()
+        self.dal.inventory_ledger = True
+
+    def ledger(self):
+        with self.dal.session_scope() as session:
+            return [(movement.cookie_id, movement.quantity, movement.order_id)
+                    for movement in session.query(InventoryMovement).order_by(
+                        InventoryMovement.movement_id)]
+
+    def derived(self):
+        with self.dal.session_scope() as session:
+            return [(cookie.quantity, cookie.stock) for cookie in
+                    session.query(Cookie).order_by(Cookie.cookie_id)]
+
+    def test_ship_it(self):
+        self.restock()
+        ship_it(1)
+        self.assertEqual(self.derived(), [(50, 48), (50, 50), (50, 38)])
+        self.assertEqual(self.ledger(), [(1, -2, 1), (3, -12, 1)])
+        self.assertEqual(self.stock(), [(50, 2), (50, 2), (50, 2)])
+        with self.dal.session_scope() as session:
+            self.assertTrue(session.query(Order).get(1).shipped)
+
+    def test_shortfall(self):
+        with self.assertRaises(InsufficientInventory) as raised:
+            ship_it(1)
+        self.assertEqual(raised.exception.shortfalls,
+                         [(1, u'dark chocolate chip', 1, 2)])
+        self.assertEqual(self.ledger(), [])
+
+    def test_missing_cookie(self):
+        self.restock()
+        with self.dal.session_scope() as session:
+            session.add(LineItem(order_id=2, cookie_id=4, quantity=6,
+                                 extended_cost=6.00))
+        with self.assertRaises(InsufficientInventory) as raised:
+            ship_it(2)
+        self.assertEqual(raised.exception.shortfalls, [(4, None, None, 6)])
+        self.assertEqual(self.ledger(), [])
+
+    def test_compact_inventory(self):
+        self.restock()
+        ship_it(1)
+        self.assertEqual(self.dal.compact_inventory(), 2)
+        self.assertEqual(self.ledger(), [])
+        self.assertEqual(self.derived(), [(48, 48), (50, 50), (38, 38)])
+        self.assertEqual(self.stock(), [(48, 3), (50, 2), (38, 3)])
+        self.assertEqual(self.dal.compact_inventory(), 0)
+
+    def test_hybrids_use_derived_stock(self):
+        self.restock(12)
+        with self.dal.session_scope() as session:
+            session.add(InventoryMovement(cookie_id=2, quantity=-5))
+        with self.dal.session_scope() as session:
+            low = session.query(Cookie.cookie_id).filter(
+                Cookie.bake_more(10)).all()
+            self.assertEqual(low, [(2,)])
+            cookie = session.query(Cookie).get(2)
+            self.assertTrue(cookie.bake_more(10))
+            self.assertEqual(cookie.inventory_value, 7 * cookie.unit_cost)
@@ -0,0 +1,130 @@
+import unittest
+
+import mock
+from sqlalchemy import Column, Integer, event
+from sqlalchemy.ext.declarative import declarative_base
+
+from db import Cookie, DataAccessLayer, LineItem, Order, User, prep_db
+from app import get_cookies
+from bulk import flush_inserts
+
+
+class TestFlushInserts(unittest.TestCase):
+
+    def setUp(self):
+        self.dal = DataAccessLayer()
+        self.dal.conn_string = 'sqlite:///:memory:'
+        self.dal.connect()
+        self.dal.session = self.session = self.dal.Session()
+        prep_db(self.session)
+        self.session.commit()
+        self.dal.statement_stats.reset()
+
+    def tearDown(self):
+        self.session.close()
+
+    def inserts(self):
+        calls = {}
+        for key, stats in self.dal.stats().items():
+            if key.startswith('INSERT'):
+                table = key.split(' (')[0]
+                calls[table] = calls.get(table, 0) + stats['calls']
+        return calls
+
+    def cookies(self, count):
+        return [Cookie(cookie_name='cookie {}'.format(i), quantity=i,
+                       unit_cost='0.50') for i in range(count)]
+
+    def test_keys_filled(self):
+        cookies = self.cookies(5)
+        self.session.add_all(cookies)
+        self.assertEqual(flush_inserts(self.session), cookies)
+        self.assertEqual([cookie.cookie_id for cookie in cookies],
+                         [4, 5, 6, 7, 8])
+        self.assertEqual(set(cookie.version_id for cookie in cookies), {1})
+        self.assertEqual(self.inserts(), {'INSERT INTO cookies': 1})
+        self.assertFalse(self.session.new or self.session.dirty)
+        self.assertIs(self.session.query(Cookie).get(6), cookies[2])
+        self.assertEqual(cookies[2].stock, 2)
+
+    def test_batches(self):
+        self.session.add_all(self.cookies(5))
+        flush_inserts(self.session, batch_size=2)
+        self.assertEqual(sum(self.inserts().values()), 3)
+
+    def test_object_graph(self):
+        user = User(username='u1', email_address='u1@c.com', phone='1',
+                    password='p')
+        cookies = self.cookies(2)
+        order = Order(order_id=10, user=user)
+        items = [LineItem(order=order, cookie=cookie, quantity=1,
+                          extended_cost='0.50') for cookie in cookies]
+        items.append(LineItem(order=order, cookie_id=1, quantity=2,
+                              extended_cost='1.50'))
+        self.session.add(order)
+        self.assertEqual(len(flush_inserts(self.session)), 7)
+        self.assertEqual(len(self.inserts()), 4)
+        self.assertIsNotNone(user.created_on)
+        self.assertIs(order.shipped, False)
+        self.assertEqual([(item.order_id, item.cookie_id) for item in items],
+                         [(10, 4), (10, 5), (10, 1)])
+        self.session.commit()
+        self.assertEqual(self.session.query(LineItem).filter(
+            LineItem.order_id == 10).count(), 3)
+
+    def test_rollback(self):
+        cookies = self.cookies(2)
+        self.session.add_all(cookies)
+        flush_inserts(self.session)
+        self.session.rollback()
+        self.assertNotIn(cookies[0], self.session)
+        self.assertEqual(self.session.query(Cookie).count(), 3)
+
+    def test_without_returning(self):
+        cookies = self.cookies(3)
+        self.session.add_all(cookies)
+        with mock.patch('bulk.supports_returning', return_value=False):
+            self.assertEqual(flush_inserts(self.session), [])
+        self.assertEqual([cookie.cookie_id for cookie in cookies], [4, 5, 6])
+        self.assertEqual(self.inserts(), {'INSERT INTO cookies': 3})
+
+    def test_second_level_cache(self):
+        self.dal.enable_second_level_cache()
+        with mock.patch('app.dal', self.dal):
+            self.assertEqual(len(get_cookies()), 3)
+            self.session.add_all(self.cookies(2))
+            self.dal.flush_inserts()
+            self.assertEqual(len(get_cookies()), 5)
+            self.session.add_all(self.cookies(1))
+            flush_inserts(self.session)
+            self.assertEqual(len(get_cookies()), 6)
+
+    def test_insert_listeners(self):
+        seen = []
+
+        def before_insert(mapper, connection, target):
+            seen.append(target)
+
+        cookies = self.cookies(2)
+        self.session.add_all(cookies)
+        event.listen(Cookie, 'before_insert', before_insert)
+        try:
+            self.assertEqual(flush_inserts(self.session), [])
+        finally:
+            event.remove(Cookie, 'before_insert', before_insert)
+        self.assertEqual(seen, cookies)
+        self.assertEqual(self.inserts(), {'INSERT INTO cookies': 2})
+
+    def test_own_version_counter(self):
+        class Tally(declarative_base()):
+            __tablename__ = 'tallies'
+            tally_id = Column(Integer, primary_key=True)
+            version = Column(Integer, nullable=False)
+            __mapper_args__ = {'version_id_col': version,
+                               'version_id_generator': False}
+
+        Tally.__table__.create(self.session.connection())
+        tally = Tally(version=7)
+        self.session.add(tally)
+        self.assertEqual(flush_inserts(self.session), [])
+        self.assertEqual((tally.tally_id, tally.version), (1, 7))
@@ -0,0 +1,170 @@
+import unittest
+
+import mock
+
+from db import (Cookie, DataAccessLayer, InventoryMovement, LineItem, Order,
+                User, prep_db)
+from app import get_cookie, get_cookies, get_orders_by_customer
+
+
+class TestWriteInvalidation(unittest.TestCase):
+
+    def setUp(self):
+        self.dal = DataAccessLayer()
+        self.dal.conn_string = 'sqlite:///:memory:'
+        self.dal.connect()
+        self.dal.session = self.dal.Session()
+        prep_db(self.dal.session)
+        self.patch = mock.patch('app.dal', self.dal)
+        self.patch.start()
+        self.cache = self.dal.enable_result_cache()
+        for cust_name in ('cookiemon', 'cakeeater'):
+            for details in (False, True):
+                get_orders_by_customer(cust_name, details=details)
+        self.dal.session.commit()
+        self.cache.reset_stats()
+
+    def tearDown(self):
+        self.patch.stop()
+        self.dal.session.close()
+
+    def cached(self, cust_name):
+        return sorted(key[2] for key in self.cache._entries
+                      if key[0] == cust_name)
+
+    def test_hit(self):
+        get_orders_by_customer('cookiemon')
+        self.assertEqual(self.cache.stats['hits'], 1)
+
+    def test_flush_invalidates_only_that_customer(self):
+        order = self.dal.session.query(Order).get(1)
+        order.shipped = True
+        self.dal.session.commit()
+        self.assertEqual(self.cached('cookiemon'), [])
+        self.assertEqual(self.cached('cakeeater'), [False, True])
+        self.assertEqual(get_orders_by_customer('cookiemon', True),
+                         [(1, u'cookiemon', u'111-111-1111')])
+
+    def test_new_line_item(self):
+        order = self.dal.session.query(Order).get(2)
+        order.line_items.append(LineItem(cookie_id=2, quantity=1,
+                                         extended_cost=0.25))
+        self.dal.session.commit()
+        self.assertEqual(self.cached('cakeeater'), [])
+        self.assertEqual(self.cached('cookiemon'), [False, True])
+
+    def test_phone_change(self):
+        user = self.dal.session.query(User).filter_by(
+            username='cakeeater').one()
+        user.phone = '444-444-4444'
+        self.dal.session.commit()
+        self.assertEqual(self.cached('cakeeater'), [])
+        self.assertEqual(self.cached('cookiemon'), [False, True])
+
+    def test_bulk_update(self):
+        self.dal.session.query(Order).filter(Order.user_id == 1).update(
+            {Order.shipped: True}, synchronize_session=False)
+        self.assertEqual(self.cached('cookiemon'), [])
+        self.assertEqual(self.cached('cakeeater'), [False, True])
+
+    def test_delete_line_item(self):
+        order = self.dal.session.query(Order).get(2)
+        self.dal.session.delete(order.line_items[0])
+        self.dal.session.commit()
+        self.assertEqual(self.cached('cakeeater'), [])
+        self.assertEqual(self.cached('cookiemon'), [False, True])
+
+    def test_delete_cookie_clears(self):
+        self.dal.session.delete(self.dal.session.query(Cookie).get(1))
+        self.dal.session.commit()
+        self.assertEqual(len(self.cache), 0)
+
+    def test_unwatched_delete_keeps_entries(self):
+        self.dal.session.execute(InventoryMovement.__table__.delete())
+        self.dal.session.commit()
+        self.assertEqual(len(self.cache), 4)
+
+
+class TestSecondLevelCache(unittest.TestCase):
+
+    def setUp(self):
+        self.dal = DataAccessLayer()
+        self.dal.conn_string = 'sqlite:///:memory:'
+        self.dal.connect()
+        with self.dal.session_scope() as session:
+            prep_db(session)
+        self.patch = mock.patch('app.dal', self.dal)
+        self.patch.start()
+        self.cache = self.dal.enable_second_level_cache()
+        with self.dal.session_scope():
+            get_cookies()
+        self.cache.reset_stats()
+        self.dal.statement_stats.reset()
+
+    def tearDown(self):
+        self.patch.stop()
+
+    def queries(self):
+        return sum(stats['calls'] for stats in self.dal.stats().values())
+
+    def test_catalog_skips_database(self):
+        with self.dal.session_scope():
+            cookies = get_cookies()
+            self.assertIs(get_cookie(2), cookies[1])
+            self.assertEqual([cookie.cookie_id for cookie in cookies],
+                             [1, 2, 3])
+        with self.dal.session_scope():
+            self.assertEqual(get_cookie(1).cookie_name, 'dark chocolate chip')
+        self.assertEqual(self.queries(), 0)
+        self.assertEqual(self.cache.stats['hits'], 3)
+
+    def test_sessions_get_their_own_copies(self):
+        with self.dal.session_scope() as session:
+            first = get_cookie(1)
+            first.quantity = 0
+            self.assertIn(first, session.dirty)
+            session.rollback()
+        with self.dal.session_scope():
+            second = get_cookie(1)
+            self.assertIsNot(second, first)
+            self.assertEqual(second.quantity, 1)
+
+    def test_flush_invalidates_row(self):
+        with self.dal.session_scope() as session:
+            get_cookie(1).quantity = 10
+            session.flush()
+            self.assertNotIn((Cookie, (1,)), self.cache._entries)
+            self.assertEqual(get_cookie(1).quantity, 10)
+            self.assertEqual(len(self.cache), 2)
+        with self.dal.session_scope():
+            self.assertEqual(get_cookie(1).quantity, 10)
+            get_cookies()
+        self.assertEqual(self.cache.stats['misses'], 3)
+        with self.dal.session_scope():
+            get_cookies()
+        self.assertEqual(self.cache.stats['hits'], 2)
+
+    def test_rolled_back_flush_is_not_cached(self):
+        with self.assertRaises(ZeroDivisionError):
+            with self.dal.session_scope() as session:
+                get_cookie(1).quantity = 10
+                session.flush()
+                get_cookies()
+                1 / 0
+        with self.dal.session_scope():
+            self.assertEqual(get_cookie(1).quantity, 1)
+
+    def test_new_cookie_refreshes_listing(self):
+        with self.dal.session_scope() as session:
+            session.add(Cookie(cookie_name='sugar', cookie_sku='S01',
+                               quantity=1, unit_cost=0.1))
+        with self.dal.session_scope():
+            self.assertEqual(len(get_cookies()), 4)
+
+    def test_bounded(self):
+        self.assertEqual(len(self.cache), 3)
+        self.cache.max_entries = 2
+        with self.dal.session_scope() as session:
+            session.query(Cookie).get(3)
+        self.assertEqual(len(self.cache), 2)
+        self.assertEqual(self.cache.stats['evictions'], 1)
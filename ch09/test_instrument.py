@@ -0,0 +1,59 @@
+import unittest
+
+import mock
+
+from db import DataAccessLayer, User, prep_db
+from app import get_orders_by_customer
+from instrument import REDACTED
+
+
+class TestStatementStats(unittest.TestCase):
+
+    def setUp(self):
+        self.dal = DataAccessLayer()
+        self.dal.conn_string = 'sqlite:///:memory:'
+        self.dal.connect()
+        self.dal.session = self.dal.Session()
+        prep_db(self.dal.session)
+        self.patch = mock.patch('app.dal', self.dal)
+        self.patch.start()
+        self.dal.statement_stats.reset()
+
+    def tearDown(self):
+        self.patch.stop()
+        self.dal.session.close()
+
+    def find(self, fragment):
+        matches = [stats for key, stats in self.dal.stats().items()
+                   if fragment in key]
+        self.assertEqual(len(matches), 1)
+        return matches[0]
+
+    def test_query_calls(self):
+        get_orders_by_customer('cakeeater')
+        get_orders_by_customer('cookiemon')
+        self.assertEqual(self.find('FROM orders JOIN users')['calls'], 2)
+
+    def test_query_rows(self):
+        rows = get_orders_by_customer('cookiemon', details=True)
+        users = self.dal.session.query(User).all()
+        self.assertEqual(self.find('FROM orders JOIN users')['rows'],
+                         len(rows))
+        self.assertEqual(self.find('FROM users')['rows'], len(users))
+
+    def test_flush_redacts_password(self):
+        self.dal.session.add(User(username='u1', email_address='u1@c.com',
+                                  phone='1', password='secret'))
+        self.dal.session.flush()
+        user = self.dal.session.query(User).filter(
+            User.password == 'secret').one()
+        user.password = 'changed'
+        self.dal.session.commit()
+        params = self.find('INSERT INTO users')['last_parameters']
+        self.assertIn('u1', params)
+        self.assertIn(REDACTED, params)
+        self.assertNotIn('secret', params)
+        params = self.find('WHERE users.password')['last_parameters']
+        self.assertNotIn('secret', params)
+        params = self.find('UPDATE users SET password')['last_parameters']
+        self.assertNotIn('changed', params)
@@ -0,0 +1,56 @@
+import os
+import shutil
+import tempfile
+import unittest
+from decimal import Decimal
+
+from sqlalchemy import MetaData, Numeric, create_engine, func
+
+from db import Base, Cookie, DataAccessLayer, LineItem, prep_db
+from money import Cents
+
+
+class TestMoney(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.dal = DataAccessLayer()
+        self.dal.conn_string = 'sqlite:///' + os.path.join(self.tmpdir,
+                                                           'money.db')
+
+    def tearDown(self):
+        self.dal.engine.dispose()
+        shutil.rmtree(self.tmpdir)
+
+    def test_hybrid_in_sql(self):
+        self.dal.connect()
+        session = self.dal.Session()
+        prep_db(session)
+        values = session.query(Cookie.cookie_name, Cookie.inventory_value)
+        self.assertEqual(dict(values), {
+            u'dark chocolate chip': Cents(75), u'peanut butter': Cents(600),
+            u'oatmeal raisin': Cents(10000)})
+        total = session.query(func.sum(LineItem.extended_cost)).scalar()
+        self.assertEqual((total, str(total)), (Cents(2200), '22.00'))
+        session.close()
+
+    def test_migrate(self):
+        old = MetaData()
+        for table in Base.metadata.sorted_tables:
+            table.tometadata(old)
+        old.tables['cookies'].c.unit_cost.type = Numeric(12, 2)
+        old.tables['line_items'].c.extended_cost.type = Numeric(12, 2)
+        engine = create_engine(self.dal.conn_string)
+        old.create_all(engine)
+        engine.execute(old.tables['cookies'].insert(), [
+            {'cookie_name': 'chip', 'quantity': 1, 'version_id': 1,
+             'unit_cost': Decimal('0.29')}])
+        engine.dispose()
+
+        self.dal.connect()
+        self.assertEqual(self.dal.migrate_money(),
+                         ['cookies.unit_cost', 'line_items.extended_cost'])
+        self.assertEqual(self.dal.migrate_money(), [])
+        session = self.dal.Session()
+        self.assertEqual(session.query(Cookie).one().unit_cost, Cents(29))
+        session.close()
@@ -0,0 +1,52 @@
+import unittest
+from decimal import Decimal
+
+import mock
+from sqlalchemy import desc
+
+from db import Cookie, DataAccessLayer, prep_db
+from app import list_cookies
+from pagination import Keyset
+
+
+class TestKeyset(unittest.TestCase):
+
+    def setUp(self):
+        self.dal = DataAccessLayer()
+        self.dal.conn_string = 'sqlite:///:memory:'
+        self.dal.connect()
+        self.dal.session = self.dal.Session()
+        prep_db(self.dal.session)
+        self.dal.session.add_all([
+            Cookie(cookie_name='cookie {}'.format(i % 5), quantity=i % 3,
+                   unit_cost=Decimal('0.50')) for i in range(20)])
+        self.dal.session.commit()
+        self.patch = mock.patch('app.dal', self.dal)
+        self.patch.start()
+
+    def tearDown(self):
+        self.patch.stop()
+        self.dal.session.close()
+
+    def test_list_cookies(self):
+        pages, cursor = [], None
+        while True:
+            page = list_cookies(cursor, size=6)
+            pages.append(page.rows)
+            cursor = page.next_cursor
+            if cursor is None:
+                break
+        self.assertEqual([len(rows) for rows in pages], [6, 6, 6, 5])
+        self.assertEqual(sum(pages, []), self.dal.session.query(
+            Cookie).order_by(Cookie.quantity, Cookie.cookie_name,
+                             Cookie.cookie_id).all())
+
+    def test_descending(self):
+        keyset = Keyset(desc(Cookie.cookie_name), Cookie.cookie_id)
+        query = self.dal.session.query(Cookie.cookie_id, Cookie.cookie_name)
+        first = keyset.page(query, size=10)
+        second = keyset.page(query, first.next_cursor, size=10)
+        self.assertEqual(first.rows + second.rows, query.order_by(
+            Cookie.cookie_name.desc(), Cookie.cookie_id).limit(20).all())
+        with self.assertRaises(ValueError):
+            list_cookies(first.next_cursor)
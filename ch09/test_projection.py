@@ -0,0 +1,67 @@
+import unittest
+
+import mock
+from sqlalchemy.sql import bindparam
+
+from db import Cookie, DataAccessLayer, Order, User, prep_db
+from app import (CookieStock, OrderSummary, get_cookie_stock,
+                 get_order_summaries)
+from projection import projection
+
+
+class TestProjection(unittest.TestCase):
+
+    def setUp(self):
+        self.dal = DataAccessLayer()
+        self.dal.conn_string = 'sqlite:///:memory:'
+        self.dal.connect()
+        self.dal.session = self.dal.Session()
+        prep_db(self.dal.session)
+        self.patch = mock.patch('app.dal', self.dal)
+        self.patch.start()
+
+    def tearDown(self):
+        self.patch.stop()
+        self.dal.session.close()
+
+    def test_cookie_stock(self):
+        rows = get_cookie_stock()
+        self.assertEqual([tuple(row) for row in rows], [
+            (u'dark chocolate chip', 1), (u'peanut butter', 24),
+            (u'oatmeal raisin', 100)])
+        self.assertEqual(rows[0].cookie_name, u'dark chocolate chip')
+        self.assertIsInstance(rows[0], CookieStock.row_class)
+        self.assertFalse(hasattr(rows[0], '__dict__'))
+        self.assertEqual(len(self.dal.session.identity_map), 0)
+
+    def test_iter_batches(self):
+        query = self.dal.session.query(Cookie).order_by(Cookie.cookie_id)
+        self.assertEqual(list(CookieStock.iter(query, batch_size=2)),
+                         CookieStock.all(query))
+
+    def test_order_summaries(self):
+        self.assertEqual(get_order_summaries(), [
+            OrderSummary.row_class(1, u'cookiemon', False),
+            OrderSummary.row_class(2, u'cakeeater', False)])
+        self.assertEqual(get_order_summaries(True), [])
+
+    def test_namedtuple(self):
+        stock = projection('Stock', Cookie.cookie_name,
+                           Cookie.quantity.label('on_hand'),
+                           kind='namedtuple')
+        rows = stock.all(self.dal.session.query(Cookie).filter(
+            Cookie.quantity > 50))
+        self.assertEqual(rows, [(u'oatmeal raisin', 100)])
+        self.assertEqual(rows[0].on_hand, 100)
+
+    def test_query_params(self):
+        query = self.dal.session.query(User).filter(
+            User.username == bindparam('name')).params(name='cakeeater')
+        names = projection('Name', User.username).all(query)
+        self.assertEqual([row.username for row in names], [u'cakeeater'])
+
+    def test_fields_must_be_unique(self):
+        with self.assertRaises(ValueError):
+            projection('Ids', Order.user_id, User.user_id)
+        projection('Ids', Order.user_id,
+                   User.user_id.label('owner_id'))
@@ -0,0 +1,66 @@
+import unittest
+
+import mock
+
+from db import Cookie, DataAccessLayer, prep_db
+from app import search_cookies
+from search import match_expression
+
+
+class TestSearch(unittest.TestCase):
+
+    def setUp(self):
+        self.dal = DataAccessLayer()
+        self.dal.conn_string = 'sqlite:///:memory:'
+        self.dal.connect()
+        self.dal.session = self.dal.Session()
+        prep_db(self.dal.session)
+        self.dal.session.commit()
+        self.dal.enable_search()
+        self.patch = mock.patch('app.dal', self.dal)
+        self.patch.start()
+
+    def tearDown(self):
+        self.patch.stop()
+        self.dal.session.close()
+
+    def names(self, text, **kwargs):
+        return [cookie.cookie_name for cookie in search_cookies(text,
+                                                                **kwargs)]
+
+    def test_match_expression(self):
+        self.assertEqual(match_expression('Choc chip'), '"Choc"* "chip"*')
+        self.assertEqual(match_expression('"chip" OR', prefix=False),
+                         '"chip" "OR"')
+        self.assertEqual(self.names('" * )'), [])
+
+    def test_prefix(self):
+        self.assertEqual(self.names('choc'), [u'dark chocolate chip'])
+        self.assertEqual(self.names('rai oat'), [u'oatmeal raisin'])
+        self.assertEqual(self.names('chocolate raisin'), [])
+
+    def test_ranked(self):
+        self.dal.session.add(Cookie(cookie_name='chocolate',
+                                    quantity=1, unit_cost=1))
+        self.dal.session.commit()
+        self.assertEqual(self.names('chocolate'),
+                         [u'chocolate', u'dark chocolate chip'])
+        self.assertEqual(self.names('chocolate', limit=1), [u'chocolate'])
+
+    def test_kept_in_sync(self):
+        session = self.dal.session
+        cookie = session.query(Cookie).get(2)
+        cookie.cookie_name = 'chunky peanut'
+        session.commit()
+        self.assertEqual(self.names('chunky'), [u'chunky peanut'])
+        self.assertEqual(self.names('butter'), [])
+        cookie.quantity = 30
+        session.commit()
+        self.assertEqual(self.names('chunky'), [u'chunky peanut'])
+        session.delete(cookie)
+        session.commit()
+        self.assertEqual(self.names('peanut'), [])
+
+    def test_enable_again(self):
+        self.dal.enable_search()
+        self.assertEqual(self.names('oatmeal'), [u'oatmeal raisin'])
@@ -0,0 +1,83 @@
+import unittest
+
+import mock
+from sqlalchemy.sql import bindparam
+
+from db import Cookie, DataAccessLayer, prep_db
+from app import iter_cookies
+from streaming import stream
+
+
+class TestStream(unittest.TestCase):
+
+    def setUp(self):
+        self.dal = DataAccessLayer()
+        self.dal.conn_string = 'sqlite:///:memory:'
+        self.dal.connect()
+        self.dal.session = self.session = self.dal.Session()
+        prep_db(self.session)
+        self.session.add_all([
+            Cookie(cookie_name='cookie {}'.format(i), quantity=i,
+                   unit_cost='0.50') for i in range(17)])
+        self.session.commit()
+        self.session.expunge_all()
+        self.patch = mock.patch('app.dal', self.dal)
+        self.patch.start()
+
+    def tearDown(self):
+        self.patch.stop()
+        self.session.close()
+
+    def test_bounded_identity_map(self):
+        ids, sizes = [], []
+        for cookie in iter_cookies(batch_size=4):
+            ids.append(cookie.cookie_id)
+            sizes.append(len(self.session.identity_map))
+        self.assertEqual(ids, list(range(1, 21)))
+        self.assertEqual(max(sizes), 4)
+        self.assertEqual(len(self.session.identity_map), 0)
+
+    def test_changes_flushed(self):
+        query = self.session.query(Cookie).order_by(Cookie.cookie_id)
+        for cookie in stream(query, batch_size=3):
+            cookie.quantity += 1000
+        self.assertFalse(self.session.dirty)
+        self.assertEqual(self.session.query(Cookie).filter(
+            Cookie.quantity < 1000).count(), 0)
+
+    def test_autoflush(self):
+        self.session.add(Cookie(cookie_name='pending', quantity=1,
+                                unit_cost='0.50'))
+        query = self.session.query(Cookie)
+        self.assertEqual(len(list(stream(query, batch_size=3))),
+                         query.count())
+        self.assertFalse(self.session.new)
+
+    def test_added_objects_flushed(self):
+        query = self.session.query(Cookie).filter(Cookie.quantity < 100)
+        pending = []
+        for cookie in stream(query, batch_size=4):
+            self.session.add(Cookie(cookie_name=cookie.cookie_name + ' copy',
+                                    quantity=cookie.quantity + 100,
+                                    unit_cost='0.50'))
+            pending.append(len(self.session.new))
+        self.assertLessEqual(max(pending), 4)
+        self.session.commit()
+        self.assertEqual(self.session.query(Cookie).filter(
+            Cookie.cookie_name.like('% copy')).count(), 19)
+
+    def test_keeps_held_objects(self):
+        held = self.session.query(Cookie).get(2)
+        query = self.session.query(Cookie).filter(
+            Cookie.quantity >= bindparam('least')).params(least=24)
+        self.assertEqual([cookie.cookie_id for cookie in stream(query, 1)],
+                         [2, 3])
+        self.assertIn(held, self.session)
+        self.assertEqual(len(self.session.identity_map), 1)
+
+    def test_early_exit(self):
+        cookies = stream(self.session.query(Cookie), batch_size=5)
+        first = next(cookies)
+        cookies.close()
+        self.assertIn(first, self.session)
+        self.assertFalse(self.session.dispatch.loaded_as_persistent)